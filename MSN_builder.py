@@ -5,7 +5,8 @@ The MSN class defining the cell
 
 from neuron import h
 import numpy as np
-import json
+import morphology_cache
+import model_registry as registry
 
 # Distributions:
 '''
@@ -16,7 +17,7 @@ naf (den): (0.1 + 0.9/(1 + np.exp((x-60.0)/10.0)))
 
 def calculate_distribution(d3, dist, a4, a5,  a6,  a7, g8):
     '''
-    Used for setting the maximal conductance of a segment.
+    Used for setting the maximal conductance of segments.
     Scales the maximal conductance based on somatic distance and distribution type.
     
     Parameters:
@@ -25,12 +26,15 @@ def calculate_distribution(d3, dist, a4, a5,  a6,  a7, g8):
          1 sigmoidal, 
          2 exponential
          3 step function
-    dist = somatic distance of segment
+    dist = somatic distance of segment(s) (number or numpy array)
     a4-7 = distribution parameters 
     g8   = base conductance (similar to maximal conductance)
     
+    Returns the conductance of each segment (numpy array of the same shape as dist).
     '''
     
+    dist = np.asarray(dist, dtype=float)
+    
     if   d3 == 0: 
         value = a4 + a5*dist
     elif d3 == 1: 
@@ -38,13 +42,11 @@ def calculate_distribution(d3, dist, a4, a5,  a6,  a7, g8):
     elif d3 == 2: 
         value = a4 + a5*np.exp((dist-a6)/a7)
     elif d3 == 3:
-        if (dist > a6) and (dist < a7):
-            value = a4
-        else:
-            value = a5
+        value = np.where((dist > a6) & (dist < a7), a4, a5)
+    else:
+        raise ValueError('Distribution type {} is not recognised.\nThis should be 0, 1, 2 or 3.'.format(d3))
             
-    if value < 0:
-        value = 0
+    value = np.where(value < 0, 0, value)
         
     value = value*g8
     return value 
@@ -59,15 +61,15 @@ class MSN:
                         morphology=None,     \
                         variables=None,                                     \
                         section=None                                        ):
-        Import = h.Import3d_SWC_read()
-        Import.input(morphology)
-        imprt = h.Import3d_GUI(Import, 0)
-        imprt.instantiate(None)
+        # sections are copied from the (once parsed) morphology, so several
+        # independent cells can exist at the same time
+        self.sections = morphology_cache.instantiate(morphology)
         h.define_shape()
         # h.cao0_ca_ion = 2  # default in nrn
         h.celsius = 35
         self._create_sectionlists()
         self._set_nsegs(section=section)
+        self._create_segment_distances()
         self.v_init = -80
         
         self.dendritic_channels =   [
@@ -117,8 +119,8 @@ class MSN:
             for mech in self.dendritic_channels+["cadyn", "caldyn"]:
                 sec.insert(mech)
         
-        with open(params) as file:
-            par = json.load(file)
+        # parameter file is only read once per process
+        par = registry.load_params(params)
         
         # set passive parameters --------------------------------------------        
         for sec in self.allseclist:
@@ -207,25 +209,27 @@ class MSN:
     def _create_sectionlists(self):
         self.allsecnames = []
         self.allseclist  = h.SectionList()
-        for sec in h.allsec():
+        for sec in self.sections:
             self.allsecnames.append(sec.name())
             self.allseclist.append(sec=sec)
         self.nsomasec = 0
         self.somalist = h.SectionList()
-        for sec in h.allsec():
+        for sec in self.sections:
             if sec.name().find('soma') >= 0:
                 self.somalist.append(sec=sec)
                 if self.nsomasec == 0:
                     self.soma = sec
                 self.nsomasec += 1
         self.axonlist = h.SectionList()
-        for sec in h.allsec():
+        for sec in self.sections:
             if sec.name().find('axon') >= 0:
                 self.axonlist.append(sec=sec)
         self.dendlist = h.SectionList()
-        for sec in h.allsec():
+        for sec in self.sections:
             if sec.name().find('dend') >= 0:
                 self.dendlist.append(sec=sec)
+        # look-up of sections by name (instead of searching allseclist)
+        self.name2sec = {sec.name(): sec for sec in self.sections}
     
     
     def _set_nsegs(self, section=None, N=20):
@@ -252,18 +256,42 @@ class MSN:
     
                 
             
-    def distribute_channels(self, as1, as2, d3, a4, a5, a6, a7, g8):
+    def _create_segment_distances(self):
+        """ store all segments with their somatic distance (for distributing channels),
+        the distance of each section (middle) to the middle of the soma, and which
+        sections belong to which compartment type """
         h.distance(sec=self.soma)
         
+        self.segments = []
+        seg_secnames  = []
+        seg_dists     = []
         for sec in self.allseclist:
-            
-            # if right cellular compartment (axon, soma or dend)
-            if sec.name().find(as1) >= 0:
-                for seg in sec:
-                    dist = h.distance(seg.x, sec=sec)
-                    val = calculate_distribution(d3, dist, a4, a5, a6, a7, g8)
-                    cmd = 'seg.%s = %g' % (as2, val)
-                    exec(cmd)
+            for seg in sec:
+                self.segments.append(seg)
+                seg_secnames.append(sec.name())
+                seg_dists.append(h.distance(seg.x, sec=sec))
+        self.seg_secnames = np.array(seg_secnames)
+        self.seg_dists    = np.array(seg_dists)
+        self._compartment_idx = {}
+        
+        # sections (in the order of allseclist)
+        secnames = np.array(self.allsecnames)
+        self.sec_dists = np.array([h.distance(self.soma(0.5), sec(0.5)) for sec in self.allseclist])
+        self.sec_index = {name: i for i, name in enumerate(self.allsecnames)}
+        self.compartment_masks = {comp: np.char.startswith(secnames, comp) for comp in ['soma', 'dend', 'axon']}
+    
+    
+    def distribute_channels(self, as1, as2, d3, a4, a5, a6, a7, g8):
+        
+        # segments in the right cellular compartment (axon, soma or dend)
+        if as1 not in self._compartment_idx:
+            self._compartment_idx[as1] = np.flatnonzero(np.char.find(self.seg_secnames, as1) >= 0)
+        idx  = self._compartment_idx[as1]
+        vals = calculate_distribution(d3, self.seg_dists[idx], a4, a5, a6, a7, g8)
+        
+        # values are rounded to %g precision, as when they were set through hoc strings
+        for i, val in zip(idx.tolist(), vals.tolist()):
+            setattr(self.segments[i], as2, float('%g' % val))
                     
 
         
@@ -9,11 +9,14 @@ from neuron import h
 import sys
 sys.path.insert(0, '../')
 
-import json, pickle
+import pickle
 import numpy                as np
 import MSN_builder          as build 
 import common_functions     as use
 import modulation_lib       as modulate
+import transients           as tr
+from   online_recording import OnlineRecorder
+from   rng_streams      import JobStreams
 
 h.load_file('stdlib.hoc')
 h.load_file('import3d.hoc')
@@ -36,6 +39,7 @@ def run_model(cell_index, ci):
     tau         = 300
     conditions  = ['ACh+DA','ACh','DA','ctrl']
     c           = conditions[ci]
+    master_seed = 1000 # random numbers of each model and factor set are drawn from streams derived from this seed
     
     # channel distribution parameter library   
     path            = '../Libraries'
@@ -50,14 +54,11 @@ def run_model(cell_index, ci):
                        morphology=morphology,       \
                        variables=parameters         )
 
-    # record vectors
-    tm  = h.Vector()
-    vm  = h.Vector()
-    tm.record(h._ref_t)
-    vm.record(cell.soma(0.5)._ref_v)
+    # record features online (downsampled vm, max, spike times, and sliding averages; full traces are not kept)
+    recorder = OnlineRecorder(cell.soma(0.5)._ref_v, cell.soma, window=tstop/40, record_dt=4*h.dt, thresh=0)
     
-    # transient to play
-    transient = h.Vector([use.alpha(ht, modOnTime, 1, tau) if ht >= modOnTime else 0 for ht in np.arange(0,tstop,h.dt)])
+    # transient to play (one vector, played into every mechanism and synapse)
+    transient = tr.get_vector('alpha', tstop, start=modOnTime, gmax=1, tau=tau)
     
     
     # result dict
@@ -65,6 +66,9 @@ def run_model(cell_index, ci):
     
     for i in range(20):
         res[i] = {}
+        # same factors, ramping delays, and noise for this model and factor set in every condition, on any worker
+        streams = JobStreams(master_seed, cell_index, i)
+        streams.seed_globals('factors')
         # draw random factors
         modulation_DA = {'intr':   {'naf': np.random.uniform(0.95,1.1),
                                     'kaf': np.random.uniform(1.0,1.1),
@@ -92,6 +96,7 @@ def run_model(cell_index, ci):
                                     }
         
         res[i][ci] = {'factors':{'da': modulation_DA, 'ach': modulation_ACh }  }
+        res[i]['features'] = {}
     
         # ACh factor sets used == 0 and 2 (since giving less inward rectification and higher excitability)
         V = {}
@@ -100,13 +105,10 @@ def run_model(cell_index, ci):
         for key in ['glut','gaba']:
             V[key] = transient
         
-        # Master seed -> reset for all factor combinations
-        #np.random.seed(seed=1000) # TODO no seed... will bg be different over workers?
-        
         # set bg (constant+ramping). 
         fgaba=24.0
         Syn, nc, ns, mapper = use.set_ramping_stimuli(cell, [],low=modOnTime,high=modOnTime+tau)
-        RAMP                = {'s':Syn.copy(), 'nc':nc.copy(), 'ns':ns.copy}
+        RAMP                = {'s':Syn.copy(), 'nc':nc.copy(), 'ns':ns.copy()}
         Syn, nc, ns         = use.set_bg_noise( cell, fglut=12.0, fgaba=fgaba)
         
         # Clean
@@ -123,19 +125,24 @@ def run_model(cell_index, ci):
         
         for bg in range(nbg):    
             print(cell_index, c, bg)
+            # new noise for each repetition (the NetStim streams restart at initialisation)
+            streams.assign(RAMP['ns'], bg, 'ramping')
+            streams.assign(ns, bg, 'bg')
             # finalize and run
             h.finitialize(-80)
-            while h.t < tstop:
-                h.fadvance()
-            # downsample data and store in array
+            use.run_until(tstop)
+            # store downsampled data and features
+            features = recorder.features()
             if not 'time' in res:
-                res['time'] = [t for ind,t in enumerate(tm) if ind%4 == 0]
-            res[i][bg] = [vm[ind]   for ind,t in enumerate(tm) if ind%4 == 0]
+                res['time'] = features['tm']
+                res['window_t'] = features['window_t']
+            res[i][bg] = features['trace']
+            res[i]['features'][bg] = {'max':features['max'], 'spikes':features['crossings'],
+                                      'window_mean':features['window_mean'], 'sustained':recorder.above_threshold()}
         
         
-    # save
-    with open('inVivo_ramping_{}_{}_model{}.json'.format(conditions[ci],tag,cell_index), 'wt') as f:
-        json.dump(res,f,indent=4)
+    # save (as json, with the recorded arrays as lists)
+    use.save_data(res, 'inVivo_ramping_{}_{}_model{}.json'.format(conditions[ci],tag,cell_index))
 
 
 # if run from terminal...   ===============================================================
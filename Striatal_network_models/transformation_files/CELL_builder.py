@@ -7,8 +7,9 @@ The MSN class defining the cell
 
 from neuron import h
 import numpy as np
-import json
 from math import exp
+import morphology_cache # shared with MSN_builder, in the base of the repo (which must be on the path)
+import model_registry as registry
 
 import logging
 logger = logging.getLogger(__name__)
@@ -25,10 +26,9 @@ class CELL:
                         replace_axon=True,
                         section=None
                         ):
-        Import = h.Import3d_SWC_read()
-        Import.input(morphology)
-        imprt = h.Import3d_GUI(Import, 0)
-        imprt.instantiate(None)
+        # sections are copied from the (once parsed) morphology, so several
+        # independent cells can exist at the same time
+        self.sections = morphology_cache.instantiate(morphology)
         h.define_shape()
         
         self._set_nsegs()
@@ -45,8 +45,7 @@ class CELL:
         self.v_init = self.par['global']['v_init']['value']
         
         if mechanisms:
-            with open(mechanisms) as file:
-                mechLists = json.load(file)
+            mechLists = registry.load_mechanisms(mechanisms)
              
         
         # set channels and parameters
@@ -99,8 +98,8 @@ class CELL:
                             "range":    {"axonal":{}, "somatic":{}, "basal":{}} }
         channel_lists   = { "axonal":[], "somatic":[], "basal":[] }
         
-        with open(params) as file:
-            paramList = json.load(file)[0]
+        # parameter file is only read once per process
+        paramList = registry.load_params(params)[0]
         
         for p in paramList:
             # extract values etc
@@ -129,7 +128,7 @@ class CELL:
         # soma
         self.nsomasec = 0
         self.somalist = h.SectionList()
-        for sec in h.allsec():
+        for sec in self.sections:
             if sec.name().find('soma') >= 0:
                 self.somalist.append(sec=sec)
                 if self.nsomasec == 0:
@@ -137,7 +136,7 @@ class CELL:
                 self.nsomasec += 1
         # dendrite
         self.dendlist = h.SectionList()
-        for sec in h.allsec():
+        for sec in self.sections:
             if sec.name().find('dend') >= 0:
                 self.dendlist.append(sec=sec)
         # axon
@@ -146,23 +145,30 @@ class CELL:
             self._create_AIS()
         else:
             axon=[]
-            for sec in h.allsec():
+            for sec in self.sections:
                 if sec.name().find('axon') >= 0:
                     self.axonlist.append(sec=sec)
         # all
         self.allsecnames = []
         self.allseclist  = h.SectionList()
-        for sec in h.allsec():
+        for sec in self.sections:
             self.allsecnames.append(sec.name())
             self.allseclist.append(sec=sec)
-        
+        # look-up of sections by name, distance of each section (middle) to the
+        # middle of the soma, and which sections belong to which compartment type
+        secnames = np.array(self.allsecnames)
+        self.name2sec = {sec.name(): sec for sec in self.sections}
+        self.sec_index = {name: i for i, name in enumerate(self.allsecnames)}
+        self.sec_dists = np.array([h.distance(self.soma(0.5), sec(0.5)) for sec in self.allseclist])
+        self.compartment_masks = {comp: np.char.startswith(secnames, comp) for comp in ['soma', 'dend', 'axon']}
+
         
     
     
     def _set_nsegs(self):
         """ def seg/sec """
         
-        for sec in h.allsec():
+        for sec in self.sections:
             sec.nseg = 2*int(sec.L/40.0)+1
             
     
@@ -172,7 +178,7 @@ class CELL:
         """
         
         temp = []
-        for sec in h.allsec():
+        for sec in self.sections:
             if sec.name().find('axon') >= 0:
                 temp.append(sec)
         
@@ -186,7 +192,7 @@ class CELL:
             # Define origin of distance function
             h.distance(0, 0.5, sec=self.soma)
             
-            for section in h.allsec():
+            for section in self.sections:
                 if section.name().find('axon') >= 0:
                     # If distance to soma is larger than 60, store diameter
                     if h.distance(1, 0.5, sec=section) > 60:
@@ -195,16 +201,17 @@ class CELL:
         
         # delete old axon
         for section in temp:
+            self.sections.remove(section)
             h.delete_section(sec=section)
         
         # Create new axon sections
         a0 = h.Section(name='axon[0]')
         a1 = h.Section(name='axon[1]')
+        self.sections.extend([a0,a1])
         
         # populate axonlist
-        for sec in h.allsec():
-            if sec.name().find('axon') >= 0:
-                self.axonlist.append(sec=sec)
+        for sec in [a0,a1]:
+            self.axonlist.append(sec=sec)
         
         # connect axon sections to soma and eachother
         a0.connect(self.soma)
@@ -51,6 +51,10 @@ Alexander Kozlov <akozlov at kth.se>
 from neuron import h
 import glob, json, pickle
 import numpy                as np
+
+import sys
+sys.path.insert(0, '../../') # base of the repo (morphology cache and model registry, used by CELL_builder)
+
 import CELL_builder         as build
 #import common_functions     as use
 
@@ -0,0 +1,90 @@
+'''
+Benchmarks the time taken to run simulations with the Python loop
+'while h.t < tstop: h.fadvance()' against common_functions.run_until, for a
+single compartment (where the time is mostly the overhead of the loop) and
+for a full SPN model.
+    - Run from command line with e.g. python benchmark_run_until.py
+'''
+
+
+
+from   neuron           import h
+import numpy                as np
+import common_functions     as cf
+import model_registry       as registry
+import MSN_builder          as build
+import time
+
+
+
+# Load model mechanisms
+import neuron               as nrn
+nrn.load_mechanisms('mechanisms/single')
+
+h.load_file('stdlib.hoc')
+h.load_file('import3d.hoc')
+
+# specs
+specs = registry.specs
+
+cell_type = 'dspn'
+cell_index = 0
+
+tstop = 1500 # duration of the in vivo simulations
+n_repeats = 3
+
+
+
+def fadvance_loop(tstop):
+    '''Runs the simulation as the drivers used to.'''
+    while h.t < tstop:
+        h.fadvance()
+
+
+def benchmark(name, vm_vec):
+    '''
+    Times each method of running the simulation, checking that they give the
+    same membrane potential.
+    '''
+    times = {}
+    vm = {}
+    for method, run in [('fadvance loop', fadvance_loop), ('run_until', cf.run_until)]:
+        times[method] = []
+        for r in range(n_repeats):
+            h.finitialize(-80)
+            start = time.time()
+            run(tstop)
+            times[method].append(time.time()-start)
+        vm[method] = vm_vec.to_python()
+
+    n_steps = len(vm['run_until'])-1
+    loop = np.median(times['fadvance loop'])
+    native = np.median(times['run_until'])
+    print('{} ({} steps): fadvance loop {:.3f} s; run_until {:.3f} s; overhead removed {:.0f} ms per run ({:.2f} us per step); same vm: {}'.format( \
+          name, n_steps, loop, native, (loop-native)*1e3, (loop-native)/n_steps*1e6, vm['fadvance loop'] == vm['run_until']))
+
+
+
+# ===== single compartment =====
+soma = h.Section(name='benchmark_soma')
+soma.insert('pas')
+vm_vec = h.Vector()
+vm_vec.record(soma(0.5)._ref_v)
+
+benchmark('single compartment', vm_vec)
+
+del vm_vec, soma
+
+
+# ===== SPN model =====
+cell = build.MSN(params=specs[cell_type]['par'],
+                 morphology=specs[cell_type]['morph'],
+                 variables=registry.load_library(specs[cell_type]['lib'])[cell_index]['variables'])
+vm_vec = h.Vector()
+vm_vec.record(cell.soma(0.5)._ref_v)
+
+benchmark('{} model {}'.format(cell_type, cell_index), vm_vec)
+
+
+
+h.quit()
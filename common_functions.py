@@ -6,6 +6,8 @@ common functions for SPN simulations
 from   neuron                       import h
 from   matplotlib                   import pyplot as plt
 import numpy                            as np
+import plateau_features                 as pf
+import spike_trains                     as st
 import os, shutil
 import pickle
 import json, codecs
@@ -35,7 +37,7 @@ def exclude_at_start(tm, vm, time):
     Thomas Binns (author), 29/01/21
     '''
     
-    exclude_idx = tm.index(min(tm, key=lambda x:abs(x-time))) - 1
+    exclude_idx = pf.nearest_index(tm, time) - 1
     
     return tm[exclude_idx:], vm[exclude_idx:]
 
@@ -80,14 +82,20 @@ def get_dists(cell,
     else:
         origin = cell.soma
     
+    # distances from the middle of each section to the middle of the soma are
+    # pre-computed when the cell is built
+    precomputed = other_origin is None and origin_x == .5 and sec_x == .5
+    
     dists = {}
     
     if only_sec:
         # ===== gets the distances to the origin =====
         for secs in only_sec:
-            for sec in cell.allseclist:
-                 if sec.name() == secs:
-                     dists[secs] = int(h.distance(origin(origin_x),sec(sec_x)))
+            if secs in cell.name2sec:
+                if precomputed:
+                    dists[secs] = int(cell.sec_dists[cell.sec_index[secs]])
+                else:
+                    dists[secs] = int(h.distance(origin(origin_x),cell.name2sec[secs](sec_x)))
         
     else:
         # ===== checks that correct sec_types given =====
@@ -97,10 +105,11 @@ def get_dists(cell,
         
         # ===== gets the distances to the origin =====
         for types in sec_type:
-            dists[types] = []
-            for sec in cell.allseclist:
-                if sec.name()[:4] == types:
-                    dists[types].append(int(h.distance(origin(origin_x),sec(sec_x))))
+            idx = np.flatnonzero(cell.compartment_masks[types])
+            if precomputed:
+                dists[types] = [int(d) for d in cell.sec_dists[idx]]
+            else:
+                dists[types] = [int(h.distance(origin(origin_x),cell.name2sec[cell.allsecnames[i]](sec_x))) for i in idx]
         
         
     return dists
@@ -606,17 +615,8 @@ def FWHM(tm, Y, baseIndex):
     before and after the maximum.
     '''
     
-    # get half-max vm
-    half_max = (max(Y)+Y[baseIndex]) / 2.
-
-    indx = []
-    for i,y in enumerate(Y):
-        
-        # get all values above half max (assumes monotonic epsp in trace)
-        if y - half_max >= 0:
-            indx.append(i)
-            
-    return tm[indx[-1]] - tm[indx[0]]
+    # get time above half-max vm (assumes monotonic epsp in trace)
+    return pf.get_features(tm, Y, base_vm=Y[baseIndex])['dur']
     
     
     
@@ -628,17 +628,8 @@ def HMDur(tm, Y, baseIndex):
     -The end of the voltage stimulation is assumed to be after 120 ms (100 delay + 20x1 ms ISI)
     '''
     
-    # get half-max vm
-    half_max = (max(Y)+Y[baseIndex]) / 2.
-
-    indx = []
-    for i,y in enumerate(Y):
-        
-        # get all values above half max (assumes monotonic epsp in trace)
-        if y - half_max >= 0:
-            indx.append(i)
-            
-    return tm[indx[-1]] - 120
+    # get last time above half-max vm (assumes monotonic epsp in trace)
+    return pf.get_features(tm, Y, base_vm=Y[baseIndex])['t_decay'] - 120
 
 
 
@@ -664,20 +655,9 @@ def dpp_dur(tm, vm, base_vm, exclude=None):
     Thomas Binns (author), 28/01/21
     '''
     
-    if exclude:
-        # excludes time at start of simulations
-        tm, vm = exclude_at_start(tm, vm, exclude)
-    
-    # get half-max vm
-    half_max = (max(vm)+base_vm) / 2
-
-    indx = []
-    for i, v in enumerate(vm):
-        # get all values above half max (assumes monotonic epsp in trace)
-        if v - half_max >= 0:
-            indx.append(i)
-            
-    return tm[indx[-1]] - tm[indx[0]]
+    # get time above half-max vm (assumes monotonic epsp in trace), excluding
+    # time at start of simulations
+    return pf.get_features(tm, vm, base_vm, exclude=exclude)['dur']
 
 
 
@@ -700,12 +680,8 @@ def dpp_amp(tm, vm, base_vm, exclude=None):
     '''
     
     
-    if exclude:
-        # excludes time at start of simulations
-        tm, vm = exclude_at_start(tm,vm,exclude)
-    
-    # get max Vm
-    return max(vm) - base_vm
+    # get max Vm, excluding time at start of simulations
+    return pf.get_features(tm, vm, base_vm, exclude=exclude)['amp']
     
 
 
@@ -718,11 +694,15 @@ def create_folder(path):
         
 def save_data(data, path):
     '''
-    Saves json serialisable data in the specified path.
+    Saves data in the specified path. Data is pickled, keeping numpy arrays as
+    they are, unless the path ends in '.json', in which case it is saved as json
+    (a legacy export, with numpy arrays converted to lists).
     
     INPUT(S):
-        - data: data to save [must be json serialisable]        
-        - path: directory to save (including filename and type) [str]
+        - data: data to save [must be picklable, or json serialisable apart
+            from numpy arrays and numbers if saving as json]
+        - path: directory to save (including filename and type ('.pkl' or
+            '.json')) [str]
         
     OUTPUT(S):
         None
@@ -730,14 +710,36 @@ def save_data(data, path):
     Thomas Binns (author), 27/01/21
     '''
     
-    json.dump(data, open(path,'w'))
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(data, f, default=_to_json)
+    else:
+        with open(path, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    
+    
+    
+    
+def _to_json(obj):
+    '''
+    Converts numpy arrays and numbers (which the json module cannot serialise)
+    to lists and python numbers, for saving data as json.
+    '''
+    
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
     
     
     
     
 def load_data(path):
     '''
-    Loads data from the specified path.
+    Loads data from the specified path (pickled data, or json data if the path
+    ends in '.json'; see save_data). If no file exists at the path, the same
+    data saved in the other format (i.e. the path with '.json' instead of
+    '.pkl', or vice versa) is loaded instead.
     
     INPUT(S):
         - path: directory to load (including filename and type) [str]
@@ -748,7 +750,18 @@ def load_data(path):
     Thomas Binns (author), 28/01/21
     '''
     
-    data = json.load(open(path))
+    if not os.path.isfile(path):
+        root, ext = os.path.splitext(path)
+        other = root + {'.pkl':'.json', '.json':'.pkl'}.get(ext, ext)
+        if os.path.isfile(other):
+            path = other
+    
+    if path.endswith('.json'):
+        with open(path) as f:
+            data = json.load(f)
+    else:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
     
     return data
     
@@ -783,7 +796,8 @@ def random_synapse(ns, nc, Syn, sec, x,         \
                 NC_delay=0,                     \
                 NC_conductance=0.6e-3,          \
                 NC_threshold=0.1,               \
-                seed = None                     ):
+                seed = None,                    \
+                spike_times = None              ):
     '''
     random_synapse(argument, *, **)
     
@@ -805,6 +819,10 @@ def random_synapse(ns, nc, Syn, sec, x,         \
     NS_arguments;       defines the NetStim object
     S_arguments;        defines the synapse mechanism
     NC_arguments;       defines the NetCon  object
+    
+    If spike_times are given (e.g. drawn with spike_trains.poisson_trains), they are
+    played into the synapse by a VecStim instead (stored in ns), and the NS_arguments
+    and seed are ignored.
     '''
     
     # create/set synapse in segment x of section
@@ -847,16 +865,21 @@ def random_synapse(ns, nc, Syn, sec, x,         \
         sys.stderr.write('\nError: wrong synapse Type (%s). \n\tSynapse not set. Exiting\n' %Type)
         sys.exit()
         
-    # create NetStim object
-    ns[key]             = h.NetStim()
-    ns[key].start       = NS_start
-    ns[key].interval    = NS_interval # mean interval between two spikes in ms
-    ns[key].noise       = NS_noise
-    ns[key].number      = NS_number
-    #ns[key].noiseFromRandom()
-    if seed == 'no_seed': pass
-    elif seed:  ns[key].seed( seed     )
-    else:       ns[key].seed( len(Syn) )
+    # create VecStim object (pre-generated spike times)...
+    if spike_times is not None:
+        ns[key]         = st.vecstim(spike_times)
+    
+    # ...or NetStim object
+    else:
+        ns[key]             = h.NetStim()
+        ns[key].start       = NS_start
+        ns[key].interval    = NS_interval # mean interval between two spikes in ms
+        ns[key].noise       = NS_noise
+        ns[key].number      = NS_number
+        #ns[key].noiseFromRandom()
+        if seed == 'no_seed': pass
+        elif seed:  ns[key].seed( seed     )
+        else:       ns[key].seed( len(Syn) )
         
     # create NetCon object
     nc[key]             = h.NetCon(ns[key],Syn[key]) #  THIS IS WHERE THE ERROR WAS (Syn[sek] instead of Syn[key])
@@ -939,11 +962,32 @@ def set_bg_noise(cell,              \
                  fglut=12.0,        \
                  fgaba=4.0,         \
                  dendOnly=0,        \
-                 delays=[]          ):
+                 delays=[],         \
+                 vecstim=False,     \
+                 tstop=None,        \
+                 rng=None,          \
+                 realisation=None   ):
+    '''
+    Adds a glutamatergic and a GABAergic synapse with background (Poisson) input to each
+    section of the cell. If vecstim, the spike times of all synapses are drawn in advance
+    until tstop (with the random number generator or seed rng; see
+    spike_trains.poisson_trains) and played by VecStims, rather than generated by NetStims.
+    
+    A realisation of the noise drawn before (see spike_trains.NoiseRealisation) can instead
+    be given, which is replayed identically (implies vecstim; fglut, fgaba, delays, tstop,
+    and rng are then ignored).
+    '''
     
     if dendOnly:    compartments = cell.dendlist
     else:           compartments = cell.allseclist
     
+    # spike times of every synapse, drawn at once
+    if vecstim and realisation is None:
+        if tstop is None:
+            raise ValueError('The time until which spike times are drawn (tstop) is needed to play noise through VecStims.')
+        realisation = st.NoiseRealisation(compartments, {'glut':fglut, 'gaba':fgaba}, tstop,
+                                          start=delays if len(delays) else 0, rng=rng)
+    
     ns      = {}
     nc      = {}
     Syn     = {}
@@ -966,14 +1010,16 @@ def set_bg_noise(cell,              \
                                 NS_interval=1000.0/fglut,    \
                                 NC_conductance=gbase,       \
                                 NS_start=delay,             \
-                                seed=None )
+                                seed=None,                  \
+                                spike_times=realisation.spike_times(sec.name(), 'glut') if realisation else None )
         # create a gaba synapse (Exp2Syn)
         random_synapse(ns, nc, Syn, sec, 0.1,           \
                                 Type='gaba',                \
                                 NS_interval=1000.0/fgaba,       \
                                 NC_conductance=gbase*3,     \
                                 NS_start=delay,             \
-                                seed=None      )
+                                seed=None,                  \
+                                spike_times=realisation.spike_times(sec.name(), 'gaba') if realisation else None )
         
         Syn[sec.name()+'_glut'].ratio = 1.0
         
@@ -1003,7 +1049,10 @@ def set_noise(cell,
               glut_x = [],
               gaba_x = [],
               glut_delay = 0,
-              gaba_delay = 0):
+              gaba_delay = 0,
+              vecstim = False,
+              tstop = None,
+              rng = None):
     '''
     Sets background noise of glutamatergic and GABAergic inputs to the cell.
     
@@ -1022,10 +1071,15 @@ def set_noise(cell,
             should be activated [number]
         - gaba_delay: the time (in ms) from the start of the simulations at which the GABAergic inputs 
             should be activated [number]
+        - vecstim: whether the spike times of the inputs are drawn in advance and played by VecStims,
+            rather than generated by NetStims (default False) [bool]
+        - tstop: time (in ms) until which spike times are drawn (needed if vecstim) [number]
+        - rng: random number generator, or seed, for the spike times (if vecstim) (default None)
+            [np.random.Generator or int]
     
     OUTPUT(S):
         - Syn: dictionary of synapses [dict]
-        - ns: dictionary of NetStim objects [dict]
+        - ns: dictionary of NetStim (or VecStim) objects [dict]
         - nc: dictionary of NetCon objects [dict]
     
     Thomas Binns (modified), 02/02/21
@@ -1058,6 +1112,16 @@ def set_noise(cell,
     else:
         gaba_inputs['x'] = [random.uniform(0,1) for x in range(n_gaba)]
     
+    # spike times of every input, drawn at once
+    glut_times = [None for x in range(n_glut)]
+    gaba_times = [None for x in range(n_gaba)]
+    if vecstim:
+        if tstop is None:
+            raise ValueError('The time until which spike times are drawn (tstop) is needed to play noise through VecStims.')
+        rng = np.random.default_rng(rng)
+        glut_times = st.poisson_trains(freq_glut, tstop, n=n_glut, start=glut_delay, rng=rng)
+        gaba_times = st.poisson_trains(freq_gaba, tstop, n=n_gaba, start=gaba_delay, rng=rng)
+    
     
     # ===== sets up objects =====
     ns      = {}
@@ -1076,23 +1140,19 @@ def set_noise(cell,
     # adds glutamatergic inputs
     for i, tar in enumerate(glut_inputs['targets']):
         
-        for sec in sections:
-            if sec.name() == secs[tar]:
-                random_synapse(ns, nc, Syn, sec, glut_inputs['x'][i],
-                               NS_interval = 1000/freq_glut, NC_conductance = gbase,
-                               NS_start = glut_delay, seed = None) #None
-                Syn[sec.name()+'_glut'].ratio = 1.0
-                break
+        sec = cell.name2sec[secs[tar]]
+        random_synapse(ns, nc, Syn, sec, glut_inputs['x'][i],
+                       NS_interval = 1000/freq_glut, NC_conductance = gbase,
+                       NS_start = glut_delay, seed = None, spike_times = glut_times[i]) #None
+        Syn[sec.name()+'_glut'].ratio = 1.0
             
     # adds GABAergic inputs
     for i, tar in enumerate(gaba_inputs['targets']):
         
-        for sec in sections:
-            if sec.name() == secs[tar]:
-                random_synapse(ns, nc, Syn, sec, gaba_inputs['x'][i],
-                               NS_interval = 1000/freq_gaba, NC_conductance = gbase,
-                               NS_start = gaba_delay, seed = None)                
-                break
+        sec = cell.name2sec[secs[tar]]
+        random_synapse(ns, nc, Syn, sec, gaba_inputs['x'][i],
+                       NS_interval = 1000/freq_gaba, NC_conductance = gbase,
+                       NS_start = gaba_delay, seed = None, spike_times = gaba_times[i])
         
     
     return Syn, ns, nc
@@ -1105,8 +1165,17 @@ def set_HFI(cell,
             freq = 10,
             n_inputs = 20,
             delay = 0,
-            exclude = []):
-    '''
+            exclude = [],
+            vecstim = False,
+            tstop = None,
+            rng = None,
+            spike_times = None):
+    '''
+    If vecstim, the spike times of the inputs are drawn in advance until tstop (with the
+    random number generator or seed rng; see spike_trains.poisson_trains) and played by
+    VecStims, rather than generated by NetStims. The spike times of each input can instead
+    be given (spike_times; e.g. empty, for inputs whose spikes are delivered as events; see
+    simulation_functions.continue_simulation).
     
     Thomas Binns (author), 03/02/21
     '''
@@ -1127,16 +1196,21 @@ def set_HFI(cell,
     # ===== gets the HFI arrangement =====
     arrangement = HF_input_arrangement(cell, exclude=exclude, n_inputs=n_inputs)
     
+    # spike times of every input, drawn at once (as by NetStims with noise=1 and number=1000)
+    if vecstim and spike_times is None:
+        if tstop is None:
+            raise ValueError('The time until which spike times are drawn (tstop) is needed to play HFIs through VecStims.')
+        spike_times = st.poisson_trains(freq, tstop, n=len(arrangement['targets']), start=delay, number=1000, rng=rng)
+    
     
     # ===== adds inputs =====
     for i, tar in enumerate(arrangement['targets']):
-        for sec in cell.allseclist:
-            if sec.name() == tar:
-                random_synapse(ns, nc, Syn, sec, random.uniform(0,1),
-                               NS_interval = 1000/freq, NC_conductance = gbase,
-                               NS_start = delay, seed = None)
-                Syn[sec.name()+'_glut'].ratio = 1.0
-                break 
+        sec = cell.name2sec[tar]
+        random_synapse(ns, nc, Syn, sec, random.uniform(0,1),
+                       NS_interval = 1000/freq, NC_conductance = gbase,
+                       NS_start = delay, seed = None,
+                       spike_times = spike_times[i] if spike_times is not None else None)
+        Syn[sec.name()+'_glut'].ratio = 1.0
         
         
     return Syn, ns, nc, arrangement
@@ -1153,7 +1227,21 @@ def set_bg_noise_with_flags(cell,              \
                  gabaMod=False,     \
                  delays=[],         \
                  seedHolder=None,   \
-                 skip_compartment={}):
+                 skip_compartment={},   \
+                 vecstim=False,     \
+                 tstop=None,        \
+                 rng=None           ):
+    '''
+    As set_bg_noise, with flags for which compartments get which synapses, and seeds
+    counted up from seedHolder. If vecstim, a synapse with a seed is given the spike
+    times drawn from its own generator (see spike_trains.seeded_trains); other synapses
+    draw from rng.
+    '''
+    
+    if vecstim:
+        if tstop is None:
+            raise ValueError('The time until which spike times are drawn (tstop) is needed to play noise through VecStims.')
+        rng = np.random.default_rng(rng)
     
     ns      = {}
     nc      = {}
@@ -1192,12 +1280,16 @@ def set_bg_noise_with_flags(cell,              \
                     seed = seedHolder[comp]['glut']
                     seedHolder[comp]['glut'] += 1
             print(seed)    
+            spike_times = None
+            if vecstim:
+                spike_times = _noise_train(12.0, tstop, delay, seed, rng)
             # create a glut synapse (glutamate)
             random_synapse(ns, nc, Syn, sec, 0.5,           \
                                     NS_interval=1000.0/12.0,    \
                                     NC_conductance=gbase,       \
                                     NS_start=delay,             \
-                                    seed=seed )
+                                    seed=seed,                  \
+                                    spike_times=spike_times )
             Syn[sec.name()+'_glut'].ratio = 1.0
             if syn_fact:
                 Syn[sec.name()+'_glut'].ampa_scale_factor = syn_fact[0]
@@ -1211,14 +1303,18 @@ def set_bg_noise_with_flags(cell,              \
                 if comp in seedHolder:
                     seed = seedHolder[comp]['gaba']
                     seedHolder[comp]['gaba'] += 1
-                    
+            
+            spike_times = None
+            if vecstim:
+                spike_times = _noise_train(3.0, tstop, delay, seed, rng)
             # create a gaba synapse (Exp2Syn)
             random_synapse(ns, nc, Syn, sec, 0.1,           \
                                     Type='gaba',                \
                                     NS_interval=1000.0/3,       \
                                     NC_conductance=gbase*3,     \
                                     NS_start=delay,             \
-                                    seed=seed )
+                                    seed=seed,                  \
+                                    spike_times=spike_times )
             if gabaMod:
                 # scale gaba
                 nc[sec.name()+'_gaba'].weight[0] = gbase * 3 * gabaMod
@@ -1227,6 +1323,18 @@ def set_bg_noise_with_flags(cell,              \
     return Syn, nc, ns
 
 
+def _noise_train(rate, tstop, delay, seed, rng):
+    '''
+    Draws the spike times of one synapse of set_bg_noise_with_flags: from its own
+    generator if it has a seed, otherwise from rng.
+    '''
+    
+    if seed is None:
+        return st.poisson_trains(rate, tstop, start=delay, rng=rng)[0]
+    
+    return st.seeded_trains(rate, tstop, [seed], start=delay)[0]
+
+
 def set_ramping_stimuli(cell,               \
                         random_delays,      \
                         index=None,         \
@@ -1235,7 +1343,22 @@ def set_ramping_stimuli(cell,               \
                         gabaMod=False,      \
                         low=800,            \
                         high=1300,          \
-                        seed='no_seed'      ):
+                        seed='no_seed',     \
+                        vecstim=False,      \
+                        tstop=None,         \
+                        rng=None            ):
+    '''
+    Adds a glutamatergic and a GABAergic synapse with background (Poisson) input to each
+    dendritic section, starting at a (random) delay between low and high. If vecstim, the
+    spike times are drawn in advance and played by VecStims; with a seed, each synapse
+    draws from its own generator (seeded by the seed, section, and synapse type),
+    otherwise all draw from rng.
+    '''
+    
+    if vecstim:
+        if tstop is None:
+            raise ValueError('The time until which spike times are drawn (tstop) is needed to play noise through VecStims.')
+        rng = np.random.default_rng(rng)
     
     ns      = {}
     nc      = {}
@@ -1257,20 +1380,29 @@ def set_ramping_stimuli(cell,               \
             delay = random_delays[index][s]
         
         name2id[sec.name()] = sec
+        
+        glut_times = gaba_times = None
+        if vecstim:
+            if seed is None or seed == 'no_seed':
+                glut_times, gaba_times = st.poisson_trains([12.0, 3.0], tstop, n=2, start=delay, rng=rng)
+            else:
+                glut_times, gaba_times = st.seeded_trains([12.0, 3.0], tstop, [[seed, s, 0], [seed, s, 1]], start=delay)
             
         # create a glut synapse (glutamate)
         random_synapse(ns, nc, Syn, sec, 0.5,           \
                                 NS_interval=1000.0/12.0,    \
                                 NC_conductance=gbase,       \
                                 NS_start=delay,             \
-                                seed=seed )
+                                seed=seed,                  \
+                                spike_times=glut_times )
         # create a gaba synapse (Exp2Syn)
         random_synapse(ns, nc, Syn, sec, 0.1,           \
                                 Type='gaba',                \
                                 NS_interval=1000.0/3,       \
                                 NC_conductance=gbase*3,     \
                                 NS_start=delay,             \
-                                seed=seed      )
+                                seed=seed,                  \
+                                spike_times=gaba_times )
         
         Syn[sec.name()+'_glut'].ratio = 1.0
         
@@ -1867,37 +1999,33 @@ def set_clustered_stim(     cell,               \
     Thomas Binns (modified), 25/01/21
     '''
     
-    for sec in cell.allseclist: # for all sections in the cell
-                                                    
-        if sec.name() == section: # if section to stimulate
-            
-            # calc distance to soma
-            # d2soma = int(h.distance(x, sec=sec)) # calculates distance from location 0 of soma section
-            d2soma = int(h.distance(cell.soma(x),sec(x))) # calculates distance from location x of soma section
-            
-            # define synapse
-            syn         = h.glutamate(x, sec=sec)
-            syn.ratio   = 1.0/3.0
-            
-            if syn_fact:
-                syn.ampa_scale_factor = syn_fact[0]
-                syn.nmda_scale_factor = syn_fact[1]
+    sec = cell.name2sec[section] # section to stimulate
+    
+    # calc distance to soma
+    # d2soma = int(h.distance(x, sec=sec)) # calculates distance from location 0 of soma section
+    d2soma = int(h.distance(cell.soma(x),sec(x))) # calculates distance from location x of soma section
+    
+    # define synapse
+    syn         = h.glutamate(x, sec=sec)
+    syn.ratio   = 1.0/3.0
+    
+    if syn_fact:
+        syn.ampa_scale_factor = syn_fact[0]
+        syn.nmda_scale_factor = syn_fact[1]
 
 
-            # create NetStim object
-            stim            = h.NetStim()
-            stim.number     = n
-            stim.start      = act_time+delta
-            stim.interval   = ISI # mean interval between two spikes in ms (default 1 ms)
-            
+    # create NetStim object
+    stim            = h.NetStim()
+    stim.number     = n
+    stim.start      = act_time+delta
+    stim.interval   = ISI # mean interval between two spikes in ms (default 1 ms)
+    
 
-            # create NetCon object
-            ncon             = h.NetCon(stim, syn)
-            ncon.delay       = 0
-            ncon.weight[0]   = 1.5/1000.0 # (h.synaptic_strength/1000.0)*1e-3 # (uS). default 1.5 nS
-            # N.B. h.synaptic_strength does not exist, so using default of 1.5 nS
-            
-            break 
+    # create NetCon object
+    ncon             = h.NetCon(stim, syn)
+    ncon.delay       = 0
+    ncon.weight[0]   = 1.5/1000.0 # (h.synaptic_strength/1000.0)*1e-3 # (uS). default 1.5 nS
+    # N.B. h.synaptic_strength does not exist, so using default of 1.5 nS
     
     return syn, stim, ncon, d2soma
 
@@ -2475,13 +2603,72 @@ def grouped_boxplot(data, ax, labels=None, colors=None):
         ax.set_xlabel(labels['axes']['x'])
     if labels['axes']['y']: # y axis
         ax.set_ylabel(labels['axes']['y'])
-    
 
 
 
 
 
-# ===== OTHER =================  
+
+# ===== Running simulations =================
+
+
+
+def run_until(tstop, cvode=False, events=None):
+    '''
+    Continues the simulation from the current time until tstop, stepping
+    inside NEURON instead of calling h.fadvance() from Python every time step.
+    Must be called after h.finitialize().
+
+    INPUT(S):
+        - tstop: time to simulate until (in ms). As with the loop
+            'while h.t < tstop: h.fadvance()', the last fixed time step may end
+            just after tstop [number]
+        - cvode: whether adaptive time steps (CVode) are active; if so, the
+            simulation stops exactly at tstop (default False) [bool]
+        - events: time:function pairs; each function is called (without
+            arguments) when the simulation reaches its time, e.g. to change
+            parameters during the simulation (default None) [list of tuples]
+
+    OUTPUT(S):
+        None
+    '''
+
+    h.load_file('stdrun.hoc')
+
+    # events are cleared by h.finitialize(), so are added for each run
+    cv = h.CVode()
+    if events:
+        for t, function in events:
+            cv.event(t, _event_callback(function, cvode))
+
+    if cvode:
+        dt = h.dt
+        cv.solve(tstop)
+        h.dt = dt # CVode leaves its last step size in dt
+    else:
+        # continuerun stops once t >= (its argument - dt/2)
+        h.continuerun(tstop + h.dt/2)
+
+
+
+def _event_callback(function, cvode):
+    '''
+    Wraps an event function so that, with adaptive time steps, CVode is
+    reinitialised after the function has (possibly) changed parameters.
+    '''
+
+    def callback():
+        function()
+        if cvode:
+            h.CVode().re_init()
+
+    return callback
+
+
+
+
+
+# ===== OTHER =================
 
 
 
@@ -0,0 +1,131 @@
+'''
+Compares simulations with adaptive time steps (CVode) to those with the fixed
+time step, for the duration and amplitude of the dendritic plateau potential
+(with and without cholinergic modulation) and the time taken to simulate.
+    - Run from command line with e.g. python cvode_validation.py
+'''
+
+
+
+from   neuron           import h
+import numpy                as np
+import common_functions     as cf
+import model_registry       as registry
+import simulation_functions as sf
+import time
+
+
+
+# Load model mechanisms
+import neuron               as nrn
+nrn.load_mechanisms('mechanisms/single')
+
+h.load_file('stdlib.hoc')
+h.load_file('import3d.hoc')
+
+# specs
+specs = registry.specs
+
+
+# chose cell type ('ispn' or 'dspn') and model id(s) to simulate...
+
+cell_type = 'dspn'
+if cell_type != 'dspn' and cell_type != 'ispn':
+    raise ValueError("The requested cell type is not supported.\nOnly 'dpsn' and 'ispn' are recognised.")
+
+model_iterator = [0,1,2,3,4]
+
+# integration methods to compare with the fixed time step (with absolute tolerances,
+# and optionally the interval at which values are recorded)
+methods = {'fixed': {},
+           'cvode': {'cvode':'global', 'atol':1e-3},
+           'cvode_local': {'cvode':'local', 'atol':1e-3, 'record_dt':0.1}}
+
+print('Comparing {} cell iteration(s) of type: {}'.format(len(model_iterator),cell_type), flush=True)
+
+
+# stimulation details
+stim_info = cf.params_for_input(cell_type, 'clustered')
+target = stim_info['clustered']['target']
+target_labels = stim_info['clustered']['label']
+stim_data = stim_info['clustered']['params']
+
+ACh_data = cf.params_for_input(cell_type, 'ACh')
+mod_factors = cf.draw_factors_ACh(cell_type, mode='mean')
+
+
+
+# ===== simulate model(s) =====
+
+data = {}
+
+for method in methods:
+
+    # model information to pass to simulations
+    model_data = {'specs':specs[cell_type], 'cell_type':cell_type, \
+                  'target':target, 'target_labels':target_labels}
+    model_data.update(methods[method])
+
+    data[method] = {'time':{'validation':0, 'ACh':0}}
+
+    for cell_n, cell_index in enumerate(model_iterator):
+        run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator)}
+
+        # unmodulated plateau potentials
+        start = time.time()
+        validation = sf.dpp_validation(model_data, stim_data, cell_index, run_info)
+        data[method]['time']['validation'] += time.time()-start
+
+        # cholinergic modulation of the plateau potentials
+        start = time.time()
+        ACh = sf.ACh_modulation(model_data, ACh_data, cell_index, run_info, mod_factors)
+        data[method]['time']['ACh'] += time.time()-start
+
+        for lab in target_labels:
+            data[method].setdefault(lab, {'dur':[], 'amp':[]})
+            data[method][lab]['dur'].append(validation[lab]['dur'])
+            data[method][lab]['amp'].append(validation[lab]['amp'])
+            for mod_lab in ACh[lab]:
+                key = '{} ({})'.format(lab, mod_lab)
+                data[method].setdefault(key, {'dur':[], 'amp':[]})
+                data[method][key]['dur'].append(ACh[lab][mod_lab]['dur'])
+                data[method][key]['amp'].append(ACh[lab][mod_lab]['amp'])
+
+
+
+# ===== compare integration methods =====
+
+comparison = {'meta':{'cell_type':cell_type, 'iterations':model_iterator, 'methods':methods}}
+
+for method in methods:
+    if method == 'fixed':
+        continue
+
+    comparison[method] = {'speed-up':{}}
+    for sim in data['fixed']['time']:
+        comparison[method]['speed-up'][sim] = data['fixed']['time'][sim] / data[method]['time'][sim]
+    print('\n{}: simulations {} times faster than the fixed time step'.format(method, \
+          ', '.join('{:.1f} ({})'.format(x, sim) for sim, x in comparison[method]['speed-up'].items())))
+
+    for key in data['fixed']:
+        if key == 'time':
+            continue
+        comparison[method][key] = {}
+        for feature in ['dur', 'amp']:
+            diff = np.subtract(data[method][key][feature], data['fixed'][key][feature])
+            comparison[method][key][feature] = {'fixed':data['fixed'][key][feature], method:data[method][key][feature], \
+                                                'max abs diff':float(np.max(np.abs(diff))), 'mean diff':float(np.mean(diff))}
+        print('    {}: max abs difference of {:.3f} ms (duration), {:.3f} mV (amplitude)'.format(key, \
+              comparison[method][key]['dur']['max abs diff'], comparison[method][key]['amp']['max abs diff']))
+
+
+
+# ===== save comparison =====
+folder = 'Data/'
+name = '{}_cvode_validation.json'.format(cell_type)
+cf.save_data(comparison,folder+name)
+print('Saving data as {}'.format(name))
+
+
+
+h.quit()
@@ -6,9 +6,13 @@ Provides clustered input to a SPN's dendrites (a distal dendrite and proximal de
 
 from   neuron               import h
 import numpy                    as np
-import pickle
 import common_functions         as cf
+import model_registry           as registry
 import simulation_functions     as sf
+from   result_store         import ResultAccumulator
+from   executors            import get_executor
+from   sweep_runner         import JobLedger, JobTimings, sweep_key, run_sweep
+import result_cache             as rc
 import time
 
 
@@ -27,17 +31,7 @@ h.load_file('stdlib.hoc')
 h.load_file('import3d.hoc')
 
 # specs
-specs = {'dspn': {
-                    'N': 71,
-                    'lib': 'Libraries/D1_71bestFit_updRheob.pkl',
-                    'par': 'Params/params_dMSN.json',
-                    'morph': 'Morphologies/WT-dMSN_P270-20_1.02_SGA1-m24.swc'},
-         'ispn': {
-                    'N': 34,
-                    'lib': 'Libraries/D2_34bestFit_updRheob.pkl',
-                    'par': 'Params/params_iMSN.json',
-                    'morph': 'Morphologies/WT-iMSN_P270-09_1.01_SGA2-m1.swc'}
-        }
+specs = registry.specs
         
 # choose cell type ('ispn' or 'dspn') and model id(s) to simulate...
 
@@ -62,9 +56,11 @@ if mod_tar != 'all' and mod_tar != 'indiv':
     
     
 trim_data = True
+legacy_json = False # if True, data is saved as json (with traces as lists), otherwise traces are kept as numpy arrays and pickled
 
 n_rounds = 5
 avg_over_rounds = True
+keep_rounds = True # if False, only the average over rounds of each model's membrane potential is kept
 model_round = []
 for r in range(n_rounds):
     for i in range(len(iterations)):
@@ -76,62 +72,86 @@ if pc.id() == 0:
     print('Simulating {} cell iteration(s) of type: {}'.format(len(model_iterator),cell_type), \
           flush=True)
    
-# open library (channel distributions etc)   
-with open(specs[cell_type]['lib'], 'rb') as f:
-    model_sets = pickle.load(f, encoding="latin1")
-
 
 
 # ===== simulate model(s) =====
 # model information to pass to simulations
-model_data = {'specs':specs[cell_type], 'cell_type':cell_type, 'model_sets':model_sets}
+model_data = {'specs':specs[cell_type], 'cell_type':cell_type}
+master_seed = None # if given, each job's random numbers (noise, modulation factors, etc...) are drawn from streams derived from this seed, the model, and the round, so runs are reproducible on any number of hosts
+model_data['master_seed'] = master_seed
+cache = None # if given, the folder of a cache of simulated jobs, which are only simulated again if something that changes their results has changed (needs master_seed, as jobs without it are not reproducible)
+model_data['cache'] = cache
+backend = None # executor of the simulations: 'pc' (ParallelContext bulletin board, over MPI), 'processes' (worker processes on this machine), or 'serial'; if None, 'pc' when run on more than one host, otherwise 'serial'
+n_workers = None # number of worker processes of the 'processes' backend (if None, one for each CPU)
+batch_size = 1 # number of rounds of a model simulated by one task, on one reused cell; if 'auto', chosen from the overhead of tasks and durations of jobs measured in earlier runs
+resume = False # if True, a run of the same simulations that was killed partway through is resumed, only simulating the jobs not completed (the results of every job are then also written to disk until the run has completed)
 noise = 0
+shared_noise = 0 # if True, one realisation of the noise is drawn for each model and round, and replayed in every modulation condition (paired comparisons)
+model_data['shared_noise'] = shared_noise
+branch = 0 # if True, the modulation conditions of each clustered input target branch from one simulation of the period before modulation (with the same inputs, played from spike times drawn in advance), rather than each being simulated from the start
+model_data['branch'] = branch
+steady_state = None # if given (a folder, or True to only keep them while running), simulations start from the resting state of each model (found once, and saved in the folder) at the start of the baseline before the clustered inputs, rather than settling from -80 mV from 0 ms
+model_data['steady_state'] = steady_state
 HFI = 0
 HFI_delay = 0
 dur_and_amp = 1
 spike = 0
+record_vm = 1 # if False, the membrane potential is not recorded (e.g. if only spikes are analysed; needs dur_and_amp to be False), and no traces are kept
+model_data['record_vm'] = record_vm
+
+# simulation function and its arguments
+driver = 'dpp_ACh_modded' if mod_type == 'ACh' else 'dpp_DA_modded'
+sim_args = {'noise':noise, 'HFI':HFI, 'HFI_delay':HFI_delay, 'dur_and_amp':dur_and_amp, 'spike':spike, 'mod_tar':mod_tar}
 
 start = time.time() # for timing simulations
 
 pc.runworker() # start workers for parallelisation
+executor = get_executor(pc, backend, n_workers)
 
-# clear temp data folder
-folder = 'temp_data'
-cf.clear_folder(folder,'.json')
+# results are folded into the accumulator as they are gathered (raw results of each round are only kept if not trimming the data)
+results = ResultAccumulator(len(iterations), n_rounds, keep_rounds)
+data_rounds = {i:{} for i in range(len(iterations))}
 
-if pc.nhost() == 1: # use the serial form
-    
-    for cell_n in range(len(model_iterator)): # for each model
-        cell_index = model_iterator[cell_n]
-        # simulate model
-        run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator), 'round':model_round[cell_n]}
-        if mod_type == 'ACh':
-            data = sf.dpp_ACh_modded(model_data, cell_index, run_info, noise, HFI, HFI_delay, dur_and_amp, spike, mod_tar)
-        elif mod_type == 'DA':
-            data = sf.dpp_DA_modded(model_data, cell_index, run_info, noise, HFI, HFI_delay, dur_and_amp, spike, mod_tar)
-        # save file to folder
-        name = '{}_{}-{}_modulation'.format(cell_type,data['meta']['round'], data['meta']['id'])
-        cf.save_data(data,'{}/{}.json'.format(folder, name))
-            
-else: # use the bulleting board form
-    
-    for cell_n in range(len(model_iterator)): # scatter processes
-        cell_index = model_iterator[cell_n]
-        # simulate model
-        run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator), 'round':model_round[cell_n]}
-        if mod_type == 'ACh':
-            pc.submit(sf.dpp_ACh_modded, model_data, cell_index, run_info, noise, HFI, HFI_delay, dur_and_amp, spike, mod_tar)
-        elif mod_type == 'DA':
-            pc.submit(sf.dpp_DA_modded, model_data, cell_index, run_info, noise, HFI, HFI_delay, dur_and_amp, spike, mod_tar)
-        
-    while pc.working(): # gather results
-        data = pc.pyret()
-        # save file to folder
-        name = '{}_{}-{}_modulation'.format(cell_type,data['meta']['round'], data['meta']['id'])
-        cf.save_data(data,'{}/{}.json'.format(folder, name))
+# arguments of each job (job = position in model_iterator)
+jobs = {}
+for cell_n in range(len(model_iterator)):
+    run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator), 'round':model_round[cell_n]}
+    jobs[cell_n] = (driver, model_data, model_iterator[cell_n], run_info, sim_args)
+
+# estimated cost of each job (its duration in earlier runs, or otherwise its number of conditions), so that the longest jobs are submitted first
+timings = JobTimings()
+n_conditions = len(cf.params_for_input(cell_type, 'clustered')['clustered']['label'])
+if mod_tar == 'indiv':
+    n_conditions *= 1 + len(cf.params_for_input(cell_type, mod_type)[mod_type]['label'])
+cost_keys = {cell_n:rc.job_key({'driver':driver, 'cell_index':model_iterator[cell_n], 'sim_args':sim_args, \
+                                'options':{key:value for key, value in model_data.items() if key != 'master_seed'}}) \
+             for cell_n in jobs}
+costs = timings.estimate(cost_keys, {cell_n:n_conditions for cell_n in jobs})
+
+# ledger of completed jobs, so that a killed run can be resumed
+ledger = JobLedger('temp_data/{}_{}-modulation-{}_sweep'.format(cell_type, mod_type, mod_tar), sweep_key(jobs), resume)
+
+# jobs of the same model are batched together (so that one task simulates several rounds on the same cell)
+groups = {cell_n:model_iterator[cell_n] for cell_n in jobs}
+if batch_size == 'auto':
+    batch_size = timings.batch_size(len(jobs), executor.n_workers)
+
+durations = np.full((len(iterations), n_rounds), np.nan) # time taken by each job (in s)
+
+for cell_n, data, duration in run_sweep(executor, sf.run_cached, jobs, ledger, costs, batch_size, groups, timings): # simulate models
+    # accumulate results
+    results.add(iterations.index(data['meta']['id']), data['meta']['round'], data)
+    if not trim_data:
+        data_rounds[iterations.index(data['meta']['id'])][data['meta']['round']] = data
+    # record the duration of the job
+    if duration is not None:
+        durations[iterations.index(data['meta']['id']), data['meta']['round']] = duration
+        timings.record(cost_keys[cell_n], duration, n_conditions)
+
+timings.save()
   
   
-pc.done() # end parallelisation
+executor.done() # end parallelisation
 
 
 # for timing simulations
@@ -146,214 +166,83 @@ clus_info = info['clustered']
 info = cf.params_for_input(cell_type, mod_type)
 mod_info = info[mod_type]
 
-# collates data loaded from files
-data_all = {}
-for i, iteration in enumerate(iterations):
-    round_data = {}
-    for r in range(n_rounds):
-        # load data
-        name = name = '{}_{}-{}_modulation'.format(cell_type,r,iteration)
-        data = cf.load_data('{}/{}.json'.format(folder,name))
-        round_data[r] = data
-    # combine data
-    data_all[i] = round_data
-    
-data = data_all
+if mod_tar == 'all':
+    mod_info['target'] = ['all']
+    mod_info['label'] = ['all']
+    mod_labels = {lab:['all'] for lab in clus_info['label']}
+else:
+    mod_labels = {lab:[lab]+mod_info['label'] for lab in clus_info['label']}
 
-if mod_tar == 'indiv':
-    # collates data for each cell iteration
-    for i in range(len(iterations)):
-        
-        data[i]['all'] = {}
-        
-        for lab in clus_info['label']:
-            
-            data[i]['all'][lab] = {}
-            data[i]['all'][lab][lab] = {'vm':[], 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}
-                
-            for j in range(n_rounds):
-                
-                data[i]['all'][lab][lab]['vm'].append(data[i][j][lab][lab]['vm'])
-                if dur_and_amp:
-                    data[i]['all'][lab][lab]['dur'].append(data[i][j][lab][lab]['dur'])
-                    data[i]['all'][lab][lab]['amp'].append(data[i][j][lab][lab]['amp'])  
-                if spike:
-                    data[i]['all'][lab][lab]['spiked'].append(data[i][j][lab][lab]['spiked'])
-            if spike:
-                data[i]['all'][lab][lab]['spiked_avg'] = np.mean(data[i]['all'][lab][lab]['spiked']).tolist()
-            if avg_over_rounds:
-                if dur_and_amp:
-                    data[i]['all'][lab][lab]['dur'] = np.mean(data[i]['all'][lab][lab]['dur']).tolist()
-                    data[i]['all'][lab][lab]['amp'] = np.mean(data[i]['all'][lab][lab]['amp']).tolist()
-                    
-            for mod in mod_info['label']:
-                
-                data[i]['all'][lab][mod] = {'vm':[], 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}
-            
-                for j in range(n_rounds):
-                    
-                    data[i]['all'][lab][mod]['vm'].append(data[i][j][lab][mod]['vm'])
-                    if dur_and_amp:
-                        data[i]['all'][lab][mod]['dur'].append(data[i][j][lab][mod]['dur'])
-                        data[i]['all'][lab][mod]['amp'].append(data[i][j][lab][mod]['amp'])  
-                    if spike:
-                        data[i]['all'][lab][mod]['spiked'].append(data[i][j][lab][mod]['spiked'])
-                if spike:
-                    data[i]['all'][lab][mod]['spiked_avg'] = np.mean(data[i]['all'][lab][mod]['spiked']).tolist()
-                if avg_over_rounds:
-                    if dur_and_amp:
-                        data[i]['all'][lab][mod]['dur'] = np.mean(data[i]['all'][lab][mod]['dur']).tolist()
-                        data[i]['all'][lab][mod]['amp'] = np.mean(data[i]['all'][lab][mod]['amp']).tolist()
-                
-            data[i]['all']['meta'] = data[i][j]['meta']
-            
+data = data_rounds
+
+# collates data across cell iterations and rounds (of shape [n iterations, n rounds, ...]; vm of shape [n iterations, n samples] if not keeping rounds)
+data['all'] = {}
+
+for lab in clus_info['label']:
     
-    # collates data across cell iterations
-    data['all'] = {}
+    data['all'][lab] = {}
     
-    for lab in clus_info['label']:
+    for mod in mod_labels[lab]:
         
-        data['all'][lab] = {}
-        data['all'][lab][lab] = {'vm':[], 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}    
-    
-        for i in range(len(iterations)):
+        if not record_vm:
+            vm = []
+        elif keep_rounds:
+            vm = results.trace([lab,mod,'vm'])
+        else:
+            vm = results.mean_trace([lab,mod,'vm'])
+        data['all'][lab][mod] = {'vm':vm, 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}
+        
+        if dur_and_amp:
+            for feature in ['dur', 'amp']:
+                values = results.values([lab,mod,feature])
+                if avg_over_rounds:
+                    values = np.mean(values,axis=1)
+                data['all'][lab][mod][feature] = values
+        if spike:
+            spiked = results.values([lab,mod,'spiked'])
+            data['all'][lab][mod]['spiked'] = spiked
+            data['all'][lab][mod]['spiked_avg'] = np.mean(spiked,axis=1)
             
-            data['all'][lab][lab]['vm'].append(data[i]['all'][lab][lab]['vm'])
-            if dur_and_amp:
-                data['all'][lab][lab]['dur'].append(data[i]['all'][lab][lab]['dur'])
-                data['all'][lab][lab]['amp'].append(data[i]['all'][lab][lab]['amp'])
-            if spike:
-                data['all'][lab][lab]['spiked'].append(data[i]['all'][lab][lab]['spiked'])
-                data['all'][lab][lab]['spiked_avg'].append(data[i]['all'][lab][lab]['spiked_avg'])
-                
-        for mod in mod_info['label']:
             
-            data['all'][lab][mod] = {'vm':[], 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}    
-        
-            for i in range(len(iterations)):
-                
-                data['all'][lab][mod]['vm'].append(data[i]['all'][lab][mod]['vm'])
-                if dur_and_amp:
-                    data['all'][lab][mod]['dur'].append(data[i]['all'][lab][mod]['dur'])
-                    data['all'][lab][mod]['amp'].append(data[i]['all'][lab][mod]['amp'])
-                if spike:
-                    data['all'][lab][mod]['spiked'].append(data[i]['all'][lab][mod]['spiked'])
-                    data['all'][lab][mod]['spiked_avg'].append(data[i]['all'][lab][mod]['spiked_avg'])
-                
-    
-    # collates meta data
-    data['meta'] = {'tm':data[i]['all']['meta']['tm'], 'cell type':cell_type, 'iterations':iterations,
-                           'n rounds':n_rounds, 'clustered':clus_info, 'avg':avg_over_rounds}
-    if mod_type == 'ACh':
-        data['meta']['ACh info'] = mod_info
-    else:
-        data['meta']['DA info'] = mod_info
-        
-    if noise:
-        info = cf.params_for_input(cell_type, 'noise')
-        data['meta']['noise'] = info['noise']
-    if HFI:
-        info = cf.params_for_input(cell_type, 'HFI')
-        info['HFI']['stim_t'] = clus_info['params']['stim_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
-        info['HFI']['stop_t'] = clus_info['params']['stop_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
-        data['meta']['HFI'] = info['HFI']
-        
-    
-    # grand averages data across cell iterations
-    if not HFI:
-        data['avg'] = {}
-        for lab in clus_info['label']:
-            data['avg'][lab] = {}
-            data['avg'][lab][lab] = {}
-            data['avg'][lab][lab]['vm'] = np.ndarray.tolist(np.mean(data['all'][lab][lab]['vm'],axis=0))
-            data['avg'][lab][lab]['vm'] = np.ndarray.tolist(np.mean(data['avg'][lab][lab]['vm'],axis=0))
-            data['avg'][lab][lab]['dur'] = float(np.mean(data['all'][lab][lab]['dur']))
-            data['avg'][lab][lab]['amp'] = float(np.mean(data['all'][lab][lab]['amp']))
-            for mod in mod_info['label']:
-                data['avg'][lab][mod] = {}
-                data['avg'][lab][mod]['vm'] = np.ndarray.tolist(np.mean(data['all'][lab][mod]['vm'],axis=0))
-                data['avg'][lab][mod]['vm'] = np.ndarray.tolist(np.mean(data['avg'][lab][mod]['vm'],axis=0))
-                data['avg'][lab][mod]['dur'] = float(np.mean(data['all'][lab][mod]['dur']))
-                data['avg'][lab][mod]['amp'] = float(np.mean(data['all'][lab][mod]['amp']))
-                
-else:
-    # collates data for each cell iteration
+# collates data for each cell iteration
+if not trim_data:
     for i in range(len(iterations)):
-        
         data[i]['all'] = {}
-        
         for lab in clus_info['label']:
-            
             data[i]['all'][lab] = {}
-            data[i]['all'][lab]['all'] = {'vm':[], 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}
-                
-            for j in range(n_rounds):
-                
-                data[i]['all'][lab]['all']['vm'].append(data[i][j][lab]['all']['vm'])
-                if dur_and_amp:
-                    data[i]['all'][lab]['all']['dur'].append(data[i][j][lab]['all']['dur'])
-                    data[i]['all'][lab]['all']['amp'].append(data[i][j][lab]['all']['amp'])  
-                if spike:
-                    data[i]['all'][lab]['all']['spiked'].append(data[i][j][lab]['all']['spiked'])
-            if spike:
-                data[i]['all'][lab]['all']['spiked_avg'] = np.mean(data[i]['all'][lab]['all']['spiked']).tolist()
-            if avg_over_rounds:
-                if dur_and_amp:
-                    data[i]['all'][lab]['all']['dur'] = np.mean(data[i]['all'][lab]['all']['dur']).tolist()
-                    data[i]['all'][lab]['all']['amp'] = np.mean(data[i]['all'][lab]['all']['amp']).tolist()
-                
-            data[i]['all']['meta'] = data[i][j]['meta']
-            
-    
-    # collates data across cell iterations
-    data['all'] = {}
+            for mod in mod_labels[lab]:
+                data[i]['all'][lab][mod] = {key:(value[i] if len(value) else []) for key, value in data['all'][lab][mod].items()}
+        data[i]['all']['meta'] = data[i][n_rounds-1]['meta']
     
-    for lab in clus_info['label']:
-        
-        data['all'][lab] = {}
-        data['all'][lab]['all'] = {'vm':[], 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}    
-    
-        for i in range(len(iterations)):
-            
-            data['all'][lab]['all']['vm'].append(data[i]['all'][lab]['all']['vm'])
-            if dur_and_amp:
-                data['all'][lab]['all']['dur'].append(data[i]['all'][lab]['all']['dur'])
-                data['all'][lab]['all']['amp'].append(data[i]['all'][lab]['all']['amp'])
-            if spike:
-                data['all'][lab]['all']['spiked'].append(data[i]['all'][lab]['all']['spiked'])
-                data['all'][lab]['all']['spiked_avg'].append(data[i]['all'][lab]['all']['spiked_avg'])
-                
+
+# collates meta data
+data['meta'] = {'tm':results.meta['meta']['tm'] if record_vm else [], 'cell type':cell_type, 'iterations':iterations,
+                       'n rounds':n_rounds, 'clustered':clus_info, 'avg':avg_over_rounds, 'durations':durations}
+if mod_type == 'ACh':
+    data['meta']['ACh info'] = mod_info
+else:
+    data['meta']['DA info'] = mod_info
     
-    # collates meta data
-    data['meta'] = {'tm':data[i]['all']['meta']['tm'], 'cell type':cell_type, 'iterations':iterations,
-                           'n rounds':n_rounds, 'clustered':clus_info, 'avg':avg_over_rounds}
-    mod_info['target'] = ['all']
-    mod_info['label'] = ['all']
-    if mod_type == 'ACh':
-        data['meta']['ACh info'] = mod_info
-    else:
-        data['meta']['DA info'] = mod_info
-        
-    if noise:
-        info = cf.params_for_input(cell_type, 'noise')
-        data['meta']['noise'] = info['noise']
-    if HFI:
-        info = cf.params_for_input(cell_type, 'HFI')
-        info['HFI']['stim_t'] = clus_info['params']['stim_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
-        info['HFI']['stop_t'] = clus_info['params']['stop_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
-        data['meta']['HFI'] = info['HFI']
-        
+if noise:
+    info = cf.params_for_input(cell_type, 'noise')
+    data['meta']['noise'] = info['noise']
+if HFI:
+    info = cf.params_for_input(cell_type, 'HFI')
+    info['HFI']['stim_t'] = clus_info['params']['stim_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
+    info['HFI']['stop_t'] = clus_info['params']['stop_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
+    data['meta']['HFI'] = info['HFI']
     
-    # grand averages data across cell iterations
-    if not HFI:
-        data['avg'] = {}
-        for lab in clus_info['label']:
-            data['avg'][lab] = {}
-            data['avg'][lab]['all'] = {}
-            data['avg'][lab]['all']['vm'] = np.ndarray.tolist(np.mean(data['all'][lab]['all']['vm'],axis=0))
-            data['avg'][lab]['all']['vm'] = np.ndarray.tolist(np.mean(data['avg'][lab]['all']['vm'],axis=0))
-            data['avg'][lab]['all']['dur'] = float(np.mean(data['all'][lab]['all']['dur']))
-            data['avg'][lab]['all']['amp'] = float(np.mean(data['all'][lab]['all']['amp']))
+
+# grand averages data across cell iterations
+if not HFI:
+    data['avg'] = {}
+    for lab in clus_info['label']:
+        data['avg'][lab] = {}
+        for mod in mod_labels[lab]:
+            data['avg'][lab][mod] = {}
+            data['avg'][lab][mod]['vm'] = np.mean(results.mean_trace([lab,mod,'vm']),axis=0) if record_vm else []
+            data['avg'][lab][mod]['dur'] = float(np.mean(data['all'][lab][mod]['dur']))
+            data['avg'][lab][mod]['amp'] = float(np.mean(data['all'][lab][mod]['amp']))
         
 
                     
@@ -361,7 +250,7 @@ else:
         
 # ===== save collated data =====
 folder = 'Data/'
-name = '{}_HFI[{}]+{}_{}-modulation-{}.json'.format(cell_type, HFI, HFI_delay, mod_type, mod_tar)
+name = '{}_HFI[{}]+{}_{}-modulation-{}.{}'.format(cell_type, HFI, HFI_delay, mod_type, mod_tar, 'json' if legacy_json else 'pkl')
 
 if trim_data:
     keys = ['all','meta']
@@ -372,6 +261,8 @@ if trim_data:
 cf.save_data(data,folder+name)
 print('Saving data as {}'.format(name))
 
+ledger.clear() # the results of the jobs are no longer needed
+
 
 
 h.quit()
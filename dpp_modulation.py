@@ -9,9 +9,11 @@ Thomas Binns (author), 29/01/21
 
 from   neuron           import h
 import numpy                as np
-import pickle
 import common_functions     as cf
+import model_registry       as registry
 import simulation_functions as sf
+from   result_store     import ResultStore
+from   executors        import get_executor
 import time
 
 
@@ -28,17 +30,7 @@ h.load_file('stdlib.hoc')
 h.load_file('import3d.hoc')
 
 # specs
-specs = {'dspn': {
-                    'N': 71,
-                    'lib': 'Libraries/D1_71bestFit_updRheob.pkl',
-                    'par': 'Params/params_dMSN.json',
-                    'morph': 'Morphologies/WT-dMSN_P270-20_1.02_SGA1-m24.swc'},
-         'ispn': {
-                    'N': 34,
-                    'lib': 'Libraries/D2_34bestFit_updRheob.pkl',
-                    'par': 'Params/params_iMSN.json',
-                    'morph': 'Morphologies/WT-iMSN_P270-09_1.01_SGA2-m1.swc'}
-        }
+specs = registry.specs
         
 
 # chose cell type ('ispn' or 'dspn') and model id(s) to simulate...
@@ -46,18 +38,17 @@ cell_type         = 'ispn'    # 'dspn'/'ispn'
 model_iterator    = list(range(specs[cell_type]['N']))  # range(specs[cell_type]['N']) gives all models; must be a list for saving data!
 # for dspn, 10 has lowest rheo, 54 has highest, 22 has mean, 41 has median; 22 is also average for experimental value
 # for ispn, 8 has mean and median; 1 is average for experimental value
+legacy_json = False # if True, data is saved as json (with traces as lists), otherwise traces are kept as numpy arrays and pickled
 if pc.id() == 0:
     print('Simulating {} cell(s) of type: {}'.format(len(model_iterator),cell_type))
     
 # stimulation details
 stim_data = cf.params_for_input(cell_type, 'ACh')
 
-# open library (channel distributions etc)   
-with open(specs[cell_type]['lib'], 'rb') as f:
-    model_sets = pickle.load(f, encoding="latin1")
-
 # model information to pass to simulations
-model_data = {'specs':specs[cell_type], 'cell_type':cell_type, 'model_sets':model_sets}
+model_data = {'specs':specs[cell_type], 'cell_type':cell_type}
+backend = None # executor of the simulations: 'pc' (ParallelContext bulletin board, over MPI), 'processes' (worker processes on this machine), or 'serial'; if None, 'pc' when run on more than one host, otherwise 'serial'
+n_workers = None # number of worker processes of the 'processes' backend (if None, one for each CPU)
 
 
 
@@ -72,42 +63,27 @@ mod_factors = cf.draw_factors_ACh(cell_type, mode='mean')
 start = time.time() # for timing simulations
 
 pc.runworker() # start workers for parallelisation
+executor = get_executor(pc, backend, n_workers)
 
-data = {}
-if pc.nhost() == 1: # use the serial form
-    
-    collate = 0
-    
-    for cell_n, cell_index in enumerate(model_iterator): # for each model
-        # simulate model
-        run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator)}
-        data[cell_index] = sf.ACh_modulation(model_data, stim_data, \
-            cell_index, run_info, mod_factors)
-            
-else: # use the bulleting board form
-    
-    collate = 1
+# store for the results of each simulation (job = position in model_iterator)
+store = ResultStore('temp_data/{}_modulation'.format(cell_type), n_jobs=len(model_iterator))
+
+for cell_n, cell_index in enumerate(model_iterator): # scatter processes
+    # simulate model
+    run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator)}
+    executor.submit(sf.ACh_modulation, model_data, stim_data, cell_index, \
+        run_info, mod_factors)
     
-    # clear temp data folder
-    folder = 'temp_data'
-    cf.clear_folder(folder,'.json')
+for data in executor.gather(): # gather results
+    # store results
+    keys_1 = list(data.keys())
+    keys_2 = list(data[keys_1[0]].keys())
+    store.save(model_iterator.index(data[keys_1[0]][keys_2[0]]['id']), data)
     
-    for cell_n, cell_index in enumerate(model_iterator): # scatter processes
-        # simulate model
-        run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator)}
-        pc.submit(sf.ACh_modulation, model_data, stim_data, cell_index, \
-            run_info, mod_factors)
-        
-    while pc.working(): # gather results
-        data = pc.pyret()
-        # save file to folder
-        keys_1 = list(data.keys())
-        keys_2 = list(data[keys_1[0]].keys())
-        name = '{}_{}_modulation'.format(cell_type,data[keys_1[0]][keys_2[0]]['id'])
-        cf.save_data(data,'{}/{}.json'.format(folder,name))
+store.close()
     
     
-pc.done() # end parallelisation
+executor.done() # end parallelisation
 
 
 # for timing simulations
@@ -119,18 +95,10 @@ print('Simulations completed (took %.0f secs).\nNow performing calculations/coll
 
 data_avg = {}
 
-if collate: # collates data if loading from files
-    
-    data_all = {}
-    
-    for n, i in enumerate(model_iterator):
-        # load data
-        name = '{}_{}_modulation'.format(cell_type,i)
-        data = cf.load_data('{}/{}.json'.format(folder,name))
-        # combine data
-        data_all[i] = data
-        
-    data = data_all
+# collates data from the result store
+data = {}
+for n, i in enumerate(model_iterator):
+    data[i] = store.load(n)
     
 
 # averages data
@@ -149,7 +117,8 @@ for i, clus_lab in enumerate(stim_data['clustered']['label']): # for each cluste
         data_avg[clus_lab][clus_lab]['dur'].append(data[cell_index][clus_lab][clus_lab]['dur'])
         data_avg[clus_lab][clus_lab]['amp'].append(data[cell_index][clus_lab][clus_lab]['amp'])
     
-    data_avg[clus_lab][clus_lab]['avg_vm'] = np.ndarray.tolist(np.mean(data_avg[clus_lab][clus_lab]['vm'],axis=0))
+    data_avg[clus_lab][clus_lab]['vm'] = np.array(data_avg[clus_lab][clus_lab]['vm'])
+    data_avg[clus_lab][clus_lab]['avg_vm'] = np.mean(data_avg[clus_lab][clus_lab]['vm'],axis=0)
     data_avg[clus_lab][clus_lab]['avg_rheo'] = float(np.mean(data_avg[clus_lab][clus_lab]['rheo']))
     data_avg[clus_lab][clus_lab]['avg_dur'] = float(np.mean(data_avg[clus_lab][clus_lab]['dur']))
     data_avg[clus_lab][clus_lab]['avg_amp'] = float(np.mean(data_avg[clus_lab][clus_lab]['amp']))
@@ -168,7 +137,8 @@ for i, clus_lab in enumerate(stim_data['clustered']['label']): # for each cluste
             data_avg[clus_lab][ACh_lab]['dur'].append(data[cell_index][clus_lab][ACh_lab]['dur'])
             data_avg[clus_lab][ACh_lab]['amp'].append(data[cell_index][clus_lab][ACh_lab]['amp'])
         
-        data_avg[clus_lab][ACh_lab]['avg_vm'] = np.ndarray.tolist(np.mean(data_avg[clus_lab][ACh_lab]['vm'],axis=0))
+        data_avg[clus_lab][ACh_lab]['vm'] = np.array(data_avg[clus_lab][ACh_lab]['vm'])
+        data_avg[clus_lab][ACh_lab]['avg_vm'] = np.mean(data_avg[clus_lab][ACh_lab]['vm'],axis=0)
         data_avg[clus_lab][ACh_lab]['avg_rheo'] = float(np.mean(data_avg[clus_lab][ACh_lab]['rheo']))
         data_avg[clus_lab][ACh_lab]['avg_dur'] = float(np.mean(data_avg[clus_lab][ACh_lab]['dur']))
         data_avg[clus_lab][ACh_lab]['avg_amp'] = float(np.mean(data_avg[clus_lab][ACh_lab]['amp']))
@@ -176,7 +146,7 @@ for i, clus_lab in enumerate(stim_data['clustered']['label']): # for each cluste
     
 # general simulation info
 data_avg['meta'] = {'cell_type':cell_type, 'specs':model_iterator,
-    'tm':data[cell_index][clus_lab][ACh_lab]['tm'], 'clus':[], 'ACh':[]}
+    'tm':np.array(data[cell_index][clus_lab][ACh_lab]['tm']), 'clus':[], 'ACh':[]}
 
 
 # clustered input-specific info
@@ -204,7 +174,7 @@ data_avg['meta']['ACh'] = {
    
 # ===== save collated data =====
 folder = 'Data/'
-name = '{}_n{}_modulation.json'.format(cell_type,stim_data['clustered']['params']['stim_n'])
+name = '{}_n{}_modulation.{}'.format(cell_type,stim_data['clustered']['params']['stim_n'],'json' if legacy_json else 'pkl')
 cf.save_data(data_avg,folder+name)
 print('Saving data as {}'.format(name))
 
@@ -6,9 +6,11 @@ Provides clustered input to a SPN's dendrites (a distal dendrite and proximal de
 
 from   neuron               import h
 import numpy                    as np
-import pickle
 import common_functions         as cf
+import model_registry           as registry
 import simulation_functions     as sf
+from   result_store         import ResultStore
+from   executors            import get_executor
 import time
 
 
@@ -27,17 +29,7 @@ h.load_file('stdlib.hoc')
 h.load_file('import3d.hoc')
 
 # specs
-specs = {'dspn': {
-                    'N': 71,
-                    'lib': 'Libraries/D1_71bestFit_updRheob.pkl',
-                    'par': 'Params/params_dMSN.json',
-                    'morph': 'Morphologies/WT-dMSN_P270-20_1.02_SGA1-m24.swc'},
-         'ispn': {
-                    'N': 34,
-                    'lib': 'Libraries/D2_34bestFit_updRheob.pkl',
-                    'par': 'Params/params_iMSN.json',
-                    'morph': 'Morphologies/WT-iMSN_P270-09_1.01_SGA2-m1.swc'}
-        }
+specs = registry.specs
         
 # chose cell type ('ispn' or 'dspn') and model id(s) to simulate...
 
@@ -52,6 +44,7 @@ model_iterator = [0,1]
 iterations = model_iterator.copy()
 
 trim_data = True
+legacy_json = False # if True, data is saved as json (with traces as lists), otherwise traces are kept as numpy arrays and pickled
 
 n_rounds = 1
 avg_over_rounds = True
@@ -66,56 +59,55 @@ if pc.id() == 0:
     print('Simulating {} cell iteration(s) of type: {}'.format(len(model_iterator),cell_type), \
           flush=True)
    
-# open library (channel distributions etc)   
-with open(specs[cell_type]['lib'], 'rb') as f:
-    model_sets = pickle.load(f, encoding="latin1")
-
 
 
 # ===== simulate model(s) =====
 # model information to pass to simulations
-model_data = {'specs':specs[cell_type], 'cell_type':cell_type, 'model_sets':model_sets}
+model_data = {'specs':specs[cell_type], 'cell_type':cell_type}
+master_seed = None # if given, each job's random numbers (noise, modulation factors, etc...) are drawn from streams derived from this seed, the model, and the round, so runs are reproducible on any number of hosts
+model_data['master_seed'] = master_seed
+steady_state = None # if given (a folder, or True to only keep them while running), simulations start from the resting state of each model (found once, and saved in the folder) at the start of the baseline before the clustered inputs, rather than settling from -80 mV from 0 ms
+model_data['steady_state'] = steady_state
+backend = None # executor of the simulations: 'pc' (ParallelContext bulletin board, over MPI), 'processes' (worker processes on this machine), or 'serial'; if None, 'pc' when run on more than one host, otherwise 'serial'
+n_workers = None # number of worker processes of the 'processes' backend (if None, one for each CPU)
 noise = 0
 HFI = 0
-HFI_delay = 0
+HFI_delay = 0 # or a list of delays (e.g. list(range(0,100+1,20)); see stats_spiking.py), simulated by branching from one simulation of each target, and saved separately
 dur_and_amp = 1
 spike = 0
+record_vm = 1 # if False, the membrane potential is not recorded (e.g. if only spikes are analysed; needs dur_and_amp to be False), and no traces are kept
+model_data['record_vm'] = record_vm
 
 start = time.time() # for timing simulations
 
 pc.runworker() # start workers for parallelisation
-
-# clear temp data folder
-folder = 'temp_data'
-cf.clear_folder(folder,'.json')
-
-if pc.nhost() == 1: # use the serial form
-    
-    for cell_n in range(len(model_iterator)): # for each model
-        cell_index = model_iterator[cell_n]
-        # simulate model
-        run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator), 'round':model_round[cell_n]}
-        data = sf.dpp_generation(model_data, cell_index, run_info, noise, HFI, HFI_delay, dur_and_amp, spike)
-        # save file to folder
-        name = '{}_{}-{}_validation'.format(cell_type,data['meta']['round'], data['meta']['id'])
-        cf.save_data(data,'{}/{}.json'.format(folder, name))
-            
-else: # use the bulleting board form
+executor = get_executor(pc, backend, n_workers)
+
+# stores for the results of each simulation (job = round*n iterations + iteration), for each HFI delay
+if isinstance(HFI_delay, list):
+    stores = {delay:ResultStore('temp_data/{}_generation_HFI+{}'.format(cell_type, delay), n_jobs=len(model_iterator))
+              for delay in HFI_delay}
+else:
+    stores = {HFI_delay:ResultStore('temp_data/{}_generation'.format(cell_type), n_jobs=len(model_iterator))}
+
+for cell_n in range(len(model_iterator)): # scatter processes
+    cell_index = model_iterator[cell_n]
+    # simulate model
+    run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator), 'round':model_round[cell_n]}
+    executor.submit(sf.dpp_generation, model_data, cell_index, run_info, noise, HFI, HFI_delay, dur_and_amp, spike)
     
-    for cell_n in range(len(model_iterator)): # scatter processes
-        cell_index = model_iterator[cell_n]
-        # simulate model
-        run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator), 'round':model_round[cell_n]}
-        pc.submit(sf.dpp_generation, model_data, cell_index, run_info, noise, HFI, HFI_delay, dur_and_amp, spike)
-        
-    while pc.working(): # gather results
-        data = pc.pyret()
-        # save file to folder
-        name = '{}_{}-{}_validation'.format(cell_type,data['meta']['round'], data['meta']['id'])
-        cf.save_data(data,'{}/{}.json'.format(folder, name))
+for data in executor.gather(): # gather results
+    if not isinstance(HFI_delay, list):
+        data = {HFI_delay:data}
+    # store results
+    for delay, delay_data in data.items():
+        stores[delay].save(delay_data['meta']['round']*len(iterations) + iterations.index(delay_data['meta']['id']), delay_data)
+
+for store in stores.values():
+    store.close()
   
   
-pc.done() # end parallelisation
+executor.done() # end parallelisation
 
 
 # for timing simulations
@@ -123,112 +115,83 @@ print('Simulations completed (took %.0f secs).\nNow performing calculations/coll
 
  
 
-# ===== combine and/or average data =====
+# ===== combine and/or average data (for each HFI delay) =====
 
-info = cf.params_for_input(cell_type, 'clustered')
-clus_info = info['clustered']
+for HFI_delay, store in stores.items():
+    
+    info = cf.params_for_input(cell_type, 'clustered')
+    clus_info = info['clustered']
 
-# collates data loaded from files
-data_all = {}
+    data = {i:{} for i in range(len(iterations))}
 
-for i, iteration in enumerate(iterations):
-    round_data = {}
-    for r in range(n_rounds):
-        # load data
-        name = name = '{}_{}-{}_validation'.format(cell_type,r,iteration)
-        data = cf.load_data('{}/{}.json'.format(folder,name))
-        round_data[r] = data
-    # combine data
-    data_all[i] = round_data
-    
-data = data_all
-    
-            
-# collates data for each cell iteration
-for i in range(len(iterations)):
+    # collates data across cell iterations and rounds (of shape [n iterations, n rounds, ...])
+    data['all'] = {}
+
+    for lab in clus_info['label']:
     
-    data[i]['all'] = {}
+        data['all'][lab] = {'vm':np.array(store.trace([lab,'vm'], n_rounds)) if record_vm else [], 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}
     
-    for lab in clus_info['label']:
-        
-        data[i]['all'][lab] = {'vm':[], 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}
-        
-        for j in range(n_rounds):
-            
-            data[i]['all'][lab]['vm'].append(data[i][j][lab]['vm'])
-            if dur_and_amp:
-                data[i]['all'][lab]['dur'].append(data[i][j][lab]['dur'])
-                data[i]['all'][lab]['amp'].append(data[i][j][lab]['amp'])  
-            if spike:
-                data[i]['all'][lab]['spiked'].append(data[i][j][lab]['spiked'])
-        
+        if dur_and_amp:
+            for feature in ['dur', 'amp']:
+                values = store.values([lab,feature], n_rounds)
+                if avg_over_rounds:
+                    values = np.mean(values,axis=1)
+                data['all'][lab][feature] = values
         if spike:
-            data[i]['all'][lab]['spiked_avg'] = np.mean(data[i]['all'][lab]['spiked'],axis=0).tolist()
-        if avg_over_rounds:
-            if dur_and_amp:
-                data[i]['all'][lab]['dur'] = np.mean(data[i]['all'][lab]['dur'],axis=0).tolist()
-                data[i]['all'][lab]['amp'] = np.mean(data[i]['all'][lab]['amp'],axis=0).tolist()
-            
-    data[i]['all']['meta'] = data[i][j]['meta']
+            spiked = store.values([lab,'spiked'], n_rounds)
+            data['all'][lab]['spiked'] = spiked
+            data['all'][lab]['spiked_avg'] = np.mean(spiked,axis=1)
         
-
-# collates data across cell iterations
-data['all'] = {}
-
-for lab in clus_info['label']:
-    
-    data['all'][lab] = {'vm':[], 'dur':[], 'amp':[], 'spiked':[], 'spiked_avg':[]}    
-
-    for i in range(len(iterations)):
         
-        data['all'][lab]['vm'].append(data[i]['all'][lab]['vm'])
-        if dur_and_amp:
-            data['all'][lab]['dur'].append(data[i]['all'][lab]['dur'])
-            data['all'][lab]['amp'].append(data[i]['all'][lab]['amp'])
-        if spike:
-            data['all'][lab]['spiked'].append(data[i]['all'][lab]['spiked'])
-            data['all'][lab]['spiked_avg'].append(data[i]['all'][lab]['spiked_avg'])
+    # collates data for each cell iteration
+    if not trim_data:
+        for i in range(len(iterations)):
+            for r in range(n_rounds):
+                data[i][r] = store.load(r*len(iterations) + i)
+            data[i]['all'] = {}
+            for lab in clus_info['label']:
+                data[i]['all'][lab] = {key:(value[i] if len(value) else []) for key, value in data['all'][lab].items()}
+            data[i]['all']['meta'] = data[i][r]['meta']
             
 
-# collates meta data
-data['meta'] = {'tm':data[i]['all']['meta']['tm'], 'cell type':cell_type, 'iterations':iterations,
-                       'n rounds':n_rounds, 'clustered':clus_info, 'avg':avg_over_rounds}
-if noise:
-    info = cf.params_for_input(cell_type, 'noise')
-    data['meta']['noise'] = info['noise']
-if HFI:
-    info = cf.params_for_input(cell_type, 'HFI')
-    info['HFI']['stim_t'] = clus_info['params']['stim_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
-    info['HFI']['stop_t'] = clus_info['params']['stop_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
-    data['meta']['HFI'] = info['HFI']
+    # collates meta data
+    data['meta'] = {'tm':np.array(store.trace(['meta','tm'])[-1,0]) if record_vm else [], 'cell type':cell_type, 'iterations':iterations,
+                           'n rounds':n_rounds, 'clustered':clus_info, 'avg':avg_over_rounds}
+    if noise:
+        info = cf.params_for_input(cell_type, 'noise')
+        data['meta']['noise'] = info['noise']
+    if HFI:
+        info = cf.params_for_input(cell_type, 'HFI')
+        info['HFI']['stim_t'] = clus_info['params']['stim_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
+        info['HFI']['stop_t'] = clus_info['params']['stop_t'] + clus_info['params']['stim_n']*clus_info['params']['isi'] + HFI_delay
+        data['meta']['HFI'] = info['HFI']
     
 
-# grand averages data across cell iterations
-if not HFI:
-    data['avg'] = {}
-    for lab in clus_info['label']:
-        data['avg'][lab] = {}
-        data['avg'][lab]['vm'] = np.ndarray.tolist(np.mean(data['all'][lab]['vm'],axis=0))
-        data['avg'][lab]['vm'] = np.ndarray.tolist(np.mean(data['avg'][lab]['vm'],axis=0))
-        data['avg'][lab]['dur'] = float(np.mean(data['all'][lab]['dur']))
-        data['avg'][lab]['amp'] = float(np.mean(data['all'][lab]['amp']))
+    # grand averages data across cell iterations
+    if not HFI:
+        data['avg'] = {}
+        for lab in clus_info['label']:
+            data['avg'][lab] = {}
+            data['avg'][lab]['vm'] = np.mean(np.mean(store.trace([lab,'vm'], n_rounds),axis=0),axis=0) if record_vm else []
+            data['avg'][lab]['dur'] = float(np.mean(data['all'][lab]['dur']))
+            data['avg'][lab]['amp'] = float(np.mean(data['all'][lab]['amp']))
         
 
                     
             
         
-# ===== save collated data =====
-folder = 'Data/'
-name = '{}_HFI[{}]+{}_validation.json'.format(cell_type,HFI,HFI_delay)
-
-if trim_data:
-    keys = ['all','meta']
-    if not HFI:
-        keys.append('avg')
-    data = cf.trim_data(data, keep_keys=keys)
-
-cf.save_data(data,folder+name)
-print('Saving data as {}'.format(name))
+    # ===== save collated data =====
+    folder = 'Data/'
+    name = '{}_HFI[{}]+{}_validation.{}'.format(cell_type,HFI,HFI_delay,'json' if legacy_json else 'pkl')
+
+    if trim_data:
+        keys = ['all','meta']
+        if not HFI:
+            keys.append('avg')
+        data = cf.trim_data(data, keep_keys=keys)
+
+    cf.save_data(data,folder+name)
+    print('Saving data as {}'.format(name))
 
 
 
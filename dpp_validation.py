@@ -9,9 +9,11 @@ Thomas Binns (author), 27/01/21
 
 from   neuron           import h
 import numpy                as np
-import pickle
 import common_functions     as cf
+import model_registry       as registry
 import simulation_functions as sf
+from   result_store     import ResultStore
+from   executors        import get_executor
 import time
 
 
@@ -32,17 +34,7 @@ h.load_file('stdlib.hoc')
 h.load_file('import3d.hoc')
 
 # specs
-specs = {'dspn': {
-                    'N': 71,
-                    'lib': 'Libraries/D1_71bestFit_updRheob.pkl',
-                    'par': 'Params/params_dMSN.json',
-                    'morph': 'Morphologies/WT-dMSN_P270-20_1.02_SGA1-m24.swc'},
-         'ispn': {
-                    'N': 34,
-                    'lib': 'Libraries/D2_34bestFit_updRheob.pkl',
-                    'par': 'Params/params_iMSN.json',
-                    'morph': 'Morphologies/WT-iMSN_P270-09_1.01_SGA2-m1.swc'}
-        }
+specs = registry.specs
         
 
 # chose cell type ('ispn' or 'dspn') and model id(s) to simulate...
@@ -55,6 +47,8 @@ model_iterator = list(range(specs[cell_type]['N'])) # use model_iterator = range
 # for dspn, 10 has lowest rheo, 54 has highest, 22 has mean, 41 has median; 22 is also average for experimental value
 # for ispn, 8 has mean and median; 1 is average for experimental value
 
+legacy_json = False # if True, data is saved as json (with traces as lists), otherwise traces are kept as numpy arrays and pickled
+
 if pc.id() == 0:
     print('Simulating {} cell iteration(s) of type: {}'.format(len(model_iterator),cell_type), \
           flush=True)
@@ -66,57 +60,41 @@ target = stim_info['clustered']['target']
 target_labels = stim_info['clustered']['label']
 stim_data = stim_info['clustered']['params']
 
-# open library (channel distributions etc)   
-with open(specs[cell_type]['lib'], 'rb') as f:
-    model_sets = pickle.load(f, encoding="latin1")
-    
 
 # ===== simulate model(s) =====
     
 data = {}
 
 # model information to pass to simulations
-model_data = {'specs':specs[cell_type], 'cell_type':cell_type, 'model_sets':model_sets, \
+model_data = {'specs':specs[cell_type], 'cell_type':cell_type, \
               'target':target, 'target_labels':target_labels}
+model_data['cache'] = None # if given, the folder of a cache of simulated jobs, which are only simulated again if something that changes their results has changed
+backend = None # executor of the simulations: 'pc' (ParallelContext bulletin board, over MPI), 'processes' (worker processes on this machine), or 'serial'; if None, 'pc' when run on more than one host, otherwise 'serial'
+n_workers = None # number of worker processes of the 'processes' backend (if None, one for each CPU)
 
 start = time.time() # for timing simulations
 
 pc.runworker() # start workers for parallelisation
+executor = get_executor(pc, backend, n_workers)
 
+# store for the results of each simulation (job = position in model_iterator)
+store = ResultStore('temp_data/{}_validation'.format(cell_type), n_jobs=len(model_iterator))
 
-if pc.nhost() == 1: # use the serial form
-    
-    collate = 0
-    
-    for cell_n, cell_index in enumerate(model_iterator): # for each model
-        # simulate model
-        run_info = {'curr_n':cell_n, 'tot_n':len(model_iterator)}
-        data[cell_index] = sf.dpp_validation(model_data, stim_data, \
-                          cell_index, run_info)
-            
-else: # use the bulleting board form
-    
-    collate = 1
+for cell_n, cell_index in enumerate(model_iterator): # scatter processes
+    # simulate model
+    sim_info = {'curr_n':cell_n, 'tot_n':len(model_iterator)}
+    executor.submit(sf.run_cached,'dpp_validation',model_data,cell_index,sim_info,{'stim_data':stim_data})
+    #sys.stdout.flush()
     
-    # clear temp data folder
-    folder = 'temp_data'
-    cf.clear_folder(folder,'.json')
+for data in executor.gather(): # gather results
+    # store results
+    keys = list(data.keys())
+    store.save(model_iterator.index(data[keys[0]]['id']), data)
     
-    for cell_n, cell_index in enumerate(model_iterator): # scatter processes
-        # simulate model
-        sim_info = {'curr_n':cell_n, 'tot_n':len(model_iterator)}
-        pc.submit(sf.dpp_validation,model_data,stim_data,cell_index,sim_info)
-        #sys.stdout.flush()
-        
-    while pc.working(): # gather results
-        data = pc.pyret()
-        # save file to folder
-        keys = list(data.keys())
-        name = '{}_{}_validation'.format(data[keys[0]]['cell_type'],data[keys[0]]['id'])
-        cf.save_data(data,'{}/{}.json'.format(folder,name))
+store.close()
   
   
-pc.done() # end parallelisation
+executor.done() # end parallelisation
 
 
 # for timing simulations
@@ -128,18 +106,10 @@ print('Simulations completed (took %.0f secs).\nNow performing calculations/coll
 
 data_avg = {}
 
-if collate: # collates data if loading from files
-    
-    data_all = {}
-    
-    for n, i in enumerate(model_iterator):
-        # load data
-        name = '{}_{}_validation'.format(cell_type,i)
-        data = cf.load_data('{}/{}.json'.format(folder,name))
-        # combine data
-        data_all[i] = data
-        
-    data = data_all
+# collates data from the result store
+data = {}
+for n, i in enumerate(model_iterator):
+    data[i] = store.load(n)
         
 
 # averages data    
@@ -155,12 +125,13 @@ for i, lab in enumerate(target_labels):
         data_avg[lab]['dur'].append(data[cell_index][lab]['dur'])
         data_avg[lab]['amp'].append(data[cell_index][lab]['amp'])
         
-    data_avg[lab]['avg_vm'] = np.ndarray.tolist(np.mean(data_avg[lab]['vm'],axis=0))
+    data_avg[lab]['vm'] = np.array(data_avg[lab]['vm'])
+    data_avg[lab]['avg_vm'] = np.mean(data_avg[lab]['vm'],axis=0)
     data_avg[lab]['avg_rheo'] = float(np.mean(data_avg[lab]['rheo']))
     data_avg[lab]['avg_dur'] = float(np.mean(data_avg[lab]['dur']))
     data_avg[lab]['avg_amp'] = float(np.mean(data_avg[lab]['amp']))
     
-data_avg['meta'] = {'cell_type':cell_type, 'tm': data[cell_index][lab]['tm'], \
+data_avg['meta'] = {'cell_type':cell_type, 'tm': np.array(data[cell_index][lab]['tm']), \
                     'dist': [data[cell_index][target_labels[0]]['dist'],data[cell_index][target_labels[1]]['dist']], \
                     'stim_n':stim_data['stim_n'], 'isi':stim_data['isi'], \
                     'stim_t':stim_data['stim_t'], 'stop_t':stim_data['stop_t'], \
@@ -171,7 +142,7 @@ data_avg['meta'] = {'cell_type':cell_type, 'tm': data[cell_index][lab]['tm'], \
 
 # ===== save collated data =====
 folder = 'Data/'
-name = '{}_n{}_validation.json'.format(cell_type,stim_data['stim_n'])
+name = '{}_n{}_validation.{}'.format(cell_type,stim_data['stim_n'],'json' if legacy_json else 'pkl')
 cf.save_data(data_avg,folder+name)
 print('Saving data as {}'.format(name))
 
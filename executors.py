@@ -0,0 +1,240 @@
+'''
+Executors running simulation jobs (e.g. the drivers in simulation_functions),
+all with the same API: jobs are submitted with submit(func, *args), and their
+results are gathered as they finish with gather().
+
+Backends:
+    - BulletinBoardExecutor: the bulletin board of a NEURON ParallelContext
+        (over MPI; e.g. mpiexec -n 4 python dpp_mod.py)
+    - ProcessExecutor: a pool of worker processes on one machine (no MPI
+        needed), each with its own NEURON instance, in which the mechanisms are
+        loaded once
+    - SerialExecutor: jobs run one after another in this process
+
+Functions submitted must be defined at the top level of a module (not in a
+script), so that they can be sent to the workers.
+'''
+
+import concurrent.futures
+import multiprocessing
+import os
+from   neuron           import h
+import neuron               as nrn
+
+
+
+class SerialExecutor():
+    '''
+    Runs jobs one after another in this process, in the order submitted (when
+    their results are gathered).
+    '''
+
+    def __init__(self):
+
+        self.n_workers = 1
+        self._jobs = []
+
+
+    def submit(self, func, *args):
+        '''
+        Submits a job.
+
+        INPUT(S):
+            - func: function running the job [function]
+            - args: (positional) arguments of func
+
+        OUTPUT(S):
+            None
+        '''
+
+        self._jobs.append((func, args))
+
+
+    def gather(self):
+        '''
+        Runs the jobs submitted and gives their results.
+
+        INPUT(S):
+            None
+
+        OUTPUT(S):
+            - results: results of each job [generator]
+        '''
+
+        while self._jobs:
+            func, args = self._jobs.pop(0)
+            yield func(*args)
+
+
+    def done(self):
+        '''
+        Ends the executor.
+        '''
+
+        self._jobs = []
+
+
+
+
+class BulletinBoardExecutor():
+    '''
+    Runs jobs through the bulletin board of a ParallelContext, whose workers
+    must have been started (with pc.runworker()). Results are given in the
+    order the jobs finish.
+    '''
+
+    def __init__(self, pc):
+        '''
+        INPUT(S):
+            - pc: parallel context [h.ParallelContext]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.pc = pc
+        self.n_workers = pc.nhost()
+
+
+    def submit(self, func, *args):
+        '''
+        Submits a job (see SerialExecutor.submit).
+        '''
+
+        self.pc.submit(func, *args)
+
+
+    def gather(self):
+        '''
+        Gives the results of the jobs submitted as they finish (see
+        SerialExecutor.gather).
+        '''
+
+        while self.pc.working():
+            yield self.pc.pyret()
+
+
+    def done(self):
+        '''
+        Ends the executor, releasing the workers (pc.done()).
+        '''
+
+        self.pc.done()
+
+
+
+
+def _init_worker(mechanisms):
+    '''
+    Prepares a worker process of a ProcessExecutor: loads the mechanisms
+    (unless already loaded in the process it was started from) and the hoc
+    libraries used to build cells.
+    '''
+
+    if mechanisms and mechanisms not in getattr(nrn, 'nrn_dll_loaded', []):
+        nrn.load_mechanisms(mechanisms)
+
+    h.load_file('stdlib.hoc')
+    h.load_file('import3d.hoc')
+
+
+
+
+class ProcessExecutor():
+    '''
+    Runs jobs in a pool of worker processes on this machine, each with its own
+    NEURON instance. Results are given in the order the jobs finish.
+
+    Workers are forked from this process (scripts are not guarded by
+    if __name__ == '__main__', so cannot be re-imported by spawned workers),
+    so should be created before any cells are built.
+    '''
+
+    def __init__(self,  n_workers=None,
+                        mechanisms='mechanisms/single'):
+        '''
+        INPUT(S):
+            - n_workers: number of worker processes. If None, one for each CPU
+                available (default None) [int]
+            - mechanisms: folder of the mechanisms loaded in each worker
+                (default 'mechanisms/single') [str]
+
+        OUTPUT(S):
+            None
+        '''
+
+        if n_workers is None:
+            n_workers = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+        self.n_workers = n_workers
+        self._pool = concurrent.futures.ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('fork'),
+                                                            initializer=_init_worker, initargs=(mechanisms,))
+        self._futures = set()
+
+
+    def submit(self, func, *args):
+        '''
+        Submits a job (see SerialExecutor.submit).
+        '''
+
+        self._futures.add(self._pool.submit(func, *args))
+
+
+    def gather(self):
+        '''
+        Gives the results of the jobs submitted as they finish (see
+        SerialExecutor.gather).
+        '''
+
+        while self._futures:
+            future = next(concurrent.futures.as_completed(self._futures))
+            self._futures.remove(future)
+            yield future.result()
+
+
+    def done(self):
+        '''
+        Ends the executor, shutting down the worker processes.
+        '''
+
+        self._pool.shutdown()
+        self._futures = set()
+
+
+
+
+def get_executor(pc, backend=None, n_workers=None, mechanisms='mechanisms/single'):
+    '''
+    Gets an executor for a simulation run. Must only be called on the master
+    rank (i.e. after pc.runworker()).
+
+    INPUT(S):
+        - pc: parallel context [h.ParallelContext]
+        - backend: 'pc' (bulletin board of pc), 'processes' (pool of worker
+            processes), or 'serial'. If None, 'pc' if running on more than one
+            host, otherwise 'serial' (default None) [str]
+        - n_workers: number of worker processes of the 'processes' backend (if
+            None, one for each CPU) (default None) [int]
+        - mechanisms: folder of the mechanisms loaded in worker processes
+            (default 'mechanisms/single') [str]
+
+    OUTPUT(S):
+        - executor: the executor [SerialExecutor, BulletinBoardExecutor, or
+            ProcessExecutor]
+    '''
+
+    if backend is None:
+        backend = 'pc' if pc.nhost() > 1 else 'serial'
+
+    if backend == 'pc':
+        return BulletinBoardExecutor(pc)
+
+    if pc.nhost() > 1:
+        raise ValueError("The '{}' backend cannot be used when running on more than one host (use 'pc').".format(backend))
+
+    if backend == 'processes':
+        return ProcessExecutor(n_workers, mechanisms)
+    elif backend == 'serial':
+        return SerialExecutor()
+    else:
+        raise ValueError("The requested backend is not supported.\nOnly 'pc', 'processes', and 'serial' are recognised.")
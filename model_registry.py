@@ -0,0 +1,128 @@
+'''
+Per-process registry of the model files (parameter files, model libraries, and
+mechanism lists).
+
+Each file is loaded once per process and then shared by every cell built from
+it, so repeated builds (and bulletin board jobs, which only need the index of
+the cell specification) do not re-read or re-send the same data. Files are
+keyed by path and modification time, so a file that changes on disk is loaded
+again.
+'''
+
+import json
+import os
+import pickle
+
+
+
+# model specifications for each cell type
+specs = {'dspn': {
+                    'N': 71,
+                    'lib': 'Libraries/D1_71bestFit_updRheob.pkl',
+                    'par': 'Params/params_dMSN.json',
+                    'morph': 'Morphologies/WT-dMSN_P270-20_1.02_SGA1-m24.swc'},
+         'ispn': {
+                    'N': 34,
+                    'lib': 'Libraries/D2_34bestFit_updRheob.pkl',
+                    'par': 'Params/params_iMSN.json',
+                    'morph': 'Morphologies/WT-iMSN_P270-09_1.01_SGA2-m1.swc'}
+        }
+
+
+# loaded files; keyed by (path, modification time)
+_loaded = {}
+
+
+
+
+def _load(path, loader):
+    '''
+    Loads a file with the given function, unless it has already been loaded
+    in this process (and not changed since).
+    '''
+
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path))
+
+    if key not in _loaded:
+        _loaded[key] = loader(path)
+
+    return _loaded[key]
+
+
+
+
+def _read_json(path):
+
+    with open(path) as file:
+        return json.load(file)
+
+
+
+
+def _read_pickle(path):
+
+    with open(path, 'rb') as f:
+        return pickle.load(f, encoding="latin1")
+
+
+
+
+def load_params(path):
+    '''
+    Gets the contents of a parameter file. The returned object is shared
+    between all callers and should not be modified.
+
+    INPUT(S):
+        - path: path to the parameter file [str]
+
+    OUTPUT(S):
+        - params: the parsed json file [dict or list]
+    '''
+
+    return _load(path, _read_json)
+
+
+
+
+def load_mechanisms(path):
+    '''
+    Gets the mechanism lists of a (network) model. The returned object is
+    shared between all callers and should not be modified.
+
+    INPUT(S):
+        - path: path to the mechanism file [str]
+
+    OUTPUT(S):
+        - mechanisms: mechanisms to insert, keyed by section list [dict]
+    '''
+
+    return _load(path, _read_json)
+
+
+
+
+def load_library(path):
+    '''
+    Gets a model library (channel distributions, rheobase, etc... of each cell
+    specification). The returned object is shared between all callers and
+    should not be modified.
+
+    INPUT(S):
+        - path: path to the pickled library [str]
+
+    OUTPUT(S):
+        - model_sets: cell specifications, keyed by cell index [dict]
+    '''
+
+    return _load(path, _read_pickle)
+
+
+
+
+def clear():
+    '''
+    Removes all loaded files.
+    '''
+
+    _loaded.clear()
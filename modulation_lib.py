@@ -185,7 +185,7 @@ class ACh():
                 mech.max2 = self.mod_dict[mech.name()]
                 if reset:
                     mech.lev2 = 0
-                if len(self.play) and mech.name() in self.play:
+                elif len(self.play) and mech.name() in self.play:
                     self.play[mech.name()].play(mech._ref_lev2, self.dt) # ._ref_
                 else:
                     mech.lev2 = 1
@@ -286,7 +286,8 @@ class set_ACh():
                     play['kaf'][t+1/dt] == 10)
             - dt: size of the time step in the simulation used for determining
                 when to apply modulation scaling associated with 'play'
-                (default: 0.025; units of ms) [number]
+                (default: 0.025; units of ms). Alternatively, the times of 
+                the elements of the vectors in 'play' [number or h.Vector]
         
         OUTPUT(S):
             None
@@ -310,26 +311,27 @@ class set_ACh():
         
         # gets targets for modulation
         if 'all' in self.target:
-            self.target = [str(x) for x in self.cell.allseclist]
+            self.target = list(self.cell.allsecnames)
         
         # performs modulation of cell
         self._set_modulation()
         
         
-    def _set_modulation(self):
+    def _set_modulation(self, reset=False):
         '''
-        Modulates the requested segments of the requested sections.
+        Modulates (or, if reset, removes the modulation of) the requested 
+        segments of the requested sections.
         '''
         for tar in self.target:
-            for sec in self.cell.allseclist:
-                if sec.name() == tar:
-                    if self.target_x == 'all':
-                        for seg in sec:
-                            self._mod_mech(seg)
-                            self._mod_chan(seg)
-                    else:
-                        self._mod_mech(sec(self.target_x))
-                        self._mod_chan(sec(self.target_x))
+            if tar in self.cell.name2sec:
+                sec = self.cell.name2sec[tar]
+                if self.target_x == 'all':
+                    for seg in sec:
+                        self._mod_mech(seg, reset=reset)
+                        self._mod_chan(seg, reset=reset)
+                else:
+                    self._mod_mech(sec(self.target_x), reset=reset)
+                    self._mod_chan(sec(self.target_x), reset=reset)
                 
                 
     def _mod_mech(self, seg, reset=False): # shift conductance
@@ -351,7 +353,7 @@ class set_ACh():
                     mech.max2 = self.mod_dict[mech.name()]
                     if reset:
                         mech.lev2 = 0
-                    if len(self.play) and mech.name() in self.play:
+                    elif len(self.play) and mech.name() in self.play:
                         self.play[mech.name()].play(mech._ref_lev2, self.dt)
                     else:
                         mech.lev2 = 1
@@ -396,11 +398,7 @@ class set_ACh():
             for trans in self.play.values():
                 trans.play_remove()
                 
-        for tar in self.target:
-            for sec in self.cell.allseclist:
-                if sec.name() == tar:
-                    self._mod_mech(sec(self.target_x), reset=True)
-                    self._mod_chan(sec(self.target_x), reset=True)
+        self._set_modulation(reset=True)
     
 
 
@@ -444,7 +442,8 @@ class set_DA():
                     play['kaf'][t+1/dt] == 10)
             - dt: size of the time step in the simulation used for determining
                 when to apply modulation scaling associated with 'play'
-                (default: 0.025; units of ms) [number]
+                (default: 0.025; units of ms). Alternatively, the times of 
+                the elements of the vectors in 'play' [number or h.Vector]
         
         OUTPUT(S):
             None
@@ -467,26 +466,27 @@ class set_DA():
         
         # gets targets for modulation
         if 'all' in self.target:
-            self.target = [str(x) for x in self.cell.allseclist]
+            self.target = list(self.cell.allsecnames)
         
         # performs modulation of cell
         self._set_modulation()
         
         
-    def _set_modulation(self):
+    def _set_modulation(self, reset=False):
         '''
-        Modulates the requested segments of the requested sections.
+        Modulates (or, if reset, removes the modulation of) the requested 
+        segments of the requested sections.
         '''
         for tar in self.target:
-            for sec in self.cell.allseclist:
-                if sec.name() == tar:
-                    if self.target_x == 'all':
-                        for seg in sec:
-                            self._mod_mech(seg)
-                            self._mod_chan(seg)
-                    else:
-                        self._mod_mech(sec(self.target_x))
-                        self._mod_chan(sec(self.target_x))
+            if tar in self.cell.name2sec:
+                sec = self.cell.name2sec[tar]
+                if self.target_x == 'all':
+                    for seg in sec:
+                        self._mod_mech(seg, reset=reset)
+                        self._mod_chan(seg, reset=reset)
+                else:
+                    self._mod_mech(sec(self.target_x), reset=reset)
+                    self._mod_chan(sec(self.target_x), reset=reset)
                 
                 
     def _mod_mech(self, seg, reset=False): # shift conductance
@@ -499,7 +499,7 @@ class set_DA():
                 mech.maxMod = self.mod_dict[mech.name()]
                 if reset:
                     mech.level = 0
-                if len(self.play) and mech.name() in self.play:
+                elif len(self.play) and mech.name() in self.play:
                     self.play[mech.name()].play(mech._ref_level, self.dt)
                 else:
                     mech.level = 1
@@ -544,11 +544,7 @@ class set_DA():
             for trans in self.play.values():
                 trans.play_remove()
                 
-        for tar in self.target:
-            for sec in self.cell.allseclist:
-                if sec.name() == tar:
-                    self._mod_mech(sec(self.target_x), reset=True)
-                    self._mod_chan(sec(self.target_x), reset=True)
+        self._set_modulation(reset=True)
                     
                     
                     
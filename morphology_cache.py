@@ -0,0 +1,145 @@
+'''
+Per-process cache of cell morphologies.
+
+Each SWC file is parsed once (through Import3d) into a compact array
+representation of the section topology and 3D points. New cells are then
+stamped out from this template without re-reading the file, and any number of
+independent copies of the same morphology can exist in one process.
+'''
+
+from   neuron           import h
+import numpy                as np
+import os
+
+
+
+# templates of the parsed morphologies; keyed by (path, modification time)
+_templates = {}
+
+
+
+
+def get_template(morphology):
+    '''
+    Gets the compact representation of a morphology, parsing the SWC file only
+    if it has not been parsed in this process before (or has since changed).
+
+    INPUT(S):
+        - morphology: path to the SWC file [str]
+
+    OUTPUT(S):
+        - template: section names; index of, and position on, the parent
+            section; end of the section connected to the parent; order in which
+            the sections were connected; 3D points (x, y, z, diam) of all
+            sections; and the offset of each section's first 3D point [dict]
+    '''
+
+    path = os.path.abspath(morphology)
+    key = (path, os.path.getmtime(path))
+
+    if key not in _templates:
+        _templates[key] = _read_swc(path)
+
+    return _templates[key]
+
+
+
+
+def instantiate(morphology):
+    '''
+    Creates a new, independent copy of a morphology.
+
+    INPUT(S):
+        - morphology: path to the SWC file [str]
+
+    OUTPUT(S):
+        - sections: sections of the new copy, in the order they were created
+            by Import3d. The sections are deleted once no longer referenced
+            [list of Sections]
+    '''
+
+    template = get_template(morphology)
+    offsets = template['offsets']
+
+    # creates sections with their 3D points
+    sections = []
+    for i, name in enumerate(template['names']):
+        sec = h.Section(name=name)
+        for x, y, z, diam in template['pt3d'][offsets[i]:offsets[i+1]].tolist():
+            h.pt3dadd(x, y, z, diam, sec=sec)
+        sections.append(sec)
+
+    # connects sections (in the original order, which sets the order of the
+    # children of each section and so the order of the nodes)
+    for i in template['connect_order'].tolist():
+        sections[i].connect(sections[template['parent'][i]](template['parent_x'][i]),
+                            template['child_x'][i])
+
+    return sections
+
+
+
+
+def clear():
+    '''
+    Removes all cached morphologies.
+    '''
+
+    _templates.clear()
+
+
+
+
+def _read_swc(path):
+    '''
+    Parses an SWC file with Import3d and stores the resulting sections as
+    arrays. The sections created by Import3d are deleted afterwards.
+    '''
+
+    h.load_file('import3d.hoc')
+
+    existing = set(h.allsec())
+
+    Import = h.Import3d_SWC_read()
+    Import.input(path)
+    imprt = h.Import3d_GUI(Import, 0)
+    imprt.instantiate(None)
+
+    secs = [sec for sec in h.allsec() if sec not in existing]
+    index = {sec: i for i, sec in enumerate(secs)}
+
+    names = []
+    parent = []
+    parent_x = []
+    child_x = []
+    connect_order = []
+    offsets = [0]
+    pt3d = []
+    for sec in secs:
+        names.append(sec.name())
+        pseg = sec.parentseg()
+        if pseg is None:
+            parent.append(-1)
+            parent_x.append(0.)
+        else:
+            parent.append(index[pseg.sec])
+            parent_x.append(pseg.x)
+        child_x.append(sec.orientation())
+        # children are listed from the last connected to the first connected
+        connect_order.extend(index[child] for child in reversed(sec.children()))
+        for i in range(sec.n3d()):
+            pt3d.append([sec.x3d(i), sec.y3d(i), sec.z3d(i), sec.diam3d(i)])
+        offsets.append(len(pt3d))
+
+    for sec in secs:
+        h.delete_section(sec=sec)
+
+    template = {'names':names,
+                'parent':np.array(parent, dtype=int),
+                'parent_x':np.array(parent_x),
+                'child_x':np.array(child_x),
+                'connect_order':np.array(connect_order, dtype=int),
+                'pt3d':np.array(pt3d, dtype=float).reshape(-1,4),
+                'offsets':np.array(offsets, dtype=int)}
+
+    return template
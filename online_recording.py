@@ -0,0 +1,194 @@
+'''
+Recording of features of a simulated variable (e.g. the somatic membrane
+potential) online, while the simulation runs, so that the full trace at every
+time step never has to be kept.
+
+The variable is recorded natively into a short buffer, which is folded into
+running features (maximum, windowed means) and emptied at the end of each
+window. Threshold crossings are detected by a NetCon, and a downsampled trace
+can be recorded at a coarse interval. Memory per simulation is therefore set by
+the number of features (and the downsampled trace), not by the number of time
+steps.
+'''
+
+from   neuron           import h
+import numpy                as np
+
+
+
+class OnlineRecorder():
+    '''
+    Records features of a variable during each simulation. Recording restarts
+    each time the simulation is initialised (h.finitialize), so one recorder
+    can be reused for repeated simulations of the same cell.
+    '''
+
+    def __init__(self,  ref,
+                        sec,
+                        window=50,
+                        record_dt=None,
+                        thresh=None):
+        '''
+        INPUT(S):
+            - ref: pointer to the variable recorded (e.g.
+                cell.soma(0.5)._ref_v) [NEURON pointer]
+            - sec: section containing the variable [h.Section]
+            - window: length of the windows over which the variable is
+                averaged (in ms) (default 50) [number]
+            - record_dt: interval at which a downsampled trace is recorded (in
+                ms). If None, no trace is recorded (default None) [number]
+            - thresh: threshold for the times at which the variable crosses
+                from below (e.g. 0 for spikes). If None, crossings are not
+                detected (default None) [number]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.window = window
+
+        # buffer emptied at the end of each window
+        self._buffer_t = h.Vector()
+        self._buffer_t.record(h._ref_t, sec=sec)
+        self._buffer = h.Vector()
+        self._buffer.record(ref, sec=sec)
+
+        # downsampled trace
+        self._trace_t = None
+        if record_dt:
+            self._trace_t = h.Vector()
+            self._trace_t.record(h._ref_t, record_dt, sec=sec)
+            self._trace = h.Vector()
+            self._trace.record(ref, record_dt, sec=sec)
+
+        # threshold crossings
+        self._crossings = None
+        if thresh is not None:
+            self._ncon = h.NetCon(ref, None, sec=sec)
+            self._ncon.threshold = thresh
+            self._crossings = h.Vector()
+            self._ncon.record(self._crossings)
+
+        self._reset()
+        self._fih = h.FInitializeHandler(self._start)
+
+
+    def features(self):
+        '''
+        Gets the features recorded in the last simulation.
+
+        INPUT(S):
+            None
+
+        OUTPUT(S):
+            - features: features of the variable [dict of numbers and numpy
+                arrays]
+                - max: maximum value
+                - t_max: time of the maximum value (in ms)
+                - window_t: start times of the windows (in ms)
+                - window_mean: mean value in each window
+                - crossings: times of threshold crossings (in ms) (if thresh
+                    given)
+                - tm: times of the downsampled trace (in ms) (if record_dt
+                    given)
+                - trace: downsampled trace (if record_dt given)
+        '''
+
+        # folds in the last (partial) window
+        self._flush()
+
+        features = {'max':self._max, 't_max':self._t_max,
+                    'window_t':np.array(self._window_t), 'window_mean':np.array(self._window_mean)}
+        if self._crossings is not None:
+            features['crossings'] = self._crossings.as_numpy().copy()
+        if self._trace_t is not None:
+            features['tm'] = self._trace_t.as_numpy().copy()
+            features['trace'] = self._trace.as_numpy().copy()
+
+        return features
+
+
+    def above_threshold(self, threshold=-40, n_windows=5):
+        '''
+        Checks whether the mean of the variable was above a threshold for a
+        number of consecutive windows in the last simulation (as in
+        common_functions.check_sliding_average).
+
+        INPUT(S):
+            - threshold: threshold for the windowed means (default -40)
+                [number]
+            - n_windows: number of consecutive windows (default 5) [int]
+
+        OUTPUT(S):
+            - above: whether the threshold was exceeded [bool]
+        '''
+
+        self._flush()
+
+        counter = 0 # consecutive windows over threshold
+        for mean in self._window_mean:
+            counter = counter + 1 if mean > threshold else 0
+            if counter >= n_windows:
+                return True
+
+        return False
+
+
+    def _reset(self):
+        '''
+        Clears the features of a previous simulation.
+        '''
+
+        self._max = -np.inf
+        self._t_max = None
+        self._window_t = []
+        self._window_mean = []
+
+
+    def _start(self):
+        '''
+        Called at initialisation: clears the features and schedules the end of
+        each window.
+        '''
+
+        self._reset()
+        self._window_end = h.t + self.window
+        h.CVode().event(self._window_end, self._end_window)
+
+
+    def _end_window(self):
+        '''
+        Called at the end of each window during the simulation.
+        '''
+
+        self._flush()
+        self._window_end += self.window
+        h.CVode().event(self._window_end, self._end_window)
+
+
+    def _flush(self):
+        '''
+        Folds the buffered values into the features and empties the buffer.
+        '''
+
+        if self._buffer.size() == 0:
+            return
+
+        t = self._buffer_t.as_numpy()
+        x = self._buffer.as_numpy()
+
+        i = int(np.argmax(x))
+        if x[i] > self._max:
+            self._max = float(x[i])
+            self._t_max = float(t[i])
+
+        # with adaptive time steps, samples are denser where the variable changes quickly
+        if h.CVode().active() and len(t) > 1:
+            mean = np.sum((x[1:]+x[:-1]) / 2 * np.diff(t)) / (t[-1]-t[0])
+        else:
+            mean = np.mean(x)
+        self._window_t.append(float(t[0]))
+        self._window_mean.append(float(mean))
+
+        self._buffer_t.resize(0)
+        self._buffer.resize(0)
@@ -0,0 +1,122 @@
+'''
+Vectorised features of plateau potentials (baseline, amplitude, duration at
+half-max, half-max crossing times, area), calculated for many voltage traces
+sharing one time vector at once (e.g. traces stacked from a ResultStore).
+'''
+
+import numpy                as np
+
+
+
+def nearest_index(tm, time):
+    '''
+    Finds the index of the time value closest to the requested time(s). Gives
+    the same index as tm.index(min(tm, key=lambda x:abs(x-time))), but with a
+    binary search of the (sorted) time values.
+
+    INPUT(S):
+        - tm: time values, in ascending order [list or array of numbers]
+        - time: time(s) to find (in ms) [number or array of numbers]
+
+    OUTPUT(S):
+        - index: index(es) of the closest time value(s) [int or array of ints]
+    '''
+
+    tm = np.asarray(tm)
+    time = np.asarray(time)
+
+    right = np.clip(np.searchsorted(tm, time), 1, len(tm)-1)
+    left = right - 1
+    index = np.where(np.abs(tm[left]-time) <= np.abs(tm[right]-time), left, right)
+    # first occurrence of the closest value (as with list.index)
+    index = np.searchsorted(tm, tm[index])
+
+    if index.ndim == 0:
+        return int(index)
+
+    return index
+
+
+
+def get_features(tm, vm, base_vm=None, base_window=None, exclude=None):
+    '''
+    Calculates the features of plateau potentials in voltage traces. Each trace
+    can only have one epsp, i.e. it is assumed that the curve is monotonic
+    before and after the maximum.
+
+    INPUT(S):
+        - tm: time values shared by all traces, in ascending order [list or
+            array of numbers]
+        - vm: voltage traces [array of shape [n traces, n samples], or of
+            shape [n samples] for a single trace]
+        - base_vm: baseline voltage (of each trace). If None, the baseline
+            is taken from base_window (default None) [number or array]
+        - base_window: start and end times (in ms) over which the voltage is
+            averaged for the baseline. If None (and base_vm is None), the
+            voltage at the start of the (non-excluded) trace is used (default
+            None) [list of two numbers]
+        - exclude: time (in ms) at the start of the simulations that will be
+            ignored (as in common_functions.exclude_at_start) (default None)
+            [number]
+
+    OUTPUT(S):
+        - features: features of each trace [dict of arrays of shape [n traces],
+            or of numbers for a single trace]
+            - base: baseline voltage
+            - amp: maximum amplitude above baseline
+            - dur: length of time that the voltage is above half of the
+                maximum (relative to baseline); 0 if the baseline is above
+                the maximum (no potential above baseline)
+            - half_max: voltage at half-max
+            - t_rise: first time the voltage is above half-max (NaN if the
+                baseline is above the maximum)
+            - t_decay: last time the voltage is above half-max (NaN if the
+                baseline is above the maximum)
+            - area: area above baseline (mV ms)
+    '''
+
+    tm = np.asarray(tm, dtype=float)
+    vm = np.asarray(vm, dtype=float)
+    single = vm.ndim == 1
+    vm = np.atleast_2d(vm)
+
+    # baseline voltage
+    if base_vm is not None:
+        base = np.broadcast_to(np.asarray(base_vm, dtype=float), vm.shape[:1])
+    elif base_window is not None:
+        start, end = nearest_index(tm, base_window)
+        base = np.mean(vm[:, start:end], axis=1)
+    else:
+        base = None
+
+    # excludes time at start of simulations
+    if exclude:
+        start = max(nearest_index(tm, exclude) - 1, 0)
+        tm = tm[start:]
+        vm = vm[:, start:]
+    if base is None:
+        base = vm[:, 0]
+
+    # get half-max vm (assumes monotonic epsp in trace)
+    peak = np.max(vm, axis=1)
+    half_max = (peak+base) / 2
+    above = vm >= half_max[:, np.newaxis]
+    first = np.argmax(above, axis=1)
+    last = vm.shape[1] - 1 - np.argmax(above[:, ::-1], axis=1)
+
+    # area above baseline (trapezoid rule)
+    above_base = vm - base[:, np.newaxis]
+    area = np.sum((above_base[:, 1:]+above_base[:, :-1]) / 2 * np.diff(tm), axis=1)
+
+    # traces that never rise above baseline have no half-max crossings (rather than the whole trace)
+    flat = base > peak
+    t_rise = np.where(flat, np.nan, tm[first])
+    t_decay = np.where(flat, np.nan, tm[last])
+
+    features = {'base':base, 'amp':peak-base, 'dur':np.where(flat, 0., t_decay-t_rise), 'half_max':half_max,
+                't_rise':t_rise, 't_decay':t_decay, 'area':area}
+
+    if single:
+        return {key:float(value[0]) for key, value in features.items()}
+
+    return features
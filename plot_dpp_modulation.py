@@ -22,8 +22,8 @@ if HFI == 0:
     if mod_tar == 'indiv':
         
         # load data
-        data = cf.load_data('Data/{}_HFI[0]+0_{}-modulation-{}.json'.format(cell_type, mod_type, mod_tar))#cf.load_data('C:/Users/tomth/OneDrive/Documents/Work/Courses/Level 4/Honours/Data/dspn_n16.json')
-        ctrl_data = cf.load_data('Data/{}_HFI[0]+0_validation.json'.format(cell_type))
+        data = cf.load_data('Data/{}_HFI[0]+0_{}-modulation-{}.pkl'.format(cell_type, mod_type, mod_tar))#cf.load_data('C:/Users/tomth/OneDrive/Documents/Work/Courses/Level 4/Honours/Data/dspn_n16.json')
+        ctrl_data = cf.load_data('Data/{}_HFI[0]+0_validation.pkl'.format(cell_type))
         
         
         # ===== organise data =====
@@ -181,8 +181,8 @@ if HFI == 0:
             
     else:
         # load data
-        data = cf.load_data('Data/{}_HFI[0]+0_{}-modulation-{}.json'.format(cell_type, mod_type, mod_tar))#cf.load_data('C:/Users/tomth/OneDrive/Documents/Work/Courses/Level 4/Honours/Data/dspn_n16.json')
-        ctrl_data = cf.load_data('Data/{}_HFI[0]+0_validation.json'.format(cell_type))
+        data = cf.load_data('Data/{}_HFI[0]+0_{}-modulation-{}.pkl'.format(cell_type, mod_type, mod_tar))#cf.load_data('C:/Users/tomth/OneDrive/Documents/Work/Courses/Level 4/Honours/Data/dspn_n16.json')
+        ctrl_data = cf.load_data('Data/{}_HFI[0]+0_validation.pkl'.format(cell_type))
         
         
         # ===== organise data =====
@@ -341,10 +341,10 @@ else: # ===================
     for d in range(len(delta)):
         
         # load data
-        data = cf.load_data('Data/{}_HFI[1]+{}_{}-modulation.json'.format(cell_type, delta[d], mod_type))
+        data = cf.load_data('Data/{}_HFI[1]+{}_{}-modulation.pkl'.format(cell_type, delta[d], mod_type))
         delta_labels.append('+{}'.format(delta[d]))
         
-        ctrl_data = cf.load_data('Data/{}_HFI[1]+{}_validation.json'.format(cell_type, delta[d]))
+        ctrl_data = cf.load_data('Data/{}_HFI[1]+{}_validation.pkl'.format(cell_type, delta[d]))
         
         
         # plotting =================
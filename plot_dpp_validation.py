@@ -15,7 +15,7 @@ HFI = 0
 if not HFI:
     
     # load data
-    data = cf.load_data('Data/ispn_HFI[0]+0_validation.json')
+    data = cf.load_data('Data/ispn_HFI[0]+0_validation.pkl')
     
     
     # plotting =================
@@ -110,7 +110,7 @@ else:
     for d in range(len(delta)):
         
         # load data
-        data = cf.load_data('Data/dspn_HFI[1]+{}_validation.json'.format(delta[d]))
+        data = cf.load_data('Data/dspn_HFI[1]+{}_validation.pkl'.format(delta[d]))
         
         delta_labels.append('+{}'.format(delta[d]))
         
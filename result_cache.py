@@ -0,0 +1,266 @@
+'''
+Content-addressed cache of the results of simulation jobs.
+
+Each job is identified by a hash of everything that determines its results:
+the driver and its arguments, the model (its variables in the library, and the
+parameter and morphology files), the input parameters (params_for_input), the
+options in model_data (e.g. seeds, integration method, recordings), the round,
+and the version of the simulation code (its source files and mechanisms). A
+job whose hash is already in the cache is not simulated again, so e.g.
+re-running an analysis only simulates jobs that changed.
+
+The cache is a folder of pickled results (one file per job, named by its hash).
+When the cache grows beyond a maximum size, the least recently used results
+are removed.
+'''
+
+import hashlib
+import json
+import os
+import pickle
+import numpy                as np
+import common_functions     as cf
+import model_registry       as registry
+
+
+
+# source files and mechanisms on which the results of simulations depend (every module that affects the output
+# of a simulation must be listed, or changes to it will not invalidate cached results)
+CODE_FILES = ['simulation_functions.py', 'common_functions.py', 'MSN_builder.py', 'morphology_cache.py',
+              'modulation_lib.py', 'spike_trains.py', 'rng_streams.py', 'plateau_features.py', 'model_registry.py',
+              'steady_state.py', 'transients.py']
+MECHANISMS = 'mechanisms/single'
+
+# keys of model_data that do not change the results of a job
+IGNORED_KEYS = ['specs', 'cache', 'cache_size']
+
+# digests of files; keyed by (path, modification time)
+_digests = {}
+
+
+
+
+def file_digest(path):
+    '''
+    Gets the hash of the contents of a file (computed once per process, unless
+    the file changes).
+
+    INPUT(S):
+        - path: path to the file [str]
+
+    OUTPUT(S):
+        - digest: hash of the file [str]
+    '''
+
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path))
+
+    if key not in _digests:
+        with open(path, 'rb') as f:
+            _digests[key] = hashlib.sha256(f.read()).hexdigest()
+
+    return _digests[key]
+
+
+
+
+def code_version(files=CODE_FILES, mechanisms=MECHANISMS):
+    '''
+    Gets a hash of the simulation code (the source files and mechanisms).
+
+    INPUT(S):
+        - files: source files [list of str]
+        - mechanisms: folder of the mechanisms (.mod files) [str]
+
+    OUTPUT(S):
+        - version: hash of the code [str]
+    '''
+
+    paths = list(files)
+    if mechanisms and os.path.isdir(mechanisms):
+        paths += sorted(os.path.join(mechanisms, name) for name in os.listdir(mechanisms) if name.endswith('.mod'))
+
+    version = hashlib.sha256()
+    for path in paths:
+        version.update(path.encode())
+        version.update(file_digest(path).encode())
+
+    return version.hexdigest()
+
+
+
+
+def _to_json(obj):
+    '''
+    Converts objects that the json module cannot serialise for hashing.
+    '''
+
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+
+    return repr(obj)
+
+
+
+
+def job_spec(driver, model_data, cell_index, run_info, kwargs={}):
+    '''
+    Gets everything that determines the results of a job.
+
+    INPUT(S):
+        - driver: name of the simulation function (in simulation_functions)
+            [str]
+        - model_data: model parameters (as passed to the driver) [dict]
+        - cell_index: cell specification simulated [int]
+        - run_info: information about the simulation run (only the round
+            changes the results) [dict]
+        - kwargs: other arguments of the driver [dict]
+
+    OUTPUT(S):
+        - spec: specification of the job [dict]
+    '''
+
+    specs = model_data['specs']
+    cell_type = model_data['cell_type']
+    model_set = registry.load_library(specs['lib'])[cell_index]
+
+    spec = {'driver':driver, 'kwargs':kwargs, 'cell_index':cell_index, 'round':run_info.get('round', 0),
+            'variables':model_set['variables'], 'rheobase':model_set['rheobase'],
+            'files':{key:file_digest(specs[key]) for key in ['par', 'morph']},
+            'inputs':{input_type:cf.params_for_input(cell_type, input_type)
+                      for input_type in ['clustered', 'noise', 'HFI', 'ACh', 'DA']},
+            'options':{key:value for key, value in model_data.items() if key not in IGNORED_KEYS},
+            'code':code_version()}
+
+    return spec
+
+
+
+
+def job_key(spec):
+    '''
+    Gets the hash of a job specification (see job_spec).
+
+    INPUT(S):
+        - spec: specification of the job [dict]
+
+    OUTPUT(S):
+        - key: hash of the job [str]
+    '''
+
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=_to_json).encode()).hexdigest()
+
+
+
+
+class ResultCache():
+    '''
+    Cache of job results in a folder, keyed by the hash of each job (see
+    job_key). Several processes can share a cache; results are written
+    atomically.
+    '''
+
+    def __init__(self,  folder='temp_data/cache',
+                        max_size=None):
+        '''
+        INPUT(S):
+            - folder: folder of the cache [str]
+            - max_size: maximum size of the cache (in bytes), beyond which the
+                least recently used results are removed. If None, results are
+                never removed (default None) [int]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(folder, exist_ok=True)
+
+
+    def get(self, key):
+        '''
+        Gets the results of a job, if cached.
+
+        INPUT(S):
+            - key: hash of the job [str]
+
+        OUTPUT(S):
+            - data: results of the job, or None if not cached [dict]
+        '''
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # marks the results as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return data
+
+
+    def put(self, key, data):
+        '''
+        Stores the results of a job, removing the least recently used results
+        if the cache is then too large.
+
+        INPUT(S):
+            - key: hash of the job [str]
+            - data: results of the job [dict]
+
+        OUTPUT(S):
+            None
+        '''
+
+        path = self._path(key)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+
+    def evict(self, max_size):
+        '''
+        Removes the least recently used results until the cache is no larger
+        than the given size.
+
+        INPUT(S):
+            - max_size: size of the cache to keep (in bytes) [int]
+
+        OUTPUT(S):
+            None
+        '''
+
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith('.pkl'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError: # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, file_size, name in sorted(entries):
+            if size <= max_size:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+
+    def _path(self, key):
+
+        return os.path.join(self.folder, key + '.pkl')
@@ -0,0 +1,394 @@
+'''
+Binary store for the results of simulation jobs.
+
+The traces of every job (e.g. membrane potentials and times) are written as
+rows of one contiguous array on disk (traces.npy; of shape [n jobs, n traces
+per job, n samples]). All other results of each job (durations, amplitudes,
+ids, etc...) are kept in a small json index (index.json). Collating the results
+of a simulation run is then a memory-mapped (zero-copy) view of the traces,
+instead of parsing one json file per job.
+
+Alternatively, results can be folded into a ResultAccumulator on the master
+rank as they are gathered, without being written to disk at all.
+'''
+
+import copy
+import json
+import numbers
+import os
+import numpy                as np
+
+
+
+# keys whose values are stored as traces (for 'sites', a trace for each
+# recording site; see simulation_functions.set_recordings)
+TRACE_KEYS = ['vm', 'tm', 'sites']
+
+
+
+
+class ResultStore():
+    '''
+    Store of the results of a set of simulation jobs, each given by an index
+    (0 to n_jobs-1). All jobs must return the same structure of results, with
+    traces of the same length.
+    '''
+
+    def __init__(self,  folder,
+                        n_jobs=None,
+                        dtype='float64',
+                        trace_keys=TRACE_KEYS):
+        '''
+        Creates a new store (removing any store in the folder), or opens an
+        existing store for reading.
+
+        INPUT(S):
+            - folder: folder of the store [str]
+            - n_jobs: number of jobs to be stored. If None, the store already
+                in the folder is opened for reading (default None) [int]
+            - dtype: type in which the traces are stored ('float64' or
+                'float32') (default 'float64') [str]
+            - trace_keys: keys whose values (or, for dicts, each of whose
+                values) are stored as traces (default 'vm', 'tm', and
+                'sites') [list of str]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.folder = folder
+        self._traces_path = os.path.join(folder, 'traces.npy')
+        self._index_path = os.path.join(folder, 'index.json')
+
+        if n_jobs is None:
+            with open(self._index_path) as f:
+                index = json.load(f)
+            self.n_jobs = index['n_jobs']
+            self.trace_keys = index['trace_keys']
+            self.trace_paths = [tuple(path) for path in index['trace_paths']]
+            self.meta = {int(job): meta for job, meta in index['meta'].items()}
+            self.traces = None # jobs without traces (e.g. only spikes recorded)
+            if self.trace_paths:
+                self.traces = np.load(self._traces_path, mmap_mode='r')
+
+        else:
+            os.makedirs(folder, exist_ok=True)
+            for path in [self._traces_path, self._index_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.n_jobs = n_jobs
+            self.dtype = dtype
+            self.trace_keys = list(trace_keys)
+            self.trace_paths = None
+            self.meta = {}
+            self.traces = None # created with the first job, once the traces are known (if any)
+
+
+    def save(self, job, data):
+        '''
+        Stores the results of a job.
+
+        INPUT(S):
+            - job: index of the job [int]
+            - data: results of the job [dict]
+
+        OUTPUT(S):
+            None
+        '''
+
+        traces = {}
+        meta = self._split(data, (), traces)
+
+        if self.trace_paths is None:
+            self.trace_paths = list(traces.keys())
+            if self.trace_paths:
+                n_samples = len(traces[self.trace_paths[0]])
+                self.traces = np.lib.format.open_memmap(self._traces_path, mode='w+', dtype=self.dtype,
+                                                        shape=(self.n_jobs, len(self.trace_paths), n_samples))
+
+        if list(traces.keys()) != self.trace_paths:
+            raise ValueError('The traces of job {} do not match those of the other jobs in the store.'.format(job))
+        for row, path in enumerate(self.trace_paths):
+            self.traces[job, row] = traces[path]
+
+        self.meta[job] = meta
+
+
+    def close(self):
+        '''
+        Writes the traces and index of a new store to disk.
+        '''
+
+        if self.traces is not None:
+            self.traces.flush()
+        with open(self._index_path, 'w') as f:
+            json.dump({'n_jobs':self.n_jobs, 'trace_keys':self.trace_keys,
+                       'trace_paths':[list(path) for path in self.trace_paths or []],
+                       'meta':self.meta}, f)
+
+
+    def load(self, job, as_list=False):
+        '''
+        Gets the results of a job in the structure in which they were saved.
+
+        INPUT(S):
+            - job: index of the job [int]
+            - as_list: whether the traces are given as lists (as when the
+                results were simulated) or as (memory-mapped) arrays (default
+                False) [bool]
+
+        OUTPUT(S):
+            - data: results of the job [dict]
+        '''
+
+        data = copy.deepcopy(self.meta[job])
+        for row, path in enumerate(self.trace_paths):
+            trace = self.traces[job, row]
+            if as_list:
+                trace = trace.tolist()
+            entry = data
+            for key in path[:-1]:
+                entry = entry.setdefault(key, {})
+            entry[path[-1]] = trace
+
+        return data
+
+
+    def stack(self, n_rounds=1):
+        '''
+        Gets the traces of all jobs as one array (a view of the stored traces;
+        no copy is made). Jobs are assumed to be ordered by round, then by
+        model (i.e. job = round*n_models + model).
+
+        INPUT(S):
+            - n_rounds: number of rounds simulated for each model (default
+                1) [int]
+
+        OUTPUT(S):
+            - traces: traces of shape [n models, n rounds, n traces, n
+                samples] (see trace_paths for the order of the traces)
+                [numpy array]
+        '''
+
+        n_jobs, n_traces, n_samples = self.traces.shape
+
+        return self.traces.reshape(n_rounds, n_jobs//n_rounds, n_traces, n_samples).swapaxes(0, 1)
+
+
+    def trace(self, path, n_rounds=1):
+        '''
+        Gets one of the traces of all jobs (a view of the stored traces).
+
+        INPUT(S):
+            - path: keys leading to the trace in the results of a job (e.g.
+                ['distal dend', 'vm']) [list of str]
+            - n_rounds: number of rounds simulated for each model (default
+                1) [int]
+
+        OUTPUT(S):
+            - trace: traces of shape [n models, n rounds, n samples] [numpy
+                array]
+        '''
+
+        return self.stack(n_rounds)[:, :, self.trace_paths.index(tuple(path))]
+
+
+    def values(self, path, n_rounds=1):
+        '''
+        Gets one of the other (non-trace) results of all jobs.
+
+        INPUT(S):
+            - path: keys leading to the value in the results of a job (e.g.
+                ['distal dend', 'dur']) [list of str]
+            - n_rounds: number of rounds simulated for each model (default
+                1) [int]
+
+        OUTPUT(S):
+            - values: values of shape [n models, n rounds, ...] [numpy array]
+        '''
+
+        values = []
+        for job in range(self.n_jobs):
+            value = self.meta[job]
+            for key in path:
+                value = value[key]
+            values.append(value)
+        values = np.array(values)
+
+        return values.reshape((n_rounds, self.n_jobs//n_rounds) + values.shape[1:]).swapaxes(0, 1)
+
+
+    def _split(self, data, path, traces):
+        '''
+        Copies the results of a job without their traces, collecting the traces
+        (keyed by the keys leading to them).
+        '''
+
+        meta = {}
+        for key, value in data.items():
+            if key in self.trace_keys:
+                if isinstance(value, dict):
+                    for label, trace in value.items():
+                        traces[path + (key, label)] = trace
+                else:
+                    traces[path + (key,)] = value
+            elif isinstance(value, dict):
+                meta[key] = self._split(value, path + (key,), traces)
+            else:
+                meta[key] = value
+
+        return meta
+
+
+
+
+
+class ResultAccumulator():
+    '''
+    Accumulates the results of simulation jobs in memory as they are gathered,
+    for a set of models each simulated over several rounds. Traces are summed
+    over the rounds of each model (and, if requested, kept for every round),
+    other numeric results (durations, amplitudes, etc...) are kept for every
+    model and round, and any other results are kept from the latest job.
+    '''
+
+    def __init__(self,  n_models,
+                        n_rounds=1,
+                        keep_rounds=True,
+                        trace_keys=['vm', 'sites']):
+        '''
+        INPUT(S):
+            - n_models: number of models simulated [int]
+            - n_rounds: number of rounds simulated for each model (default
+                1) [int]
+            - keep_rounds: whether the traces of every round are kept, or only
+                their sum over rounds (in which case memory is bounded by the
+                number of models, not the number of jobs) (default True) [bool]
+            - trace_keys: keys whose values (or, for dicts, each of whose
+                values) are accumulated as traces (default 'vm' and 'sites')
+                [list of str]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.n_models = n_models
+        self.n_rounds = n_rounds
+        self.keep_rounds = keep_rounds
+        self.trace_keys = list(trace_keys)
+        self.counts = np.zeros(n_models, dtype=int) # number of rounds gathered for each model
+        self.meta = {}
+        self._sums = {}
+        self._rounds = {}
+        self._values = {}
+
+
+    def add(self, model, round, data):
+        '''
+        Folds the results of a job into the accumulated results.
+
+        INPUT(S):
+            - model: index of the model simulated (0 to n_models-1) [int]
+            - round: round of the simulation (0 to n_rounds-1) [int]
+            - data: results of the job [dict]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self._add(model, round, data, ())
+        self.counts[model] += 1
+
+
+    def trace(self, path):
+        '''
+        Gets a trace of every model and round (only if keep_rounds is True).
+
+        INPUT(S):
+            - path: keys leading to the trace in the results of a job (e.g.
+                ['distal dend', 'all', 'vm']) [list of str]
+
+        OUTPUT(S):
+            - traces: traces of shape [n models, n rounds, n samples] [numpy
+                array]
+        '''
+
+        if not self.keep_rounds:
+            raise ValueError('The traces of each round are not kept by this accumulator (keep_rounds is False).')
+
+        return self._rounds[tuple(path)]
+
+
+    def mean_trace(self, path):
+        '''
+        Gets a trace of every model, averaged over rounds.
+
+        INPUT(S):
+            - path: keys leading to the trace in the results of a job [list
+                of str]
+
+        OUTPUT(S):
+            - traces: traces of shape [n models, n samples] [numpy array]
+        '''
+
+        return self._sums[tuple(path)] / self.counts[:, np.newaxis]
+
+
+    def values(self, path):
+        '''
+        Gets one of the other numeric results of every model and round.
+
+        INPUT(S):
+            - path: keys leading to the value in the results of a job (e.g.
+                ['distal dend', 'all', 'dur']) [list of str]
+
+        OUTPUT(S):
+            - values: values of shape [n models, n rounds] [numpy array]
+        '''
+
+        return self._values[tuple(path)]
+
+
+    def _add(self, model, round, data, path):
+        '''
+        Folds the results of a job (below the given keys) into the accumulated
+        results.
+        '''
+
+        for key, value in data.items():
+            key_path = path + (key,)
+
+            if key in self.trace_keys:
+                if isinstance(value, dict):
+                    for label, trace in value.items():
+                        self._add_trace(model, round, trace, key_path + (label,))
+                else:
+                    self._add_trace(model, round, value, key_path)
+
+            elif isinstance(value, dict):
+                self._add(model, round, value, key_path)
+
+            elif isinstance(value, numbers.Number):
+                if key_path not in self._values:
+                    self._values[key_path] = np.full((self.n_models, self.n_rounds), np.nan)
+                self._values[key_path][model, round] = value
+
+            else:
+                entry = self.meta
+                for path_key in path:
+                    entry = entry.setdefault(path_key, {})
+                entry[key] = value
+
+
+    def _add_trace(self, model, round, trace, path):
+        '''
+        Folds a trace of a job into the accumulated traces.
+        '''
+
+        if path not in self._sums:
+            self._sums[path] = np.zeros((self.n_models, len(trace)))
+            if self.keep_rounds:
+                self._rounds[path] = np.zeros((self.n_models, self.n_rounds, len(trace)))
+        self._sums[path][model] += trace
+        if self.keep_rounds:
+            self._rounds[path][model, round] = trace
@@ -0,0 +1,137 @@
+'''
+Reproducible, independent random number streams for each simulation job.
+
+Every stream is derived from a master seed and the ids of the job (cell
+index, round) and of what the stream is used for (a condition, e.g. a
+clustered input and modulation target, and a synapse). Streams are
+counter-based (Philox for numpy, Random123 for NEURON's NetStims), so they do
+not depend on which host runs a job or in which order the jobs are run, and
+any job can be re-run exactly on its own.
+'''
+
+import random
+import zlib
+from   neuron           import h
+import numpy                as np
+
+
+
+def stream_id(value):
+    '''
+    Converts an id (e.g. a label) to a 32-bit integer that is the same on any
+    host (unlike hash, which is salted for each python process).
+
+    INPUT(S):
+        - value: id [int, str, or tuple/list of ints and strs]
+
+    OUTPUT(S):
+        - id: integer id [int]
+    '''
+
+    if isinstance(value, (tuple, list)):
+        value = [stream_id(x) for x in value]
+    elif isinstance(value, (int, np.integer)) and 0 <= value < 2**32:
+        return int(value)
+
+    return zlib.crc32(repr(value).encode())
+
+
+
+
+class JobStreams():
+    '''
+    Random number streams of one job. Without a master seed, streams are not
+    reproducible and the random number generators are left as they are (the
+    behaviour without this class).
+    '''
+
+    def __init__(self,  master_seed,
+                        cell_index,
+                        round=0):
+        '''
+        INPUT(S):
+            - master_seed: seed from which all streams are derived. If None,
+                streams are drawn from fresh entropy [int]
+            - cell_index: cell specification simulated by the job [int]
+            - round: round of the simulation (default 0) [int]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.master_seed = master_seed
+        self.cell_index = cell_index
+        self.round = round
+
+        # NetStims with Random123 streams draw from the master seed's set of streams
+        if master_seed is not None:
+            h.Random().Random123_globalindex(stream_id(master_seed))
+
+
+    def generator(self, *ids):
+        '''
+        Gets the (numpy) random number generator of a stream.
+
+        INPUT(S):
+            - ids: ids of the stream within the job (e.g. condition labels)
+                [ints or strs]
+
+        OUTPUT(S):
+            - rng: random number generator [np.random.Generator]
+        '''
+
+        if self.master_seed is None:
+            return np.random.default_rng()
+
+        seed = np.random.SeedSequence(stream_id(self.master_seed),
+                                      spawn_key=(self.cell_index, self.round) + tuple(stream_id(x) for x in ids))
+
+        return np.random.Generator(np.random.Philox(seed))
+
+
+    def seed_globals(self, *ids):
+        '''
+        Seeds the global random number generators (of the random and numpy
+        modules, used e.g. to draw modulation factors and input locations)
+        from a stream.
+
+        INPUT(S):
+            - ids: ids of the stream within the job [ints or strs]
+
+        OUTPUT(S):
+            None
+        '''
+
+        if self.master_seed is None:
+            return
+
+        seed = int(self.generator('globals', *ids).integers(2**32))
+        random.seed(seed)
+        np.random.seed(seed)
+
+
+    def assign(self, stims, *ids):
+        '''
+        Gives each NetStim its own Random123 stream, numbered by its position
+        (VecStims, whose spike times are drawn in advance, are skipped). The
+        streams restart when the simulation is initialised.
+
+        INPUT(S):
+            - stims: NetStims (e.g. as returned by common_functions.set_bg_noise)
+                [dict or list of h.NetStims]
+            - ids: ids of the streams within the job [ints or strs]
+
+        OUTPUT(S):
+            None
+        '''
+
+        if self.master_seed is None:
+            return
+
+        if isinstance(stims, dict):
+            stims = list(stims.values())
+
+        stream = stream_id((self.round,) + ids)
+        for n, stim in enumerate(stims):
+            if stim.hname().startswith('NetStim'):
+                stim.noiseFromRandom123(self.cell_index, stream, n)
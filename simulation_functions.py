@@ -10,6 +10,678 @@ import common_functions      as cf
 import MSN_builder           as build
 import numpy                 as np
 import modulation_lib        as modulate
+import model_registry        as registry
+import plateau_features      as pf
+import spike_trains          as st
+import rng_streams           as rs
+import result_cache          as rc
+import steady_state          as ss
+import transients            as tr
+import warnings
+
+
+
+
+def reset_cell(inputs, modulation = None):
+    '''
+    Removes the inputs and modulation added to a cell for a simulation, so
+    that the same cell can be reused for the next simulation instead of being
+    rebuilt.
+
+    INPUT(S):
+        - inputs: input objects (synapses, NetStims, NetCons) added to the
+            cell for the simulation, keyed by input type. The dictionary is
+            emptied, which deletes the NEURON objects it held [dict]
+        - modulation: modulation applied to the cell for the simulation
+            (default None; no modulation applied) [set_ACh or set_DA object]
+
+    OUTPUT(S):
+        None
+    '''
+
+    # removes played vectors and modulation state from the mechanisms
+    if modulation is not None:
+        modulation._reset_mod()
+
+    # drops the only references to the synapses, NetStims, and NetCons
+    inputs.clear()
+
+
+
+
+# the cell built most recently in this process, keyed by its model
+_cell = {}
+
+
+
+
+def get_cell(model_data, cell_index):
+    '''
+    Gets a cell of a model from the library in its specification. The cell
+    built most recently in this process is kept, and is reused (rather than
+    rebuilt) if the same model is requested again, e.g. by the next job of a
+    batch simulating several rounds of a model (the inputs and modulation of
+    each simulation are removed from the cell; see reset_cell).
+
+    INPUT(S):
+        - model_data: model paramaters (specification and cell type) [dict]
+        - cell_index: cell specification in the library [int]
+
+    OUTPUT(S):
+        - cell: the cell [MSN_builder.MSN]
+        - rheobase: rheobase of the model [number]
+    '''
+
+    specs = model_data['specs']
+    key = (specs['lib'], specs['par'], specs['morph'], cell_index)
+
+    if key not in _cell:
+        _cell.clear() # the previous cell is deleted before the new one is built
+        model_set = registry.load_library(specs['lib'])[cell_index]
+        cell = build.MSN(params=specs['par'],
+                         morphology=specs['morph'],
+                         variables=model_set['variables'])
+        _cell[key] = (cell, model_set['rheobase'])
+
+    return _cell[key]
+
+
+
+
+def set_integration(model_data):
+    '''
+    Sets the integration method requested in the model data. By default, the
+    fixed time step (h.dt) is used. Adaptive time steps (CVode) are used if
+    model_data['cvode'] is 'global' (or True), or 'local' (local variable time
+    steps; for a single cell, this is the same as 'global'). The absolute
+    error tolerance of CVode can be given in model_data['atol'].
+
+    INPUT(S):
+        - model_data: model paramaters, optionally containing 'cvode' (default
+            False) and 'atol' (default 1e-3) [dict]
+
+    OUTPUT(S):
+        - cvode: whether adaptive time steps are used [bool]
+    '''
+
+    method = model_data.get('cvode', False)
+    if method not in [False, True, 'global', 'local']:
+        raise ValueError("The integration method '{}' is not recognised.\nThis should be False, 'global', or 'local'.".format(method))
+
+    cvode = h.CVode()
+    cvode.active(1 if method else 0)
+    cvode.use_local_dt(1 if method == 'local' else 0)
+    if method:
+        cvode.atol(model_data.get('atol', 1e-3))
+
+    return bool(method)
+
+
+
+
+def set_initial_state(cell, model_data, cell_index, clus_params):
+    '''
+    Gets the state from which each simulation of a cell starts. By default,
+    simulations start at 0 ms from a membrane potential of -80 mV, and the
+    cell settles to rest during the period before the stimulus. If
+    model_data['steady_state'] is given, simulations instead start from the
+    resting state of the model (found once; see steady_state), at the time in
+    model_data['start_t'] (by default, the start of the baseline before the
+    clustered inputs), so the settling period is not simulated. The resting
+    state is then saved in the folder model_data['steady_state'] (if a str;
+    if True, it is only kept for the process). Inputs (e.g. background noise)
+    start at the start time. Must be called before inputs are added to the
+    cell.
+
+    INPUT(S):
+        - cell: cell being simulated, without inputs [MSN object]
+        - model_data: model paramaters, optionally containing 'steady_state'
+            (default None), 'start_t' (default clus_params['stim_t'] +
+            clus_params['pre_t']), and 'settle_t' (time for which the model
+            settles to rest, in ms; default 1000) [dict]
+        - cell_index: cell specification being simulated [int]
+        - clus_params: parameters of the clustered inputs [dict]
+
+    OUTPUT(S):
+        - state: resting state of the cell, or None if simulations start from
+            -80 mV [steady_state.SteadyState]
+        - start: time at which simulations start (in ms) [number]
+    '''
+
+    folder = model_data.get('steady_state')
+    if not folder:
+        return None, 0
+
+    start = model_data.get('start_t', clus_params['stim_t']+clus_params['pre_t'])
+    if start > clus_params['stim_t']:
+        raise ValueError("Simulations cannot start ({} ms) after the clustered inputs ({} ms).".format(start, clus_params['stim_t']))
+
+    state = ss.get_state(cell, model_data, cell_index, folder=folder if isinstance(folder, str) else None,
+                         settle_t=model_data.get('settle_t', 1000))
+
+    return state, start
+
+
+
+
+def run_simulation(tstop, cvode = False, events = None, state = None, start = 0):
+    '''
+    Initialises the cell(s) and simulates until the requested time.
+
+    INPUT(S):
+        - tstop: time to simulate until (in ms) [number]
+        - cvode: whether adaptive time steps are used (see set_integration)
+            (default False) [bool]
+        - events: time:function pairs called during the simulation (see
+            common_functions.run_until) (default None) [list of tuples]
+        - state: resting state from which the simulation starts (see
+            set_initial_state); if None, the simulation starts from -80 mV
+            (default None) [steady_state.SteadyState]
+        - start: time at which the simulation starts from the resting state
+            (in ms) (default 0) [number]
+
+    OUTPUT(S):
+        None
+    '''
+
+    h.finitialize(-80)
+    if state is not None:
+        state.initialise(start, cvode)
+    cf.run_until(tstop, cvode, events)
+
+
+
+
+def baseline_vm(tm, vm, clus_params):
+    '''
+    Gets the baseline membrane potential before the clustered inputs: the mean
+    over the baseline period (from clus_params['pre_t'] before the inputs), or
+    the first recorded value if no baseline period was simulated (see
+    set_initial_state).
+
+    INPUT(S):
+        - tm: recorded time (in ms) [numpy array]
+        - vm: recorded membrane potential (in mV) [numpy array]
+        - clus_params: parameters of the clustered inputs [dict]
+
+    OUTPUT(S):
+        - base_vm: baseline membrane potential (in mV) [number]
+    '''
+
+    base_t_start = pf.nearest_index(tm, clus_params['stim_t']+clus_params['pre_t'])
+    base_t_end = pf.nearest_index(tm, clus_params['stim_t'])
+    if base_t_end <= base_t_start:
+        return vm[base_t_start]
+
+    return np.mean(vm[base_t_start:base_t_end])
+
+
+
+
+class BranchPoint():
+    '''
+    The state of a simulation at a time from which several conditions branch
+    (e.g. the onset of modulation, before which the conditions are the same).
+    The simulation is run once until then (see run_simulation), its state is
+    saved (h.SaveState), and each condition is continued from the saved state
+    (see continue_simulation), so that the shared period is only simulated
+    once. Between the branch point and each branch, no sections, mechanisms,
+    or point processes can be added to or removed from the model.
+    '''
+
+    def __init__(self, recordings):
+        '''
+        Saves the current state of the simulation.
+
+        INPUT(S):
+            - recordings: recorded time, membrane potential, and other
+                variables (see set_recordings) [dict of h.Vector(s)]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.t = h.t
+        self.recordings = recordings
+        self.state = h.SaveState()
+        self.state.save()
+        self.sizes = self._sizes(recordings)
+
+
+    def restore(self):
+        '''
+        Restores the saved state, discarding what was recorded after the
+        branch point (e.g. by the previous branch).
+        '''
+
+        self.state.restore()
+        self._resize(self.recordings, self.sizes)
+
+
+    def _sizes(self, recordings):
+
+        return {key: (self._sizes(vec) if isinstance(vec, dict) else vec.size()) for key, vec in recordings.items()}
+
+
+    def _resize(self, recordings, sizes):
+
+        for key, vec in recordings.items():
+            if isinstance(vec, dict):
+                self._resize(vec, sizes[key])
+            else:
+                vec.resize(sizes[key])
+
+
+
+
+class EventPlay():
+    '''
+    Stands in for a vector played into variables (see h.Vector.play; e.g. the
+    time-dependent scaling of modulation) in simulations continued from a
+    branch point, in which played vectors do not take effect. The variables
+    are instead set by events (see continue_simulation), to the value of the
+    vector at the branch point and then at each time the value changes.
+    '''
+
+    def __init__(self, vec):
+        '''
+        INPUT(S):
+            - vec: values played [h.Vector or array of numbers]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.values = np.array(vec)
+        self.refs = []
+        self.dt = h.dt
+
+
+    def play(self, ref, dt):
+        '''
+        Plays the vector into a variable (as h.Vector.play).
+
+        INPUT(S):
+            - ref: reference to the variable (e.g. seg.kaf._ref_modShift)
+            - dt: time step of the values, or the time of each value [number
+                or h.Vector]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.refs.append(ref)
+        self.dt = dt
+
+
+    def play_remove(self):
+        '''
+        Stops playing the vector (as h.Vector.play_remove).
+        '''
+
+        self.refs = []
+
+
+    def events(self, t):
+        '''
+        Sets the variables to the value of the vector at a time, and gets the
+        events setting them at each later change of the value.
+
+        INPUT(S):
+            - t: time from which the vector is played (in ms) [number]
+
+        OUTPUT(S):
+            - events: time:function pairs (see common_functions.run_until)
+                [list of tuples]
+        '''
+
+        if isinstance(self.dt, h.Vector):
+            times = np.array(self.dt)
+        else:
+            times = np.arange(len(self.values))*self.dt
+
+        # value played at t (events within half a time step are delivered with the step)
+        current = max(np.searchsorted(times, t + h.dt/2, side='right') - 1, 0)
+        self._set(self.values[current])
+
+        changes = current + 1 + np.flatnonzero(np.diff(self.values[current:]) != 0)
+
+        return [(times[i], self._setter(self.values[i])) for i in changes]
+
+
+    def _set(self, value):
+
+        for ref in self.refs:
+            ref[0] = value
+
+
+    def _setter(self, value):
+
+        return lambda: self._set(value)
+
+
+
+
+def continue_simulation(branch, tstop, cvode = False, plays = {}, spikes = []):
+    '''
+    Continues a simulation from a branch point until the requested time.
+
+    INPUT(S):
+        - branch: branch point from which the simulation is continued
+            [BranchPoint]
+        - tstop: time to simulate until (in ms) [number]
+        - cvode: whether adaptive time steps are used (see set_integration)
+            (default False) [bool]
+        - plays: vectors played into variables during the branch (e.g. the
+            scaling of modulation) [dict of EventPlay(s)]
+        - spikes: spike times delivered to synapses during the branch, as
+            (NetCon, spike times) pairs; spikes before the branch point are
+            ignored (default none) [list of tuples]
+
+    OUTPUT(S):
+        None
+    '''
+
+    branch.restore()
+
+    events = []
+    for play in plays.values():
+        events += play.events(branch.t)
+
+    for ncon, times in spikes:
+        for spike_t in times:
+            if spike_t >= branch.t:
+                ncon.event(spike_t)
+
+    if cvode:
+        h.CVode().re_init()
+    cf.run_until(tstop, cvode, events)
+
+
+
+
+def set_recordings(cell, model_data, dur_and_amp = False):
+    '''
+    Records the time and somatic membrane potential (and any other requested
+    variables) during each simulation. By default, values are recorded every
+    time step. If model_data['record_dt'] is given, values are recorded
+    natively at that interval instead (the duration and amplitude of plateau
+    potentials are then calculated from the downsampled traces). Other
+    variables are requested in model_data['record_sites'] as [section name,
+    position, variable] lists (e.g. ['dend[10]', 0.5, 'v'] for the membrane
+    potential of a dendrite, or ['dend[10]', 0.5, 'cai'] for a calcium pool).
+    The somatic membrane potential is not recorded if model_data['record_vm']
+    is False (e.g. if only spikes are analysed).
+
+    INPUT(S):
+        - cell: cell being simulated [MSN object]
+        - model_data: model paramaters, optionally containing 'record_dt'
+            (default None), 'record_sites' (default []), and 'record_vm'
+            (default True) [dict]
+        - dur_and_amp: whether the duration and amplitude of the plateau
+            potential will be calculated (which needs the somatic membrane
+            potential) (default False) [bool]
+
+    OUTPUT(S):
+        - recordings: recorded time ('tm'), somatic membrane potential ('vm'),
+            and other variables ('sites'; keyed by
+            '<section>(<position>).<variable>') [dict of h.Vector(s)]
+    '''
+
+    record_dt = model_data.get('record_dt')
+    record_vm = model_data.get('record_vm', True)
+    if dur_and_amp and not record_vm:
+        raise ValueError("The membrane potential must be recorded to calculate the duration and amplitude of the plateau potential.\nSet model_data['record_vm'] to True, or dur_and_amp to False.")
+
+    # with local variable time steps, each recording must be associated with
+    # the section whose time steps it follows
+    def record(ref, sec):
+        vec = h.Vector()
+        if record_dt:
+            vec.record(ref, record_dt, sec=sec)
+        else:
+            vec.record(ref, sec=sec)
+        return vec
+
+    recordings = {}
+    if record_vm or model_data.get('record_sites'):
+        if record_dt:
+            # time is not a variable of a section, so its recording at
+            # intervals is associated with the soma through a point process
+            # (with no current), kept with the cell
+            if not hasattr(cell, 'record_anchor'):
+                cell.record_anchor = h.IClamp(cell.soma(0.5))
+                cell.record_anchor.amp = 0
+            recordings['tm'] = h.Vector()
+            recordings['tm'].record(cell.record_anchor, h._ref_t, record_dt)
+        else:
+            recordings['tm'] = record(h._ref_t, cell.soma)
+    if record_vm:
+        recordings['vm'] = record(cell.soma(0.5)._ref_v, cell.soma)
+    if model_data.get('record_sites'):
+        recordings['sites'] = {}
+        for sec_name, x, var in model_data['record_sites']:
+            sec = cell.name2sec[sec_name]
+            recordings['sites']['{}({}).{}'.format(sec_name, x, var)] = record(getattr(sec(x), '_ref_'+var), sec)
+
+    return recordings
+
+
+
+
+def fixed_step_times(tstop, start = 0):
+    '''
+    Gets the times recorded with fixed time steps (see run_simulation). NEURON
+    advances t by two half steps each step, and the rounding accumulated over
+    the steps decides whether the last step ends at or just after tstop, so the
+    times are accumulated in the same way.
+
+    INPUT(S):
+        - tstop: time simulated until (in ms) [number]
+        - start: time at which the simulation started (in ms) (default 0)
+            [number]
+
+    OUTPUT(S):
+        - tm: recorded times (in ms) [numpy array]
+    '''
+
+    n_max = int(np.ceil((tstop-start)/h.dt)) + 2
+    tm = np.cumsum(np.concatenate([[start], np.full(2*n_max, .5*h.dt)]))[::2]
+
+    # the loop stops at the first time at or after tstop
+    return tm[:np.searchsorted(tm, tstop)+1]
+
+
+
+
+def get_traces(recordings, tstop, cvode = False, record_dt = None, start = 0):
+    '''
+    Gets the recorded traces of a simulation (see set_recordings) as arrays.
+    The recorded values are read through zero-copy views of the vectors
+    (h.Vector.as_numpy), and copied once, as the vectors are recorded into
+    again in the next simulation. With adaptive time steps (and values recorded
+    every step), the traces are resampled onto the grid of the fixed time step,
+    so that all simulations have the same time points.
+
+    INPUT(S):
+        - recordings: recorded time ('tm'), somatic membrane potential ('vm'),
+            and other variables ('sites') [dict of h.Vector(s)]
+        - tstop: time simulated until (in ms) [number]
+        - cvode: whether adaptive time steps were used (default False) [bool]
+        - record_dt: interval at which values were recorded (in ms); if None,
+            values were recorded every step (default None) [number]
+        - start: time at which the simulation started (in ms) (default 0)
+            [number]
+
+    OUTPUT(S):
+        - traces: recorded time (in ms), membrane potential (in mV), and other
+            variables, in the same structure as the recordings [dict of numpy
+            arrays]
+    '''
+
+    if not cvode or record_dt:
+        tm = None
+        resample = lambda vec: vec.as_numpy().copy()
+    else:
+        # same time points as taken by the fixed step loop
+        tm = fixed_step_times(tstop, start)
+        resample = lambda vec: np.interp(tm, recordings['tm'].as_numpy(), vec.as_numpy())
+
+    traces = {}
+    for key, vec in recordings.items():
+        if key == 'sites':
+            traces[key] = {label: resample(site_vec) for label, site_vec in vec.items()}
+        elif key == 'tm' and tm is not None:
+            traces[key] = tm
+        else:
+            traces[key] = resample(vec)
+
+    return traces
+
+
+
+
+def record_spikes(cell, thresh = 0):
+    '''
+    Records the times at which the somatic membrane potential crosses a
+    threshold (from below) during a simulation, without recording the
+    membrane potential itself. The recording is cleared each time the
+    simulation is initialised, so the same recorder can be used for each
+    simulation of the cell.
+
+    INPUT(S):
+        - cell: cell whose spikes are recorded [MSN object]
+        - thresh: threshold for spikes (in mV) (default 0) [number]
+
+    OUTPUT(S):
+        - ncon: NetCon detecting the spikes (must be kept for the spikes to be
+            recorded) [h.NetCon]
+        - spike_vec: recorded spike times [h.Vector]
+    '''
+
+    ncon = h.NetCon(cell.soma(0.5)._ref_v, None, sec=cell.soma)
+    ncon.threshold = thresh
+    spike_vec = h.Vector()
+    ncon.record(spike_vec)
+
+    return ncon, spike_vec
+
+
+
+
+def get_spikes(spike_vec):
+    '''
+    Gets whether a cell spiked, the time of the first spike, and the number of
+    spikes from the spike times recorded in a simulation (see record_spikes).
+
+    INPUT(S):
+        - spike_vec: recorded spike times [h.Vector]
+
+    OUTPUT(S):
+        - spikes: whether a spike occurred ('spiked'; 0 or 1), and the time of
+            the first spike ('first_spike') and number of spikes ('spike_n')
+            (empty lists if no spikes occurred) [dict]
+    '''
+
+    spike_t = spike_vec.as_numpy()
+    if not len(spike_t):
+        return {'spiked':0, 'first_spike':[], 'spike_n':[]}
+
+    return {'spiked':1, 'first_spike':float(spike_t[0]), 'spike_n':len(spike_t)}
+
+
+
+
+def compress_play(play, dt):
+    '''
+    Keeps only the elements of vectors (to be played into mechanisms) at which
+    their values change. With adaptive time steps, each element of a played
+    vector interrupts the integration, so vectors sampled every time step
+    would remove any gain in speed.
+
+    INPUT(S):
+        - play: vectors of the same length, sampled every dt, keyed by
+            mechanism [dict of h.Vector(s)]
+        - dt: sampling interval of the vectors (in ms) [number]
+
+    OUTPUT(S):
+        - play: vectors with only the elements at which any of the vectors
+            changes value [dict of h.Vector(s)]
+        - tvec: times of the kept elements (in ms; empty if no vectors are
+            given) [h.Vector]
+    '''
+
+    if not play: # nothing to play
+        return {}, h.Vector()
+
+    arrays = {key: vec.as_numpy() for key, vec in play.items()}
+
+    # elements at which any vector changes value (and the first element)
+    keep = np.zeros(len(next(iter(arrays.values()))), dtype=bool)
+    keep[0] = True
+    for x in arrays.values():
+        keep[1:] |= x[1:] != x[:-1]
+    idx = np.flatnonzero(keep)
+
+    compressed = {key: h.Vector(x[idx]) for key, x in arrays.items()}
+    tvec = h.Vector(idx*dt)
+
+    return compressed, tvec
+
+
+
+
+def run_cached(driver, model_data, cell_index, run_info, kwargs = {}):
+    '''
+    Runs a simulation function, through the result cache in model_data (if
+    any): a job simulated before with the same model, inputs, options, round,
+    and code (see result_cache.job_spec) is loaded rather than simulated
+    again. The results of such a job are flagged as loaded from the cache
+    (data['meta']['cached'] is True, if the results have meta data), so that
+    the time taken to load them is not recorded as the duration of the job.
+    Jobs are only cached if their random numbers are seeded
+    (model_data['master_seed'] is given); otherwise each run draws new random
+    numbers, so the cache is bypassed (with a warning). All arguments can be
+    passed positionally, as with pc.submit.
+
+    INPUT(S):
+        - driver: name of the simulation function (e.g. 'dpp_ACh_modded')
+            [str]
+        - model_data: model parameters passed to the simulation function. May
+            also contain the folder of the cache ('cache'; if None or absent,
+            no cache is used) and its maximum size in bytes ('cache_size';
+            default None, i.e. no limit) [dict]
+        - cell_index: cell specification being simulated [int]
+        - run_info: information about the simulation run [dict]
+        - kwargs: other arguments of the simulation function (default none)
+            [dict]
+
+    OUTPUT(S):
+        - data: results of the simulation function [dict]
+    '''
+
+    func = globals()[driver]
+    if not model_data.get('cache'):
+        return func(model_data, cell_index=cell_index, run_info=run_info, **kwargs)
+
+    if model_data.get('master_seed') is None:
+        warnings.warn("Simulations are not cached without a master seed, as their results are not reproducible.\nSet model_data['master_seed'] to cache them.")
+        return func(model_data, cell_index=cell_index, run_info=run_info, **kwargs)
+
+    cache = rc.ResultCache(model_data['cache'], model_data.get('cache_size'))
+    key = rc.job_key(rc.job_spec(driver, model_data, cell_index, run_info, kwargs))
+
+    data = cache.get(key)
+    if data is None:
+        data = func(model_data, cell_index=cell_index, run_info=run_info, **kwargs)
+        cache.put(key, data)
+    else:
+        print('Loaded cell specification {} of {} from the cache'.format( \
+              run_info['curr_n']+1,run_info['tot_n']),flush = True)
+        if 'meta' in data:
+            data['meta']['cached'] = True
+
+    return data
 
 
 
@@ -24,8 +696,11 @@ def dpp_validation(model_data,
     plateau potential in the absence of modulation.
     
     INPUT(S):
-        - model_data: model paramaters (specification, cell type, model 
-            sets, and stimulation targets) [dict]
+        - model_data: model paramaters (specification, cell type, and 
+            stimulation targets); the cell specification is read from the
+            library given in the specification. May also contain the
+            integration method (see set_integration) and what is recorded
+            (see set_recordings) [dict]
         - stim_data: stimulation parameters (number of inputs, time of inputs,
             input inter-spike intervals, time to stop simulating) [dict]
         - cell_index: cell specification being simulated [int]
@@ -52,40 +727,45 @@ def dpp_validation(model_data,
     
     # ===== simulation =====
     data = {}
+    
+    # initiate cell (built once and reused for each simulation target, and for later jobs of the same model)
+    cell, rheobase = get_cell(model_data, cell_index)
+    
+    # record vectors
+    recordings = set_recordings(cell, model_data, dur_and_amp)
+    record_dt = model_data.get('record_dt')
+    
+    # integration method (fixed or adaptive time steps)
+    cvode = set_integration(model_data)
+    
     for i, t in enumerate(model_data['target']): # for each simulation target
         
         clus_lab = model_data['target_labels'][i] # label for input target
-        
-        # initiate cell
-        cell = build.MSN(params=model_data['specs']['par'],
-                         morphology=model_data['specs']['morph'],
-                         variables=model_data['model_sets'][cell_index]['variables'])
-        rheobase = model_data['model_sets'][cell_index]['rheobase']
-        
-        # record vectors
-        tm = h.Vector()
-        tm.record(h._ref_t)
-        vm = h.Vector()
-        vm.record(cell.soma(0.5)._ref_v)
+        inputs = {}
         
         # add clustered inputs
-        syn,stim,ncon,d2soma = cf.set_clustered_stim(cell,t,n=stim_data['stim_n'], \
-                                                     act_time=stim_data['stim_t'], \
-                                                     ISI=stim_data['isi'])
+        inputs['clustered'] = cf.set_clustered_stim(cell,t,n=stim_data['stim_n'], \
+                                                    act_time=stim_data['stim_t'], \
+                                                    ISI=stim_data['isi'])
+        d2soma = inputs['clustered'][3]
+        
         # run simulation
-        h.finitialize(-80)
-        while h.t < stim_data['stop_t']:
-            h.fadvance()
-        tm = tm.to_python()
-        vm = vm.to_python()
+        tstop = stim_data['stop_t']
+        run_simulation(tstop, cvode)
+        traces = get_traces(recordings, tstop, cvode, record_dt)
+        
+        # remove inputs before reusing the cell
+        reset_cell(inputs)
         
         # collate data
-        data[clus_lab] = {'tm':tm, 'vm':vm, 'dist':d2soma, 'rheo':rheobase, \
-            'id':int(cell_index), 'cell_type':model_data['cell_type']}
+        data[clus_lab] = traces
+        data[clus_lab].update({'dist':d2soma, 'rheo':rheobase, \
+            'id':int(cell_index), 'cell_type':model_data['cell_type']})
         
         if dur_and_amp:
             # calculate dpp duration and amplitude
-            base_t = tm.index(min(tm, key=lambda x:abs(x-stim_data['stim_t'])))-1
+            tm, vm = traces['tm'], traces['vm']
+            base_t = pf.nearest_index(tm, stim_data['stim_t'])-1
             data[clus_lab]['dur'] = \
                 cf.dpp_dur(tm,vm,vm[base_t],stim_data['stim_t'])
             data[clus_lab]['amp'] = \
@@ -110,13 +790,26 @@ def dpp_generation(model_data,
     plateau potential in the absence of modulation.
     
     INPUT(S):
-        - model_data: model paramaters (specification, cell type, model 
-            sets, and stimulation targets) [dict]
+        - model_data: model paramaters (specification, cell type, and 
+            stimulation targets); the cell specification is read from the
+            library given in the specification. May also contain the
+            integration method (see set_integration), what is recorded
+            (see set_recordings), the state from which simulations start
+            (see set_initial_state), and whether the background noise and
+            HFIs are played from spike times drawn in advance ('vecstim';
+            default False), and a master seed from which the random numbers of the
+            job are drawn reproducibly ('master_seed'; see rng_streams)
+            [dict]
         - stim_data: stimulation parameters (number of inputs, time of inputs,
             input inter-spike intervals, time to stop simulating) [dict]
         - cell_index: cell specification being simulated [int]
         - run_info: information about the simulation run (this simulation and 
             total number of simulations) [dict]
+        - HFI_delay: delay of the HFIs after the last clustered input (in ms).
+            If a list, each delay is simulated by branching from one
+            simulation until the earliest HFIs (see BranchPoint), with the
+            same inputs (and HFI trains, from their onset) for each delay
+            (default 0) [number or list of numbers]
         - dur_and_amp: whether to calculate the duration and peak amplitude of
             the plateau potential (default True) [bool]
         
@@ -124,7 +817,8 @@ def dpp_generation(model_data,
         - data: simulated data including: simulation times; simulated voltages;
             distance of stimulated target to the soma; rheobase of the model; 
             half-max width of the potential; peak amplitude of the potential;
-            cell specification being simulated; cell type being simulated
+            cell specification being simulated; cell type being simulated. If
+            HFI_delay is a list, the data of each delay, keyed by delay
             [dict]
         - ncon: NetCon object
             
@@ -135,6 +829,10 @@ def dpp_generation(model_data,
     print('Simulating cell specification {} of {}'.format( \
           run_info['curr_n']+1,run_info['tot_n']),flush = True)
     
+    # random number streams of the job (reproducible, if a master seed is given)
+    streams = rs.JobStreams(model_data.get('master_seed'), cell_index, run_info.get('round', 0))
+    streams.seed_globals('job')
+    
     
     # ===== gets stimulation info =====
     # clustered inputs
@@ -152,29 +850,47 @@ def dpp_generation(model_data,
         HFI_params = HFI_info['HFI']['params']
         
     # ===== simulation =====
-    data = {}
+    
+    # initiate cell (built once and reused for each simulation target, and for later jobs of the same model)
+    cell, rheobase = get_cell(model_data, cell_index)
+    
+    # state and time from which simulations start (from rest, skipping the settling period, if requested)
+    rest_state, start = set_initial_state(cell, model_data, cell_index, clus_params)
+    noise_start = [start]*len(list(cell.allseclist)) if start else []
+    
+    
+    # record vectors (the membrane potential is not needed if only spikes are analysed)
+    recordings = set_recordings(cell, model_data, dur_and_amp)
+    record_dt = model_data.get('record_dt')
+    if spike:
+        spike_ncon, spike_vec = record_spikes(cell)
+    
+    # integration method (fixed or adaptive time steps)
+    cvode = set_integration(model_data)
+    
+    # a sweep of HFI delays branches from one simulation until the earliest HFIs (see BranchPoint)
+    sweep = isinstance(HFI_delay, (list, tuple, np.ndarray))
+    delays = list(HFI_delay) if sweep else [HFI_delay]
+    HFI_onset = clus_params['stim_t']+(clus_params['stim_n']*clus_params['isi'])
+    sweep_data = {delay:{} for delay in delays}
+    
+    # background noise and HFIs from spike times drawn in advance (VecStims) or during the simulation (NetStims);
+    # NetStim streams are not restored with the state of a simulation, so sweeps use VecStims
+    vecstim = model_data.get('vecstim', False) or sweep
+    
+    tstop = clus_params['stop_t']+max(delays)+(clus_params['stim_n']*clus_params['isi'])
     
     for i, tar in enumerate(clus_info['clustered']['target']): # for each simulation target
         
         clus_lab = clus_info['clustered']['label'][i] # label for input target
+        inputs = {}
         
         
-        # initiate cell
-        cell = build.MSN(params=model_data['specs']['par'],
-                         morphology=model_data['specs']['morph'],
-                         variables=model_data['model_sets'][cell_index]['variables'])
-        rheobase = model_data['model_sets'][cell_index]['rheobase']
-        
-        
-        # record vectors
-        tm = h.Vector()
-        tm.record(h._ref_t)
-        vm = h.Vector()
-        vm.record(cell.soma(0.5)._ref_v)
-        
+        # random numbers of this condition (e.g. HFI locations)
+        streams.seed_globals(clus_lab)
         
         # add clustered inputs
-        clus_syn, clus_stim, clus_ncon, clus_d2soma = cf.set_clustered_stim(cell, tar ,n=clus_params['stim_n'],
+        inputs['clustered'] = cf.set_clustered_stim(cell, tar ,n=clus_params['stim_n'],
             act_time=clus_params['stim_t'], ISI=clus_params['isi'])
         
         # add background noise
@@ -185,61 +901,79 @@ def dpp_generation(model_data,
                 n_glut=noise_params['n_glut'], n_gaba=noise_params['n_gaba'], only_dend=noise_params['only dend'],
                 glut_delay=noise_params['stim_t'], gaba_delay=noise_params['stim_t'])
             '''
-            noise_syn, noise_stim, noise_ncon = cf.set_bg_noise(cell,model_data['cell_type'], fglut=noise_params['freq_glut'],
-                fgaba=noise_params['freq_gaba'],dendOnly=noise_params['only dend'])
+            inputs['noise'] = cf.set_bg_noise(cell,model_data['cell_type'], fglut=noise_params['freq_glut'],
+                fgaba=noise_params['freq_gaba'],dendOnly=noise_params['only dend'], delays=noise_start, vecstim=vecstim,
+                tstop=tstop, rng=streams.generator(clus_lab, 'noise'))
+            streams.assign(inputs['noise'][2], clus_lab, 'noise')
 
         
         # add high-frequency inputs
-        if HFI:
+        HFI_spikes = []
+        if HFI and sweep:
+            # adds HFI, whose spikes (the same trains from the onset of each delay) are delivered in each branch
+            inputs['HFI'] = cf.set_HFI(cell, model_data['cell_type'],
+                freq=HFI_params['freq'], n_inputs=HFI_params['n_inputs'], delay=HFI_onset+min(delays),
+                exclude=HFI_info['HFI']['exclude'], vecstim=True, spike_times=[[]]*HFI_params['n_inputs'])
+            trains = st.poisson_trains(HFI_params['freq'], clus_params['stop_t']-clus_params['stim_t'],
+                n=HFI_params['n_inputs'], number=1000, rng=streams.generator(clus_lab, 'HFI'))
+            # (inputs on the same section replace each other, as for HFIs set at once)
+            HFI_spikes = {cell.name2sec[tar].name()+'_glut':train for tar, train in zip(inputs['HFI'][3]['targets'], trains)}
+            HFI_spikes = [(inputs['HFI'][2][key], train) for key, train in HFI_spikes.items()]
+        elif HFI:
             # adds HFI
-            HFI_syn, HFI_stim, HFI_ncon, arrangement = cf.set_HFI(cell, model_data['cell_type'], 
+            inputs['HFI'] = cf.set_HFI(cell, model_data['cell_type'], 
                 freq=HFI_params['freq'], n_inputs=HFI_params['n_inputs'],
-                delay=clus_params['stim_t']+(clus_params['stim_n']*clus_params['isi'])+HFI_delay, 
-                exclude=HFI_info['HFI']['exclude'])
-            # collates data
-            data['HFI'] = arrangement
-        
+                delay=HFI_onset+HFI_delay, 
+                exclude=HFI_info['HFI']['exclude'], vecstim=vecstim, tstop=tstop,
+                rng=streams.generator(clus_lab, 'HFI'))
+            streams.assign(inputs['HFI'][1], clus_lab, 'HFI')
         
-        # run simulation
-        h.finitialize(-80)
-        while h.t < clus_params['stop_t']+HFI_delay+(clus_params['stim_n']*clus_params['isi']):
-            h.fadvance()
-        tm = tm.to_python()
-        vm = vm.to_python()
         
+        # run simulation (of each delay, from the earliest HFIs)
+        if sweep:
+            run_simulation(HFI_onset+min(delays), cvode, state=rest_state, start=start)
+            branch_point = BranchPoint({'traces':recordings, 'spikes':spike_vec} if spike else recordings)
         
-        # collate data
-        data[clus_lab] = {'vm':vm}
-        data['meta'] = {'id':int(cell_index), 'round':run_info['round'], 'cell_type':model_data['cell_type'], 'tm':tm, 
-                        'rheo':rheobase}
+        for delay in delays:
+            
+            data = sweep_data[delay]
+            delay_tstop = clus_params['stop_t']+delay+(clus_params['stim_n']*clus_params['isi'])
+            
+            if sweep:
+                continue_simulation(branch_point, delay_tstop, cvode,
+                    spikes=[(ncon, HFI_onset+delay+train) for ncon, train in HFI_spikes])
+            else:
+                run_simulation(delay_tstop, cvode, state=rest_state, start=start)
+            traces = get_traces(recordings, delay_tstop, cvode, record_dt, start)
+            
+            
+            # collate data
+            if HFI:
+                data['HFI'] = inputs['HFI'][3]
+            data[clus_lab] = {key:trace for key, trace in traces.items() if key != 'tm'}
+            data['meta'] = {'id':int(cell_index), 'round':run_info['round'], 'cell_type':model_data['cell_type'], 
+                            'rheo':rheobase}
+            if 'tm' in traces:
+                data['meta']['tm'] = traces['tm']
         
         
-        # calculate dpp duration and amplitude
-        if dur_and_amp:
-            base_t_start = tm.index(min(tm, key=lambda x:abs(x-(clus_params['stim_t']+clus_params['pre_t']))))
-            base_t_end = tm.index(min(tm, key=lambda x:abs(x-clus_params['stim_t'])))
-            base_vm = np.mean(vm[base_t_start:base_t_end])
-            data[clus_lab]['dur'] = cf.dpp_dur(tm, vm, base_vm, clus_params['stim_t'])
-            data[clus_lab]['amp'] = cf.dpp_amp(tm, vm, base_vm, clus_params['stim_t'])
-            
-        # get spike-related data
-        if spike:
-            spiked = 0
-            thresh = 0
-            # checks whether spike occured
-            data[clus_lab]['spiked'] = 0
-            if max(vm) > thresh:
-                data[clus_lab]['spiked'] = 1
-                spiked = 1
-            # checks time of first spike number of spikes that occured (if any)
-            data[clus_lab]['first_spike'] = []
-            data[clus_lab]['spike_n'] = []
-            if spiked == 1:
-                data[clus_lab]['first_spike'] = tm[next(i for i, x in enumerate(vm) if x > 0)]
-                data[clus_lab]['spike_n'] = cf.spike_n(vm)
+            # calculate dpp duration and amplitude
+            if dur_and_amp:
+                tm, vm = traces['tm'], traces['vm']
+                base_vm = baseline_vm(tm, vm, clus_params)
+                data[clus_lab]['dur'] = cf.dpp_dur(tm, vm, base_vm, clus_params['stim_t'])
+                data[clus_lab]['amp'] = cf.dpp_amp(tm, vm, base_vm, clus_params['stim_t'])
             
+            # get spike-related data
+            if spike:
+                # checks whether spike occured, time of first spike, and number of spikes that occured (if any)
+                data[clus_lab].update(get_spikes(spike_vec))
         
-    return data
+        # remove inputs before reusing the cell
+        reset_cell(inputs)
+        
+        
+    return sweep_data if sweep else sweep_data[HFI_delay]
 
 
 
@@ -259,8 +993,21 @@ def dpp_ACh_modded(model_data,
     plateau potential in the absence of modulation.
     
     INPUT(S):
-        - model_data: model paramaters (specification, cell type, model 
-            sets, and stimulation targets) [dict]
+        - model_data: model paramaters (specification, cell type, and 
+            stimulation targets); the cell specification is read from the
+            library given in the specification. May also contain the
+            integration method (see set_integration), what is recorded
+            (see set_recordings), the state from which simulations start
+            (see set_initial_state), and whether the background noise and
+            HFIs are played from spike times drawn in advance ('vecstim';
+            default False), and whether one realisation of the noise is drawn and
+            replayed in every condition, for paired comparisons
+            ('shared_noise'; default False), and whether the modulation
+            conditions of each clustered input target branch from a single
+            simulation of the period before modulation, with the same inputs
+            ('branch'; default False; implies 'vecstim'; see BranchPoint), and
+            a master seed from which the random numbers of the job are drawn
+            reproducibly ('master_seed'; see rng_streams) [dict]
         - stim_data: stimulation parameters (number of inputs, time of inputs,
             input inter-spike intervals, time to stop simulating) [dict]
         - cell_index: cell specification being simulated [int]
@@ -284,6 +1031,10 @@ def dpp_ACh_modded(model_data,
     print('Simulating cell specification {} of {}'.format( \
           run_info['curr_n']+1,run_info['tot_n']),flush = True)
     
+    # random number streams of the job (reproducible, if a master seed is given)
+    streams = rs.JobStreams(model_data.get('master_seed'), cell_index, run_info.get('round', 0))
+    streams.seed_globals('job')
+    
     
     # ===== gets stimulation info =====
     # clustered inputs
@@ -296,13 +1047,10 @@ def dpp_ACh_modded(model_data,
     ACh_info = cf.params_for_input(model_data['cell_type'], 'ACh')
     ACh_params = ACh_info['ACh']['params']
     
-    # gets vector for modulation timing
-    state = [1 if ht >= ACh_params['stim_t'] and ht <= ACh_params['stop_t'] \
-             else 0 for ht in np.arange(0,clus_params['stop_t'],h.dt)]
+    # gets vector for modulation timing (built once, and shared by the jobs of the process)
+    mod_state = tr.get_vector('step', clus_params['stop_t'], start=ACh_params['stim_t'], stop=ACh_params['stop_t'])
     if 'kaf' in mod_factors:
-        kaf_state = [x * mod_factors['kaf'] for x in state]
-        kaf_state = h.Vector(kaf_state)
-    state = h.Vector(state)
+        kaf_state = h.Vector(mod_state.as_numpy() * mod_factors['kaf'])
     
     # collates time-dependent mechanism modulation scaling
     mech_scale = {}
@@ -310,7 +1058,7 @@ def dpp_ACh_modded(model_data,
         if key == 'kaf':
             mech_scale[key] = kaf_state
         else:
-            mech_scale[key] = state
+            mech_scale[key] = mod_state
     
     
     # noise inputs
@@ -326,6 +1074,43 @@ def dpp_ACh_modded(model_data,
     # ===== simulation =====
     data = {}
     
+    # initiate cell (built once and reused for each simulation target, and for later jobs of the same model)
+    cell, rheobase = get_cell(model_data, cell_index)
+    
+    # state and time from which simulations start (from rest, skipping the settling period, if requested)
+    rest_state, start = set_initial_state(cell, model_data, cell_index, clus_params)
+    noise_start = [start]*len(list(cell.allseclist)) if start else []
+    
+    # record vectors (the membrane potential is not needed if only spikes are analysed)
+    recordings = set_recordings(cell, model_data, dur_and_amp)
+    record_dt = model_data.get('record_dt')
+    if spike:
+        spike_ncon, spike_vec = record_spikes(cell)
+    
+    # integration method (fixed or adaptive time steps)
+    cvode = set_integration(model_data)
+    
+    # only keeps the changes in modulation, as each played element interrupts CVode
+    play_t = h.dt
+    if cvode:
+        mech_scale, play_t = compress_play(mech_scale, h.dt)
+    
+    # conditions branching from one simulation of the period before modulation (see BranchPoint)
+    branch = model_data.get('branch', False)
+    
+    # background noise and HFIs from spike times drawn in advance (VecStims) or during the simulation (NetStims);
+    # NetStim streams are not restored with the state of a simulation, so branched conditions use VecStims
+    vecstim = model_data.get('vecstim', False) or branch
+    
+    tstop = clus_params['stop_t']+HFI_delay+(clus_params['stim_n']*clus_params['isi'])
+    
+    # one realisation of the background noise, replayed in every condition
+    realisation = None
+    if noise and model_data.get('shared_noise', False):
+        realisation = st.NoiseRealisation(cell.dendlist if noise_params['only dend'] else cell.allseclist,
+            {'glut':noise_params['freq_glut'], 'gaba':noise_params['freq_gaba']}, tstop, start=start,
+            rng=streams.generator('noise'))
+    
     for i, clus_tar in enumerate(clus_info['clustered']['target']): # for each simulation target
         
         clus_lab = clus_info['clustered']['label'][i] # label for input target
@@ -345,75 +1130,82 @@ def dpp_ACh_modded(model_data,
             ACh_targets['label'] = ['all']
             #target_x = 'all'
         
+        branch_point = None
         for j, ACh_t in enumerate(ACh_targets['target']): # for each cholinergic input target
-            
+
             ACh_lab = ACh_targets['label'][j]
-            
-            # initiate cell
-            cell = build.MSN(params=model_data['specs']['par'],
-                             morphology=model_data['specs']['morph'],
-                             variables=model_data['model_sets'][cell_index]['variables'])
-            rheobase = model_data['model_sets'][cell_index]['rheobase']
-            
-            # record vectors
-            tm = h.Vector()
-            tm.record(h._ref_t)
-            vm = h.Vector()
-            vm.record(cell.soma(0.5)._ref_v)
-            
-            
-            # add clustered inputs
-            clus_syn, clus_stim, clus_ncon, clus_d2soma = cf.set_clustered_stim(cell, clus_tar ,n=clus_params['stim_n'],
-                act_time=clus_params['stim_t'], ISI=clus_params['isi'])
-            
-            # add background noise
-            if noise:
-                noise_syn, noise_stim, noise_ncon = cf.set_bg_noise(cell, model_data['cell_type'], 
-                    fglut=noise_params['freq_glut'], fgaba=noise_params['freq_gaba'], dendOnly=noise_params['only dend'])
-    
-            
-            # add high-frequency inputs
-            if HFI:
-                # adds HFI
-                HFI_syn, HFI_stim, HFI_ncon, arrangement = cf.set_HFI(cell, model_data['cell_type'], 
-                    freq=HFI_params['freq'], n_inputs=HFI_params['n_inputs'],
-                    delay=clus_params['stim_t']+(clus_params['stim_n']*clus_params['isi'])+HFI_delay, 
-                    exclude=HFI_info['HFI']['exclude'])
-                # collates data
-                data['HFI'] = arrangement
-            
+
+            # inputs of this condition (when branching, those of the first condition are kept for all conditions)
+            if not branch or j == 0:
+                inputs = {}
+                ids = (clus_lab,) if branch else (clus_lab, ACh_lab)
+
+                # random numbers of this condition (e.g. HFI locations)
+                streams.seed_globals(*ids)
+
+                # add clustered inputs
+                inputs['clustered'] = cf.set_clustered_stim(cell, clus_tar ,n=clus_params['stim_n'],
+                    act_time=clus_params['stim_t'], ISI=clus_params['isi'])
+
+                # add background noise
+                if noise:
+                    inputs['noise'] = cf.set_bg_noise(cell, model_data['cell_type'],
+                        fglut=noise_params['freq_glut'], fgaba=noise_params['freq_gaba'], dendOnly=noise_params['only dend'],
+                        delays=noise_start, vecstim=vecstim, tstop=tstop, realisation=realisation, rng=streams.generator(*ids, 'noise'))
+                    streams.assign(inputs['noise'][2], *ids, 'noise')
+
+
+                # add high-frequency inputs
+                if HFI:
+                    # adds HFI
+                    inputs['HFI'] = cf.set_HFI(cell, model_data['cell_type'],
+                        freq=HFI_params['freq'], n_inputs=HFI_params['n_inputs'],
+                        delay=clus_params['stim_t']+(clus_params['stim_n']*clus_params['isi'])+HFI_delay,
+                        exclude=HFI_info['HFI']['exclude'], vecstim=vecstim, tstop=tstop,
+                        rng=streams.generator(*ids, 'HFI'))
+                    streams.assign(inputs['HFI'][1], *ids, 'HFI')
+                    # collates data
+                    data['HFI'] = inputs['HFI'][3]
+
+            # when branching, the period before modulation (the same in every condition) is simulated once
+            if branch and branch_point is None:
+                run_simulation(ACh_params['stim_t'], cvode, state=rest_state, start=start)
+                branch_point = BranchPoint({'traces':recordings, 'spikes':spike_vec} if spike else recordings)
+
             # get cholinergic modulation class
-            modulation = modulate.set_ACh(cell, mod_factors, [ACh_t], target_x=target_x, play=mech_scale, dt=h.dt)
-            
+            play = {key:EventPlay(vec) for key, vec in mech_scale.items()} if branch else mech_scale
+            modulation = modulate.set_ACh(cell, mod_factors, [ACh_t], target_x=target_x, play=play, dt=play_t)
+
             # run simulation
-            h.finitialize(-80)
-            while h.t < clus_params['stop_t']+HFI_delay+(clus_params['stim_n']*clus_params['isi']):
-                h.fadvance()
-            tm = tm.to_python()
-            vm = vm.to_python()
+            if branch:
+                continue_simulation(branch_point, tstop, cvode, play)
+            else:
+                run_simulation(tstop, cvode, state=rest_state, start=start)
+            traces = get_traces(recordings, tstop, cvode, record_dt, start)
+
+            # remove inputs and modulation before reusing the cell (when branching, inputs after the last condition)
+            reset_cell(inputs if not branch or j == len(ACh_targets['target'])-1 else {}, modulation)
             
             
             # collate data
-            data[clus_lab][ACh_lab] = {'vm':vm}
-            data['meta'] = {'id':int(cell_index), 'round':run_info['round'], 'cell_type':model_data['cell_type'], 'tm':tm, 
+            data[clus_lab][ACh_lab] = {key:trace for key, trace in traces.items() if key != 'tm'}
+            data['meta'] = {'id':int(cell_index), 'round':run_info['round'], 'cell_type':model_data['cell_type'], 
                             'rheo':rheobase}
+            if 'tm' in traces:
+                data['meta']['tm'] = traces['tm']
             
             
             # calculate dpp duration and amplitude
             if dur_and_amp:
-                base_t_start = tm.index(min(tm, key=lambda x:abs(x-(clus_params['stim_t']+clus_params['pre_t']))))
-                base_t_end = tm.index(min(tm, key=lambda x:abs(x-clus_params['stim_t'])))
-                base_vm = np.mean(vm[base_t_start:base_t_end])
+                tm, vm = traces['tm'], traces['vm']
+                base_vm = baseline_vm(tm, vm, clus_params)
                 data[clus_lab][ACh_lab]['dur'] = cf.dpp_dur(tm, vm, base_vm, clus_params['stim_t'])
                 data[clus_lab][ACh_lab]['amp'] = cf.dpp_amp(tm, vm, base_vm, clus_params['stim_t'])
                 
             # get spike-related data
             if spike:
-                thresh = 0
                 # checks whether spike occured
-                data[clus_lab][ACh_lab]['spiked'] = 0
-                if max(vm) > thresh:
-                    data[clus_lab][ACh_lab]['spiked'] = 1
+                data[clus_lab][ACh_lab]['spiked'] = get_spikes(spike_vec)['spiked']
                 
             
         
@@ -437,8 +1229,21 @@ def dpp_DA_modded(model_data,
     plateau potential in the absence of modulation.
     
     INPUT(S):
-        - model_data: model paramaters (specification, cell type, model 
-            sets, and stimulation targets) [dict]
+        - model_data: model paramaters (specification, cell type, and 
+            stimulation targets); the cell specification is read from the
+            library given in the specification. May also contain the
+            integration method (see set_integration), what is recorded
+            (see set_recordings), the state from which simulations start
+            (see set_initial_state), and whether the background noise and
+            HFIs are played from spike times drawn in advance ('vecstim';
+            default False), and whether one realisation of the noise is drawn and
+            replayed in every condition, for paired comparisons
+            ('shared_noise'; default False), and whether the modulation
+            conditions of each clustered input target branch from a single
+            simulation of the period before modulation, with the same inputs
+            ('branch'; default False; implies 'vecstim'; see BranchPoint), and
+            a master seed from which the random numbers of the job are drawn
+            reproducibly ('master_seed'; see rng_streams) [dict]
         - stim_data: stimulation parameters (number of inputs, time of inputs,
             input inter-spike intervals, time to stop simulating) [dict]
         - cell_index: cell specification being simulated [int]
@@ -462,6 +1267,10 @@ def dpp_DA_modded(model_data,
     print('Simulating cell specification {} of {}'.format( \
           run_info['curr_n']+1,run_info['tot_n']),flush = True)
     
+    # random number streams of the job (reproducible, if a master seed is given)
+    streams = rs.JobStreams(model_data.get('master_seed'), cell_index, run_info.get('round', 0))
+    streams.seed_globals('job')
+    
     
     # ===== gets stimulation info =====
     # clustered inputs
@@ -474,15 +1283,13 @@ def dpp_DA_modded(model_data,
     DA_info = cf.params_for_input(model_data['cell_type'], 'DA')
     DA_params = DA_info['DA']['params']
     
-    # gets vector for modulation timing
-    state = [1 if ht >= DA_params['stim_t'] and ht <= DA_params['stop_t'] \
-             else 0 for ht in np.arange(0,clus_params['stop_t'],h.dt)]
-    state = h.Vector(state)
+    # gets vector for modulation timing (built once, and shared by the jobs of the process)
+    mod_state = tr.get_vector('step', clus_params['stop_t'], start=DA_params['stim_t'], stop=DA_params['stop_t'])
     
     # collates time-dependent mechanism modulation scaling
     mech_scale = {}
     for key in mod_factors:
-        mech_scale[key] = state
+        mech_scale[key] = mod_state
     
     
     # noise inputs
@@ -498,6 +1305,43 @@ def dpp_DA_modded(model_data,
     # ===== simulation =====
     data = {}
     
+    # initiate cell (built once and reused for each simulation target, and for later jobs of the same model)
+    cell, rheobase = get_cell(model_data, cell_index)
+    
+    # state and time from which simulations start (from rest, skipping the settling period, if requested)
+    rest_state, start = set_initial_state(cell, model_data, cell_index, clus_params)
+    noise_start = [start]*len(list(cell.allseclist)) if start else []
+    
+    # record vectors (the membrane potential is not needed if only spikes are analysed)
+    recordings = set_recordings(cell, model_data, dur_and_amp)
+    record_dt = model_data.get('record_dt')
+    if spike:
+        spike_ncon, spike_vec = record_spikes(cell)
+    
+    # integration method (fixed or adaptive time steps)
+    cvode = set_integration(model_data)
+    
+    # only keeps the changes in modulation, as each played element interrupts CVode
+    play_t = h.dt
+    if cvode:
+        mech_scale, play_t = compress_play(mech_scale, h.dt)
+    
+    # conditions branching from one simulation of the period before modulation (see BranchPoint)
+    branch = model_data.get('branch', False)
+    
+    # background noise and HFIs from spike times drawn in advance (VecStims) or during the simulation (NetStims);
+    # NetStim streams are not restored with the state of a simulation, so branched conditions use VecStims
+    vecstim = model_data.get('vecstim', False) or branch
+    
+    tstop = clus_params['stop_t']+HFI_delay+(clus_params['stim_n']*clus_params['isi'])
+    
+    # one realisation of the background noise, replayed in every condition
+    realisation = None
+    if noise and model_data.get('shared_noise', False):
+        realisation = st.NoiseRealisation(cell.dendlist if noise_params['only dend'] else cell.allseclist,
+            {'glut':noise_params['freq_glut'], 'gaba':noise_params['freq_gaba']}, tstop, start=start,
+            rng=streams.generator('noise'))
+    
     for i, clus_tar in enumerate(clus_info['clustered']['target']): # for each simulation target
         
         clus_lab = clus_info['clustered']['label'][i] # label for input target
@@ -517,76 +1361,82 @@ def dpp_DA_modded(model_data,
             DA_targets['label'] = ['all']
             target_x = 'all'
         
+        branch_point = None
         for j, DA_t in enumerate(DA_targets['target']): # for each cholinergic input target
-            
+
             DA_lab = DA_targets['label'][j]
-            
-            # initiate cell
-            cell = build.MSN(params=model_data['specs']['par'],
-                             morphology=model_data['specs']['morph'],
-                             variables=model_data['model_sets'][cell_index]['variables'])
-            rheobase = model_data['model_sets'][cell_index]['rheobase']
-            
-            
-            # record vectors
-            tm = h.Vector()
-            tm.record(h._ref_t)
-            vm = h.Vector()
-            vm.record(cell.soma(0.5)._ref_v)
-            
-            
-            # add clustered inputs
-            clus_syn, clus_stim, clus_ncon, clus_d2soma = cf.set_clustered_stim(cell, clus_tar ,n=clus_params['stim_n'],
-                act_time=clus_params['stim_t'], ISI=clus_params['isi'])
-            
-            # add background noise
-            if noise:
-                noise_syn, noise_stim, noise_ncon = cf.set_bg_noise(cell, model_data['cell_type'], 
-                    fglut=noise_params['freq_glut'], fgaba=noise_params['freq_gaba'], dendOnly=noise_params['only dend'])
-    
-            
-            # add high-frequency inputs
-            if HFI:
-                # adds HFI
-                HFI_syn, HFI_stim, HFI_ncon, arrangement = cf.set_HFI(cell, model_data['cell_type'], 
-                    freq=HFI_params['freq'], n_inputs=HFI_params['n_inputs'],
-                    delay=clus_params['stim_t']+(clus_params['stim_n']*clus_params['isi'])+HFI_delay, 
-                    exclude=HFI_info['HFI']['exclude'])
-                # collates data
-                data['HFI'] = arrangement
-            
+
+            # inputs of this condition (when branching, those of the first condition are kept for all conditions)
+            if not branch or j == 0:
+                inputs = {}
+                ids = (clus_lab,) if branch else (clus_lab, DA_lab)
+
+                # random numbers of this condition (e.g. HFI locations)
+                streams.seed_globals(*ids)
+
+                # add clustered inputs
+                inputs['clustered'] = cf.set_clustered_stim(cell, clus_tar ,n=clus_params['stim_n'],
+                    act_time=clus_params['stim_t'], ISI=clus_params['isi'])
+
+                # add background noise
+                if noise:
+                    inputs['noise'] = cf.set_bg_noise(cell, model_data['cell_type'],
+                        fglut=noise_params['freq_glut'], fgaba=noise_params['freq_gaba'], dendOnly=noise_params['only dend'],
+                        delays=noise_start, vecstim=vecstim, tstop=tstop, realisation=realisation, rng=streams.generator(*ids, 'noise'))
+                    streams.assign(inputs['noise'][2], *ids, 'noise')
+
+
+                # add high-frequency inputs
+                if HFI:
+                    # adds HFI
+                    inputs['HFI'] = cf.set_HFI(cell, model_data['cell_type'],
+                        freq=HFI_params['freq'], n_inputs=HFI_params['n_inputs'],
+                        delay=clus_params['stim_t']+(clus_params['stim_n']*clus_params['isi'])+HFI_delay,
+                        exclude=HFI_info['HFI']['exclude'], vecstim=vecstim, tstop=tstop,
+                        rng=streams.generator(*ids, 'HFI'))
+                    streams.assign(inputs['HFI'][1], *ids, 'HFI')
+                    # collates data
+                    data['HFI'] = inputs['HFI'][3]
+
+            # when branching, the period before modulation (the same in every condition) is simulated once
+            if branch and branch_point is None:
+                run_simulation(DA_params['stim_t'], cvode, state=rest_state, start=start)
+                branch_point = BranchPoint({'traces':recordings, 'spikes':spike_vec} if spike else recordings)
+
             # get cholinergic modulation class
-            modulation = modulate.set_DA(cell, mod_factors, [DA_t], target_x=target_x, play=mech_scale, dt=h.dt)
-            
+            play = {key:EventPlay(vec) for key, vec in mech_scale.items()} if branch else mech_scale
+            modulation = modulate.set_DA(cell, mod_factors, [DA_t], target_x=target_x, play=play, dt=play_t)
+
             # run simulation
-            h.finitialize(-80)
-            while h.t < clus_params['stop_t']+HFI_delay+(clus_params['stim_n']*clus_params['isi']):
-                h.fadvance()
-            tm = tm.to_python()
-            vm = vm.to_python()
+            if branch:
+                continue_simulation(branch_point, tstop, cvode, play)
+            else:
+                run_simulation(tstop, cvode, state=rest_state, start=start)
+            traces = get_traces(recordings, tstop, cvode, record_dt, start)
+
+            # remove inputs and modulation before reusing the cell (when branching, inputs after the last condition)
+            reset_cell(inputs if not branch or j == len(DA_targets['target'])-1 else {}, modulation)
             
             
             # collate data
-            data[clus_lab][DA_lab] = {'vm':vm}
-            data['meta'] = {'id':int(cell_index), 'round':run_info['round'], 'cell_type':model_data['cell_type'], 'tm':tm, 
+            data[clus_lab][DA_lab] = {key:trace for key, trace in traces.items() if key != 'tm'}
+            data['meta'] = {'id':int(cell_index), 'round':run_info['round'], 'cell_type':model_data['cell_type'], 
                             'rheo':rheobase}
+            if 'tm' in traces:
+                data['meta']['tm'] = traces['tm']
             
             
             # calculate dpp duration and amplitude
             if dur_and_amp:
-                base_t_start = tm.index(min(tm, key=lambda x:abs(x-(clus_params['stim_t']+clus_params['pre_t']))))
-                base_t_end = tm.index(min(tm, key=lambda x:abs(x-clus_params['stim_t'])))
-                base_vm = np.mean(vm[base_t_start:base_t_end])
+                tm, vm = traces['tm'], traces['vm']
+                base_vm = baseline_vm(tm, vm, clus_params)
                 data[clus_lab][DA_lab]['dur'] = cf.dpp_dur(tm, vm, base_vm, clus_params['stim_t'])
                 data[clus_lab][DA_lab]['amp'] = cf.dpp_amp(tm, vm, base_vm, clus_params['stim_t'])
                 
             # get spike-related data
             if spike:
-                thresh = 0
                 # checks whether spike occured
-                data[clus_lab][DA_lab]['spiked'] = 0
-                if max(vm) > thresh:
-                    data[clus_lab][DA_lab]['spiked'] = 1
+                data[clus_lab][DA_lab]['spiked'] = get_spikes(spike_vec)['spiked']
                     
                 
             
@@ -608,8 +1458,11 @@ def ACh_modulation(model_data,
     plateau potential alongside cholinergic modulation.
     
     INPUT(S):
-        - model_data: model paramaters (specification, cell type, model 
-            sets, and stimulation targets) [dict]
+        - model_data: model paramaters (specification, cell type, and 
+            stimulation targets); the cell specification is read from the
+            library given in the specification. May also contain the
+            integration method (see set_integration) and what is recorded
+            (see set_recordings) [dict]
         - stim_data: stimulation parameters (number of inputs, time of inputs,
             input inter-spike intervals, time to stop simulating) [dict]
         - cell_index: cell specification being simulated [int]
@@ -640,13 +1493,10 @@ def ACh_modulation(model_data,
     clus_params = stim_data['clustered']['params'] # parameters for clustered input
     ACh_params = stim_data['ACh']['params'] # parameters for cholinergic input
     
-    # gets vector for modulation timing
-    state = [1 if ht >= ACh_params['stim_t'] and ht <= ACh_params['stop_t'] \
-             else 0 for ht in np.arange(0,clus_params['stop_t'],h.dt)]
+    # gets vector for modulation timing (built once, and shared by the jobs of the process)
+    state = tr.get_vector('step', clus_params['stop_t'], start=ACh_params['stim_t'], stop=ACh_params['stop_t'])
     if 'kaf' in mod_factors:
-        kaf_state = [x * mod_factors['kaf'] for x in state]
-        kaf_state = h.Vector(kaf_state)
-    state = h.Vector(state)
+        kaf_state = h.Vector(state.as_numpy() * mod_factors['kaf'])
     
     # collates time-dependent mechanism modulation scaling
     mech_scale = {}
@@ -658,6 +1508,21 @@ def ACh_modulation(model_data,
     
     data = {}
     
+    # initiate cell (built once and reused for each simulation target, and for later jobs of the same model)
+    cell, rheobase = get_cell(model_data, cell_index)
+    
+    # record vectors
+    recordings = set_recordings(cell, model_data, dur_and_amp)
+    record_dt = model_data.get('record_dt')
+    
+    # integration method (fixed or adaptive time steps)
+    cvode = set_integration(model_data)
+    
+    # only keeps the changes in modulation, as each played element interrupts CVode
+    play_t = h.dt
+    if cvode:
+        mech_scale, play_t = compress_play(mech_scale, h.dt)
+    
     
     for i, clus_t in enumerate(stim_data['clustered']['target']): # for each clustered input target
         
@@ -676,47 +1541,39 @@ def ACh_modulation(model_data,
         for j, ACh_t in enumerate(ACh_targets['target']): # for each cholinergic input target
             
             ACh_lab = ACh_targets['label'][j]
-            
-            # initiate cell
-            cell = build.MSN(params=model_data['specs']['par'],
-                             morphology=model_data['specs']['morph'],
-                             variables=model_data['model_sets'][cell_index]['variables'])
-            rheobase = model_data['model_sets'][cell_index]['rheobase']
+            inputs = {}
         
             # gets distance info for targeted regions
             dists = cf.get_dists(cell,only_sec=ACh_targets['target'])
             
-            # record vectors
-            tm = h.Vector()
-            tm.record(h._ref_t)
-            vm = h.Vector()
-            vm.record(cell.soma(0.5)._ref_v)            
-            
             # add clustered inputs
-            syn,stim,ncon,d2soma = cf.set_clustered_stim(cell, clus_t, \
+            inputs['clustered'] = cf.set_clustered_stim(cell, clus_t, \
                 n = clus_params['stim_n'], act_time = clus_params['stim_t'], \
                 ISI = clus_params['isi'])
             
             # get cholinergic modulation class
             mod = modulate.set_ACh(cell, mod_factors, [ACh_t], target_x=.5,
-                play=mech_scale, dt=h.dt)
+                play=mech_scale, dt=play_t)
             
             # run simulation
-            h.finitialize(-80)
-            while h.t < clus_params['stop_t']:
-                h.fadvance()
-            tm = tm.to_python()
-            vm = vm.to_python()
+            tstop = clus_params['stop_t']
+            run_simulation(tstop, cvode)
+            traces = get_traces(recordings, tstop, cvode, record_dt)
+            
+            # remove inputs and modulation before reusing the cell
+            reset_cell(inputs, mod)
             
             # collate data
-            data[clus_lab][ACh_lab] = \
-                {'tm':tm, 'vm':vm, 'clust_dist':dists[clus_t], \
+            data[clus_lab][ACh_lab] = traces
+            data[clus_lab][ACh_lab].update( \
+                {'clust_dist':dists[clus_t], \
                  'ACh_dist':dists[ACh_t], 'rheo':rheobase,  \
-                 'id':int(cell_index), 'cell_type':model_data['cell_type']}
+                 'id':int(cell_index), 'cell_type':model_data['cell_type']})
             
             if dur_and_amp:
                 # calculate dpp duration and amplitude
-                base_t = tm.index(min(tm, key=lambda x:abs(x-clus_params['stim_t'])))-1
+                tm, vm = traces['tm'], traces['vm']
+                base_t = pf.nearest_index(tm, clus_params['stim_t'])-1
                 data[clus_lab][ACh_lab]['dur'] = cf.dpp_dur(tm,vm,vm[base_t],clus_params['stim_t'])
                 data[clus_lab][ACh_lab]['amp'] = cf.dpp_amp(tm,vm,vm[base_t],clus_params['stim_t'])
             
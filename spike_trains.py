@@ -0,0 +1,175 @@
+'''
+Pre-generated Poisson spike trains, to be played into synapses through VecStims
+(mechanisms/single/vecevent.mod) instead of being generated by NetStims (with
+noise=1) while the simulation runs.
+
+The spike times of all trains are drawn at once (as cumulative sums of
+exponentially distributed inter-spike intervals), so that a set of trains can
+be kept and replayed identically in other simulations (see NoiseRealisation).
+'''
+
+from   neuron           import h
+import numpy                as np
+
+
+
+def poisson_trains(rate, tstop, n=1, start=0, number=None, rng=None):
+    '''
+    Draws the spike times of independent Poisson spike trains, all from one
+    random number generator. Spikes occur as for a NetStim with noise=1, i.e.
+    from the start time, with exponentially distributed inter-spike intervals.
+
+    INPUT(S):
+        - rate: mean firing rate of the trains (in Hz) [number, or array of n
+            numbers]
+        - tstop: time until which spikes are drawn (in ms) [number]
+        - n: number of trains (default 1) [int]
+        - start: time from which the trains can spike (in ms) (default 0)
+            [number, or array of n numbers]
+        - number: maximum number of spikes in each train (as NetStim.number).
+            If None, the number is not limited (default None) [int]
+        - rng: random number generator, or seed for a new generator. If None,
+            a generator with a random seed is used (default None)
+            [np.random.Generator or int]
+
+    OUTPUT(S):
+        - trains: spike times of each train (in ms) [list of n numpy arrays]
+    '''
+
+    rng = np.random.default_rng(rng)
+    with np.errstate(divide='ignore'): # trains with a rate of 0 never spike
+        mean_isi = 1000 / np.broadcast_to(np.asarray(rate, dtype=float), (n,))
+    start = np.broadcast_to(np.asarray(start, dtype=float), (n,))
+
+    # enough intervals that (almost always) every train passes tstop
+    expected = np.maximum(tstop-start, 0) / mean_isi
+    n_isis = int(np.max(expected + 5*np.sqrt(expected), initial=0)) + 10
+
+    times = start[:, np.newaxis] + np.cumsum(rng.exponential(size=(n, n_isis))*mean_isi[:, np.newaxis], axis=1)
+    while np.any(times[:, -1] <= tstop):
+        more = times[:, -1:] + np.cumsum(rng.exponential(size=(n, n_isis))*mean_isi[:, np.newaxis], axis=1)
+        times = np.concatenate([times, more], axis=1)
+
+    counts = np.sum(times <= tstop, axis=1)
+    if number is not None:
+        counts = np.minimum(counts, number)
+
+    return [times[i, :counts[i]] for i in range(n)]
+
+
+
+
+def seeded_trains(rate, tstop, seeds, start=0, number=None):
+    '''
+    Draws the spike times of Poisson spike trains, each from its own random
+    number generator, so that the train of a synapse depends only on its seed
+    (and not on the number or order of the other trains).
+
+    INPUT(S):
+        - rate: mean firing rate of the trains (in Hz) [number, or array of
+            one number per seed]
+        - tstop: time until which spikes are drawn (in ms) [number]
+        - seeds: seed of each train [list of ints (or of sequences of ints)]
+        - start: time from which the trains can spike (in ms) (default 0)
+            [number, or array of one number per seed]
+        - number: maximum number of spikes in each train (default None) [int]
+
+    OUTPUT(S):
+        - trains: spike times of each train (in ms) [list of numpy arrays]
+    '''
+
+    rate = np.broadcast_to(np.asarray(rate, dtype=float), (len(seeds),))
+    start = np.broadcast_to(np.asarray(start, dtype=float), (len(seeds),))
+
+    return [poisson_trains(rate[i], tstop, start=start[i], number=number, rng=seed)[0]
+            for i, seed in enumerate(seeds)]
+
+
+
+
+def vecstim(times):
+    '''
+    Creates a VecStim that plays the given spike times. The VecStim keeps a
+    reference to the vector of times (an h.Vector is played as it is, so can be
+    shared by several VecStims).
+
+    INPUT(S):
+        - times: spike times (in ms) [array of numbers or h.Vector]
+
+    OUTPUT(S):
+        - stim: the VecStim [h.VecStim]
+    '''
+
+    if not isinstance(times, h.Vector):
+        times = h.Vector(times)
+
+    stim = h.VecStim()
+    stim.play(times)
+
+    return stim
+
+
+
+
+class NoiseRealisation():
+    '''
+    One realisation of background noise: the spike times of the synapses of
+    each section of a cell (e.g. a glutamatergic and a GABAergic synapse, as in
+    common_functions.set_bg_noise), drawn once and then replayed identically in
+    every simulation they are given to. Simulations of different conditions
+    (e.g. modulation targets) with the same realisation then differ only by
+    the condition, so can be compared in pairs.
+    '''
+
+    def __init__(self,  sections,
+                        rates,
+                        tstop,
+                        start=0,
+                        rng=None):
+        '''
+        INPUT(S):
+            - sections: sections given the synapses [list or h.SectionList of
+                h.Sections]
+            - rates: mean firing rate (in Hz) of each type of synapse (e.g.
+                {'glut':12, 'gaba':4}) [dict]
+            - tstop: time until which spikes are drawn (in ms) [number]
+            - start: time from which the synapses (of each section) can spike
+                (in ms) (default 0) [number, or list of one number per
+                section]
+            - rng: random number generator, or seed for a new generator
+                (default None) [np.random.Generator or int]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.sections = [sec.name() for sec in sections]
+        self.tstop = tstop
+        self._index = {name: s for s, name in enumerate(self.sections)}
+
+        if np.ndim(start):
+            start = np.asarray(start)[:len(self.sections)]
+
+        # spike times of every synapse drawn at once for each type, and held in vectors shared by the VecStims
+        rng = np.random.default_rng(rng)
+        self.times = {}
+        self._vectors = {}
+        for syn_type, rate in rates.items():
+            self.times[syn_type] = poisson_trains(rate, tstop, n=len(self.sections), start=start, rng=rng)
+            self._vectors[syn_type] = [h.Vector(times) for times in self.times[syn_type]]
+
+
+    def spike_times(self, sec_name, syn_type):
+        '''
+        Gets the spike times of a synapse, to be played by a VecStim (see
+        vecstim).
+
+        INPUT(S):
+            - sec_name: name of the section of the synapse [str]
+            - syn_type: type of the synapse (a key of rates) [str]
+
+        OUTPUT(S):
+            - times: spike times (in ms) [h.Vector]
+        '''
+
+        return self._vectors[syn_type][self._index[sec_name]]
@@ -16,7 +16,7 @@ mod_type = 'ACh'
 if not modulation:
     
     # load data
-    data = cf.load_data('Data/{}_HFI[0]+0_validation.json'.format(cell_type))
+    data = cf.load_data('Data/{}_HFI[0]+0_validation.pkl'.format(cell_type))
     clus_info = data['meta']['clustered']
     clus_labels = clus_info['label']
     
@@ -73,8 +73,8 @@ else:
     
     
     # load data
-    data = cf.load_data('Data/{}_HFI[0]+0_{}-modulation.json'.format(cell_type, mod_type))
-    ctrl_data = cf.load_data('Data/{}_HFI[0]+0_validation.json'.format(cell_type))
+    data = cf.load_data('Data/{}_HFI[0]+0_{}-modulation.pkl'.format(cell_type, mod_type))
+    ctrl_data = cf.load_data('Data/{}_HFI[0]+0_validation.pkl'.format(cell_type))
     clus_info = data['meta']['clustered']
     clus_labels = clus_info['label']
     
@@ -20,7 +20,7 @@ if not modulation:
     # load data
     spike_data = {}
     for i, r in enumerate(delta):
-        data = cf.load_data('Data/{}_HFI[1]+{}_validation.json'.format(cell_type, delta[i]))
+        data = cf.load_data('Data/{}_HFI[1]+{}_validation.pkl'.format(cell_type, delta[i]))
         spike_data[r] = data['all']
         
     clus_info = data['meta']['clustered']
@@ -63,10 +63,10 @@ else:
     spike_data = {}
     spike_data_ctrl = {}
     for delt in delta:
-        data = cf.load_data('Data/{}_HFI[1]+{}_validation.json'.format(cell_type, delt))
+        data = cf.load_data('Data/{}_HFI[1]+{}_validation.pkl'.format(cell_type, delt))
         spike_data_ctrl[delt] = data['all']
         
-        data = cf.load_data('Data/{}_HFI[1]+{}_{}-modulation.json'.format(cell_type, delt, mod_type))
+        data = cf.load_data('Data/{}_HFI[1]+{}_{}-modulation.pkl'.format(cell_type, delt, mod_type))
         spike_data[delt] = data['all']
     
     clus_info = data['meta']['clustered']
@@ -0,0 +1,262 @@
+'''
+Cache of the resting (steady) states of models.
+
+Simulations start with the membrane potential of every segment at -80 mV, and
+the first part of each simulation is the cell settling to rest. Instead, the
+resting state of a model (the membrane potential, mechanism states, and ion
+concentrations of every segment) is found once, by simulating the model
+without inputs until it has settled, and simulations of the model are then
+initialised from it. They can start at a later time (e.g. the start of the
+baseline before the stimulus), rather than simulating the settling period.
+
+Resting states are kept for the process, and can also be saved to a folder
+(one pickled file per state, named by a hash of everything that determines the
+state: the model variables, the parameter and morphology files, the
+mechanisms, the initial membrane potential, the settling time, the time step,
+and the temperature), so that each is only found once for all runs.
+'''
+
+import hashlib
+import json
+import os
+import pickle
+from   neuron               import h
+import numpy                    as np
+import common_functions         as cf
+import model_registry           as registry
+import result_cache             as rc
+
+
+
+# resting states found or loaded in this process; keyed by hash
+_states = {}
+
+# state variables of each density mechanism, and ion concentrations (found once per process)
+_variables = {}
+
+
+
+
+def mechanism_variables():
+    '''
+    Gets the variables which make up the state of a segment with each density
+    mechanism: the STATE variables of the mechanism or, for ions, the
+    concentrations (and reversal potential).
+
+    INPUT(S):
+        None
+
+    OUTPUT(S):
+        - variables: names of the variables (as attributes of a segment),
+            keyed by mechanism [dict of lists of str]
+    '''
+
+    if not _variables:
+        mt = h.MechanismType(0)
+        for i in range(int(mt.count())):
+            mt.select(i)
+            name = h.ref('')
+            mt.selected(name)
+            name = name[0]
+
+            if name.endswith('_ion'):
+                ion = name[:-len('_ion')]
+                _variables[name] = [ion+'i', ion+'o', 'e'+ion]
+            else:
+                ms = h.MechanismStandard(name, 3)
+                _variables[name] = []
+                for j in range(int(ms.count())):
+                    var = h.ref('')
+                    ms.name(var, j)
+                    _variables[name].append(var[0])
+
+    return _variables
+
+
+
+
+def state_key(model_data, cell_index, v_init = -80, settle_t = 1000):
+    '''
+    Gets the hash of everything that determines the resting state of a model.
+
+    INPUT(S):
+        - model_data: model paramaters (specification and cell type) [dict]
+        - cell_index: cell specification in the library [int]
+        - v_init: membrane potential from which the model settles (in mV)
+            (default -80) [number]
+        - settle_t: time for which the model settles (in ms) (default 1000)
+            [number]
+
+    OUTPUT(S):
+        - key: hash of the resting state [str]
+    '''
+
+    specs = model_data['specs']
+    model_set = registry.load_library(specs['lib'])[cell_index]
+
+    spec = {'variables':model_set['variables'],
+            'files':{key:rc.file_digest(specs[key]) for key in ['par', 'morph']},
+            'mechanisms':rc.code_version(files=['MSN_builder.py', 'morphology_cache.py', 'steady_state.py']),
+            'v_init':v_init, 'settle_t':settle_t, 'dt':h.dt, 'celsius':h.celsius}
+
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=rc._to_json).encode()).hexdigest()
+
+
+
+
+class SteadyState():
+    '''
+    The resting state of a cell, from which simulations of the cell can be
+    initialised (see initialise). The cell must not have been given any
+    inputs when the state is found (see find).
+    '''
+
+    def __init__(self, cell, values):
+        '''
+        INPUT(S):
+            - cell: cell whose state it is [MSN object]
+            - values: values of the state variables of each segment, keyed by
+                section and variable [dict of dicts of numpy arrays]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.cell = cell
+        self.values = values
+
+
+    @staticmethod
+    def capture(cell):
+        '''
+        Gets the current values of the state variables of every segment of a
+        cell.
+
+        INPUT(S):
+            - cell: cell [MSN object]
+
+        OUTPUT(S):
+            - values: values of the state variables of each segment, keyed by
+                section and variable [dict of dicts of numpy arrays]
+        '''
+
+        variables = mechanism_variables()
+
+        values = {}
+        for sec in cell.allseclist:
+            sec_vars = ['v']
+            for mech, mech_vars in variables.items():
+                if mech_vars and h.ismembrane(mech, sec=sec):
+                    sec_vars += mech_vars
+            values[sec.name()] = {var: np.array([getattr(seg, var) for seg in sec]) for var in sec_vars}
+
+        return values
+
+
+    @classmethod
+    def find(cls, cell, v_init = -80, settle_t = 1000):
+        '''
+        Finds the resting state of a cell, by simulating it (with adaptive
+        time steps) from a uniform membrane potential until it has settled.
+
+        INPUT(S):
+            - cell: cell without inputs [MSN object]
+            - v_init: membrane potential from which the cell settles (in mV)
+                (default -80) [number]
+            - settle_t: time for which the cell settles (in ms) (default 1000)
+                [number]
+
+        OUTPUT(S):
+            - state: resting state of the cell [SteadyState]
+        '''
+
+        cvode = h.CVode()
+        active = cvode.active()
+        cvode.active(1)
+
+        h.finitialize(v_init)
+        cf.run_until(settle_t, True)
+        state = cls(cell, cls.capture(cell))
+
+        cvode.active(active)
+
+        return state
+
+
+    def initialise(self, start = 0, cvode = False):
+        '''
+        Sets the cell to its resting state at a given time. Must be called
+        after h.finitialize(), which initialises the inputs of the simulation
+        (e.g. their first events) as for a simulation starting at 0 ms, so
+        inputs should not start before the given time.
+
+        INPUT(S):
+            - start: time at which the simulation starts (in ms) (default 0)
+                [number]
+            - cvode: whether adaptive time steps are used (default False)
+                [bool]
+
+        OUTPUT(S):
+            None
+        '''
+
+        for sec in self.cell.allseclist:
+            for var, x in self.values[sec.name()].items():
+                for seg, value in zip(sec, x):
+                    setattr(seg, var, value)
+
+        h.t = start
+        h.fcurrent()
+        if cvode:
+            h.CVode().re_init()
+        h.frecord_init() # recordings start from the restored state
+
+
+
+
+def get_state(cell, model_data, cell_index, folder = None, v_init = -80, settle_t = 1000):
+    '''
+    Gets the resting state of a model, finding it only if it has not been
+    found (in this process, or saved in the folder) before.
+
+    INPUT(S):
+        - cell: cell of the model, without inputs [MSN object]
+        - model_data: model paramaters (specification and cell type) [dict]
+        - cell_index: cell specification in the library [int]
+        - folder: folder in which resting states are saved; if None, states
+            are only kept for the process (default None) [str]
+        - v_init: membrane potential from which the model settles (in mV)
+            (default -80) [number]
+        - settle_t: time for which the model settles (in ms) (default 1000)
+            [number]
+
+    OUTPUT(S):
+        - state: resting state of the cell [SteadyState]
+    '''
+
+    key = state_key(model_data, cell_index, v_init, settle_t)
+
+    if key in _states:
+        return SteadyState(cell, _states[key])
+
+    path = os.path.join(folder, key + '.pkl') if folder else None
+    values = None
+    if path:
+        try:
+            with open(path, 'rb') as f:
+                values = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            pass
+
+    if values is None:
+        values = SteadyState.find(cell, v_init, settle_t).values
+        if path:
+            os.makedirs(folder, exist_ok=True)
+            temp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp_path, 'wb') as f:
+                pickle.dump(values, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+
+    _states[key] = values
+
+    return SteadyState(cell, values)
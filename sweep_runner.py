@@ -0,0 +1,492 @@
+'''
+Resumable sweeps of simulation jobs.
+
+The master rank keeps an append-only ledger (ledger.jsonl, one json record per
+line) of the jobs of a sweep that have been submitted and completed, and the
+results of each completed job (one pickle per job). If a run is killed partway
+through (e.g. at the wall-clock limit of a cluster job), running the same sweep
+again skips the jobs already completed, reloading their results, and submits
+only the missing jobs. As the results of every job are then written to disk,
+ledgers are only kept on disk when resuming is requested (otherwise jobs are
+only tracked in memory).
+
+A ledger is only resumed by the same sweep (the same jobs, with the same
+arguments, and the same simulation code; see sweep_key); a different sweep in
+the same folder starts a new ledger.
+
+Jobs are submitted longest first (given an estimate of the cost of each job;
+see JobTimings), so that the last jobs to finish are short ones, rather than
+a few long jobs keeping the run going while most ranks are idle. The duration
+of each job is recorded in the ledger and given with its results.
+
+Jobs can also be submitted in batches (e.g. several rounds of the same model),
+each run by one task, so that the overhead of a task (sending its arguments
+and results, building the cell) is paid once per batch rather than once per
+job.
+'''
+
+import json
+import os
+import pickle
+import shutil
+import time
+import numpy                as np
+import result_cache         as rc
+
+
+
+def sweep_key(jobs):
+    '''
+    Gets the hash of a sweep: its jobs (and their arguments) and the version of
+    the simulation code.
+
+    INPUT(S):
+        - jobs: arguments of each job, keyed by job id [dict of tuples]
+
+    OUTPUT(S):
+        - key: hash of the sweep [str]
+    '''
+
+    return rc.job_key({'jobs':{str(job):args for job, args in jobs.items()}, 'code':rc.code_version()})
+
+
+
+
+class JobLedger():
+    '''
+    Append-only ledger of the jobs of a sweep, with the results of each
+    completed job, kept in a folder.
+    '''
+
+    def __init__(self,  folder,
+                        key,
+                        resume=True):
+        '''
+        INPUT(S):
+            - folder: folder of the ledger [str]
+            - key: hash of the sweep (see sweep_key) [str]
+            - resume: whether the ledger is kept in the folder, so that the
+                sweep can be resumed, and a ledger of the same sweep already in
+                the folder is resumed. If the ledger in the folder is of a
+                different sweep, it is removed and a new ledger started. If
+                False, any ledger in the folder is removed, and jobs are only
+                tracked in memory (their results are not written to disk)
+                (default True) [bool]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.folder = folder
+        self.key = key
+        self.resume = resume
+        self.submitted = set()
+        self.completed = set()
+        self.durations = {}
+        self._path = os.path.join(folder, 'ledger.jsonl')
+
+        records = self._read() if resume else []
+        if records and records[0].get('sweep') == key:
+            for record in records[1:]:
+                if record['event'] == 'submitted':
+                    self.submitted.add(record['job'])
+                elif record['event'] == 'completed' and os.path.isfile(self._result_path(record['job'])):
+                    self.completed.add(record['job'])
+                    self.durations[record['job']] = record.get('duration')
+        else:
+            self.clear()
+            if resume:
+                os.makedirs(folder)
+            self._append({'sweep':key, 'time':time.time()})
+
+
+    def pending(self, jobs):
+        '''
+        Gets the jobs that have not been completed.
+
+        INPUT(S):
+            - jobs: ids of the jobs of the sweep [list]
+
+        OUTPUT(S):
+            - pending: ids of the jobs not completed [list]
+        '''
+
+        return [job for job in jobs if job not in self.completed]
+
+
+    def submit(self, job):
+        '''
+        Records that a job has been submitted.
+
+        INPUT(S):
+            - job: id of the job [int or str]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.submitted.add(job)
+        self._append({'event':'submitted', 'job':job, 'time':time.time()})
+
+
+    def complete(self, job, data, duration=None):
+        '''
+        Stores the results of a job and records that it has been completed
+        (only once its results are safely on disk, if the ledger is kept on
+        disk).
+
+        INPUT(S):
+            - job: id of the job [int or str]
+            - data: results of the job [dict]
+            - duration: time taken to run the job (in s) (default None)
+                [float]
+
+        OUTPUT(S):
+            None
+        '''
+
+        if self.resume:
+            path = self._result_path(job)
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+
+        self.completed.add(job)
+        self.durations[job] = duration
+        self._append({'event':'completed', 'job':job, 'duration':duration, 'time':time.time()})
+
+
+    def load(self, job):
+        '''
+        Gets the results of a completed job.
+
+        INPUT(S):
+            - job: id of the job [int or str]
+
+        OUTPUT(S):
+            - data: results of the job [dict]
+        '''
+
+        with open(self._result_path(job), 'rb') as f:
+            return pickle.load(f)
+
+
+    def clear(self):
+        '''
+        Removes the ledger and the results stored with it (e.g. once the results
+        of the sweep have been saved).
+        '''
+
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+        self.submitted = set()
+        self.completed = set()
+        self.durations = {}
+
+
+    def _read(self):
+        '''
+        Reads the records of the ledger (ignoring a last record cut short when
+        a run was killed).
+        '''
+
+        records = []
+        if os.path.isfile(self._path):
+            with open(self._path) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+
+        return records
+
+
+    def _append(self, record):
+        '''
+        Appends a record to the ledger, making sure it is on disk (if the
+        ledger is kept on disk).
+        '''
+
+        if not self.resume:
+            return
+
+        with open(self._path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def _result_path(self, job):
+
+        return os.path.join(self.folder, 'job_{}.pkl'.format(job))
+
+
+
+
+class JobTimings():
+    '''
+    Durations of jobs in previous runs, kept in a json file, from which the
+    cost of jobs is estimated. Jobs are identified by a key of what determines
+    their cost (e.g. the model and simulation options, but not the round or
+    seed), and may be given a size (e.g. the number of conditions simulated)
+    from which the cost of jobs not yet timed is estimated. The overhead of
+    tasks running batches of jobs is also kept, from which the size of batches
+    is chosen.
+    '''
+
+    def __init__(self, path='temp_data/job_timings.json'):
+        '''
+        INPUT(S):
+            - path: path to the file of timings [str]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.path = path
+        self.timings = {}
+        self.overheads = []
+        if os.path.isfile(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.timings = saved['jobs']
+            self.overheads = saved['overheads']
+
+
+    def estimate(self, keys, sizes={}):
+        '''
+        Estimates the cost of jobs: the latest duration of each job timed
+        before, otherwise its size times the median duration per unit of size
+        of the jobs timed before (or just its size, if no jobs have been
+        timed).
+
+        INPUT(S):
+            - keys: key of each job, keyed by job id [dict of str]
+            - sizes: size of each job, keyed by job id (default 1 for every
+                job) [dict of numbers]
+
+        OUTPUT(S):
+            - costs: estimated cost of each job, keyed by job id [dict of
+                floats]
+        '''
+
+        rates = [timing['duration']/timing['size'] for timing in self.timings.values() if timing['size'] > 0]
+        rate = float(np.median(rates)) if rates else 1.0
+
+        costs = {}
+        for job, key in keys.items():
+            if key in self.timings:
+                costs[job] = self.timings[key]['duration']
+            else:
+                costs[job] = sizes.get(job, 1)*rate
+
+        return costs
+
+
+    def record(self, key, duration, size=1):
+        '''
+        Records the duration of a job (replacing any earlier duration of the
+        job).
+
+        INPUT(S):
+            - key: key of the job [str]
+            - duration: time taken to run the job (in s) [float]
+            - size: size of the job (default 1) [number]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.timings[key] = {'duration':duration, 'size':size}
+
+
+    def record_overhead(self, overhead):
+        '''
+        Records the overhead of a task (keeping the latest 100).
+
+        INPUT(S):
+            - overhead: time taken by a task other than running its jobs (in
+                s) [float]
+
+        OUTPUT(S):
+            None
+        '''
+
+        self.overheads = self.overheads[-99:] + [overhead]
+
+
+    def batch_size(self, n_jobs, n_workers, tolerance=0.05, min_batches=2):
+        '''
+        Chooses the number of jobs run by each task: the smallest number for
+        which the overhead of a task is at most a given fraction of the time
+        taken to run its jobs, but small enough that every worker is given
+        several tasks (to balance the load). If no overhead has been recorded,
+        batches of 2 jobs are used, from which the overhead is measured.
+
+        INPUT(S):
+            - n_jobs: number of jobs to be run [int]
+            - n_workers: number of workers running the jobs [int]
+            - tolerance: largest fraction of the time taken to run the jobs of
+                a task spent on its overhead (default 0.05) [float]
+            - min_batches: smallest number of tasks given to each worker
+                (default 2) [int]
+
+        OUTPUT(S):
+            - batch_size: number of jobs run by each task [int]
+        '''
+
+        largest = max(1, n_jobs // (min_batches*n_workers))
+
+        durations = [timing['duration'] for timing in self.timings.values()]
+        if not durations or not self.overheads:
+            return min(2, largest)
+
+        overhead = max(float(np.median(self.overheads)), 0)
+        size = int(np.ceil(overhead / (tolerance*float(np.median(durations)))))
+
+        return int(np.clip(size, 1, largest))
+
+
+    def save(self):
+        '''
+        Writes the timings to their file.
+        '''
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'jobs':self.timings, 'overheads':self.overheads}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+
+
+def _run_job(job, func, args):
+    '''
+    Runs a job, returning its id and duration with its results (so that
+    results gathered from an executor can be matched to their job). Jobs whose
+    results were loaded from a result cache (see
+    simulation_functions.run_cached) are not timed (duration None).
+    '''
+
+    start = time.time()
+    data = func(*args)
+    duration = time.time() - start
+
+    if isinstance(data, dict) and data.get('meta', {}).get('cached', False):
+        duration = None
+
+    return job, data, duration
+
+
+
+
+def _run_batch(batch, func, args):
+    '''
+    Runs a batch of jobs in one task (see _run_job).
+    '''
+
+    return [_run_job(job, func, job_args) for job, job_args in zip(batch, args)]
+
+
+
+
+def make_batches(jobs, batch_size=1, groups=None):
+    '''
+    Splits jobs into batches of (at most) a given size, each only of jobs of
+    the same group (e.g. rounds of the same model, which can then be run on
+    the same cell). The order of the jobs is kept within each group, and
+    groups are in the order of their first job.
+
+    INPUT(S):
+        - jobs: ids of the jobs [list]
+        - batch_size: largest number of jobs in a batch (default 1) [int]
+        - groups: group of each job, keyed by job id. If None, all jobs are in
+            one group (default None) [dict]
+
+    OUTPUT(S):
+        - batches: ids of the jobs of each batch [list of lists]
+    '''
+
+    grouped = {}
+    for job in jobs:
+        grouped.setdefault(groups[job] if groups is not None else None, []).append(job)
+
+    return [members[i:i+batch_size] for members in grouped.values() for i in range(0, len(members), batch_size)]
+
+
+
+
+def run_sweep(executor, func, jobs, ledger, costs=None, batch_size=1, groups=None, timings=None):
+    '''
+    Runs the jobs of a sweep not completed in the ledger with an executor
+    (see executors), recording each job in the ledger. Jobs are submitted in
+    batches (see make_batches), in order of their estimated cost, longest
+    first. The results of the jobs completed in an earlier run are given
+    first, then those of the other jobs as they finish.
+
+    INPUT(S):
+        - executor: executor running the jobs (e.g. from
+            executors.get_executor) [executor]
+        - func: function simulating a job (must be defined at the top level of
+            a module, to be submitted to the executor) [function]
+        - jobs: (positional) arguments of func for each job, keyed by job id
+            (ints or strs) [dict of tuples]
+        - ledger: ledger of the sweep [JobLedger]
+        - costs: estimated cost of each job, keyed by job id (e.g. from
+            JobTimings.estimate). If None, jobs are run in the order given
+            (default None) [dict of numbers]
+        - batch_size: largest number of jobs run by one task (default 1)
+            [int]
+        - groups: group of each job (only jobs of the same group are run by
+            the same task), keyed by job id (default None) [dict]
+        - timings: timings in which the overhead of tasks is recorded
+            (default None) [JobTimings]. The overhead of a task is measured as
+            the time from its submission until its results are gathered (which
+            includes sending its arguments and results), less the time taken
+            to run its jobs without building the cell (i.e. the extra time
+            taken by its first job is also overhead). It is only measured for
+            the first tasks given to the workers, which start as soon as they
+            are submitted, and only if none of the jobs of the task were
+            loaded from a result cache.
+
+    OUTPUT(S):
+        - results: job id, results, and duration (time taken to run the job,
+            in s; None if not recorded, or if the results were loaded from a
+            result cache) of each job [generator of tuples]
+    '''
+
+    pending = ledger.pending(list(jobs.keys()))
+    if costs is not None:
+        pending.sort(key=lambda job: -costs[job]) # longest first (keeping the order of jobs of equal cost)
+    if len(pending) < len(jobs):
+        print('Resuming sweep: {} of {} jobs already completed'.format(len(jobs)-len(pending), len(jobs)), \
+              flush=True)
+
+    for job in jobs:
+        if job not in pending:
+            yield job, ledger.load(job), ledger.durations.get(job)
+
+    batches = make_batches(pending, batch_size, groups)
+    if costs is not None:
+        batches.sort(key=lambda batch: -sum(costs[job] for job in batch))
+
+    submitted = {} # time each of the first tasks given to the workers was submitted, keyed by its first job
+    for batch in batches: # scatter processes
+        for job in batch:
+            ledger.submit(job)
+        if len(submitted) < executor.n_workers:
+            submitted[batch[0]] = time.time()
+        executor.submit(_run_batch, batch, func, [jobs[job] for job in batch])
+
+    for results in executor.gather(): # gather results
+        wall = time.time() - submitted.pop(results[0][0], np.nan)
+        durations = [duration for job, data, duration in results]
+        if timings is not None and not np.isnan(wall) and None not in durations:
+            build = durations[0] - float(np.median(durations[1:])) if len(durations) > 1 else 0
+            timings.record_overhead(wall - sum(durations) + build)
+        for job, data, duration in results:
+            ledger.complete(job, data, duration)
+            yield job, data, duration
@@ -0,0 +1,196 @@
+'''
+Time courses of modulation (transients), to be played into mechanisms (see
+h.Vector.play and modulation_lib).
+
+Each shape is evaluated on the whole array of time points at once, and the
+vector to play is filled from the array directly, rather than being built from
+a list with one function call per time step. Vectors are cached (by shape,
+parameters, time step, and duration), so the same vector is shared by every
+reference it is played into, and by every simulation in the process that
+needs it.
+'''
+
+from   neuron           import h
+import numpy                as np
+import common_functions     as cf
+
+
+
+# vectors built in this process; keyed by (shape, parameters, dt, tstop)
+_vectors = {}
+
+
+
+
+def step(tm, start, stop=np.inf, gmax=1):
+    '''
+    Step from 0 to gmax, from start until stop (both inclusive).
+
+    INPUT(S):
+        - tm: time points (in ms) [numpy array]
+        - start: time of the onset of the step (in ms) [number]
+        - stop: time of the end of the step (in ms) (default inf; the step
+            does not end) [number]
+        - gmax: amplitude of the step (default 1) [number]
+
+    OUTPUT(S):
+        - values: value at each time point [numpy array]
+    '''
+
+    return np.where((tm >= start) & (tm <= stop), gmax, 0.)
+
+
+
+
+def alpha(tm, start, gmax=1, tau=500):
+    '''
+    Alpha function (see common_functions.alpha), from start (0 before).
+
+    INPUT(S):
+        - tm: time points (in ms) [numpy array]
+        - start: time of the onset of the transient (in ms) [number]
+        - gmax: peak of the transient (default 1) [number]
+        - tau: time constant of the transient (in ms) (default 500) [number]
+
+    OUTPUT(S):
+        - values: value at each time point [numpy array]
+    '''
+
+    values = np.zeros(len(tm))
+    after = tm >= start
+    values[after] = cf.alpha(tm[after], start, gmax, tau)
+
+    return values
+
+
+
+
+def sigmoid(tm, start, const=0, gmax=1, slope=-5):
+    '''
+    Sigmoid from const to const+gmax, centred on start (see
+    common_functions.sigmoid).
+
+    INPUT(S):
+        - tm: time points (in ms) [numpy array]
+        - start: time of the midpoint of the transient (in ms) [number]
+        - const: value before the transient (default 0) [number]
+        - gmax: amplitude of the transient (default 1) [number]
+        - slope: steepness of the transient; if positive, the transient is
+            from const+gmax to const instead (default -5) [number]
+
+    OUTPUT(S):
+        - values: value at each time point [numpy array]
+    '''
+
+    with np.errstate(over='ignore'): # far from the midpoint, the exponential is inf (and the value const)
+        return cf.sigmoid(tm, start, const, gmax, slope)
+
+
+
+
+def ramp(tm, start, stop, gmax=1):
+    '''
+    Linear ramp from 0 at start to gmax at stop (and gmax after).
+
+    INPUT(S):
+        - tm: time points (in ms) [numpy array]
+        - start: time at which the ramp starts (in ms) [number]
+        - stop: time at which the ramp reaches gmax (in ms) [number]
+        - gmax: value at the end of the ramp (default 1) [number]
+
+    OUTPUT(S):
+        - values: value at each time point [numpy array]
+    '''
+
+    return gmax * np.clip((tm-start)/(stop-start), 0, 1)
+
+
+
+
+def piecewise(tm, times, values):
+    '''
+    Piecewise linear transient through the given points (the first and last
+    values are held before and after them).
+
+    INPUT(S):
+        - tm: time points (in ms) [numpy array]
+        - times: times of the points, in ascending order (in ms) [list of
+            numbers]
+        - values: values at the points [list of numbers]
+
+    OUTPUT(S):
+        - values: value at each time point [numpy array]
+    '''
+
+    return np.interp(tm, times, values)
+
+
+
+
+SHAPES = {'step':step, 'alpha':alpha, 'sigmoid':sigmoid, 'ramp':ramp, 'piecewise':piecewise}
+
+
+
+
+def transient(shape, tstop, dt=None, **params):
+    '''
+    Evaluates a transient at every time step from 0 until tstop.
+
+    INPUT(S):
+        - shape: shape of the transient (a key of SHAPES) [str]
+        - tstop: time until which the transient is evaluated (not included;
+            in ms) [number]
+        - dt: time step (in ms); if None, h.dt (default None) [number]
+        - params: parameters of the shape (e.g. start=100, stop=250)
+
+    OUTPUT(S):
+        - values: value at each time step [numpy array]
+    '''
+
+    if shape not in SHAPES:
+        raise ValueError("The transient shape '{}' is not recognised.\nThis should be one of: {}.".format(shape, ', '.join(SHAPES)))
+
+    tm = np.arange(0, tstop, h.dt if dt is None else dt)
+
+    return SHAPES[shape](tm, **params)
+
+
+
+
+def get_vector(shape, tstop, dt=None, **params):
+    '''
+    Gets a vector of a transient (see transient) to be played, built only if
+    the same transient has not been built in this process before. The vector
+    is shared by every caller, so should not be modified.
+
+    INPUT(S):
+        - shape: shape of the transient (a key of SHAPES) [str]
+        - tstop: time until which the transient is evaluated (not included;
+            in ms) [number]
+        - dt: time step (in ms); if None, h.dt (default None) [number]
+        - params: parameters of the shape (e.g. start=100, stop=250)
+
+    OUTPUT(S):
+        - vec: value at each time step [h.Vector]
+    '''
+
+    dt = h.dt if dt is None else dt
+    key = (shape, tuple(sorted((name, tuple(np.ravel(value))) for name, value in params.items())), dt, tstop)
+
+    if key not in _vectors:
+        values = transient(shape, tstop, dt, **params)
+        vec = h.Vector(len(values))
+        vec.as_numpy()[:] = values # filled in place, without an intermediate list
+        _vectors[key] = vec
+
+    return _vectors[key]
+
+
+
+
+def clear():
+    '''
+    Removes all cached vectors.
+    '''
+
+    _vectors.clear()
@@ -64,7 +64,7 @@ if input_type == 'clustered':
     vis_cmap = lsc.from_list('my_cmap',['black','red'])
     for i, tar in enumerate(vis_info['clustered']['target']):
         if tar[:4] == 'dend':
-            h.dend[int(tar[5:-1])](.5).v = 35
+            cell.name2sec[tar](.5).v = 35
         elif tar[:4] == 'soma':
             soma_col = 'red' # highlight soma if targeted by input
         else:
@@ -77,7 +77,7 @@ if input_type == 'HFI':
     vis_cmap = lsc.from_list('my_cmap',['black','green'])
     for i, tar in enumerate(vis_info['stim']['target']):
         if tar[:4] == 'dend':
-            h.dend[int(tar[5:-1])](.5).v = 35
+            cell.name2sec[tar](.5).v = 35
         elif tar[:4] == 'soma':
             soma_col = 'green'
         else:
@@ -90,29 +90,28 @@ if input_type == 'ACh':
     vis_cmap = lsc.from_list('my_cmap',['black','cyan'])
     for i, tar in enumerate(vis_info['clustered']['target']):
         if tar[:4] == 'dend':
-            h.dend[int(tar[5:-1])](.5).v = 35
+            cell.name2sec[tar](.5).v = 35
         elif tar[:4] == 'soma':
             soma_col = 'red' # highlight soma if targeted by input
         else:
             raise ValueError("Trying to visualise input to '{}', but only visualisation of input to 'dend' and 'soma' currently supported".format(tar[:4]))
     for i, tar in enumerate(vis_info['ACh']['target']):
         if tar[:4] == 'dend':
-            h.dend[int(tar[5:-1])](.5).v = 35
+            cell.name2sec[tar](.5).v = 35
         elif tar[:4] == 'soma':
             soma_col = 'cyan'
         elif tar[:4] == 'axon':
-            h.axon[int(tar[5:-1])](.5).v = 35
+            cell.name2sec[tar](.5).v = 35
 
 # visualisation ==========
 
 # plots dendrites
 '''
-sections = h.SectionList([sec for sec in h.allsec() if 'dend' in str(sec)])
-ps = h.PlotShape(sections,False).plot(plt)
-ps._do_plot(0,1,h.dend,'v',cmap=vis_cmap)
+ps = h.PlotShape(cell.dendlist,False).plot(plt)
+ps._do_plot(0,1,cell.dendlist,'v',cmap=vis_cmap)
 '''
-ps = h.PlotShape(h.SectionList(),False).plot(plt)
-ps._do_plot(0,1,h.allsec(),'v',cmap=vis_cmap)
+ps = h.PlotShape(cell.allseclist,False).plot(plt)
+ps._do_plot(0,1,cell.allseclist,'v',cmap=vis_cmap)
 
 
 # Make sphere to mimic soma